@@ -13,7 +13,8 @@ matching m/z and retention time (within a tolerance) in both polarities,
 the one with the lowest total intensity mean is discarded. This default
 behavior can be changed to the combination (sum) of the intensities of
 both features. Additionally, a log file is created to keep track of the
-matches found.
+matches found. Several batches of each polarity can be amalgamated in a
+single pass with amalgamate_batches().
 
 Examples:
     >>> import pandas
@@ -23,39 +24,39 @@ Examples:
     >>> posData = pandas.read_csv('peakfilter_positive.csv')
     >>> parameters = LFParameters('amalgamator', 'parameters.json')
     >>> Amalgamator.amalgamate_data(negData, posData, parameters)
+    >>> Amalgamator.amalgamate_batches([negData, negData2],
+    ...                                [posData, posData2], parameters)
 """
 
-import logging
-from math import sqrt
 import os
 import warnings
 
 import numpy
 import pandas
 
-from LipidFinder.LFDataFrame import LFDataFrame
-from LipidFinder._utils import mz_delta, mz_tol_range, rt_delta, rt_tol_range, \
-                               print_progress_bar
+from LipidFinder.LFProfiler import LFProfiler
+from LipidFinder.LFRunContext import LFRunContext
+from LipidFinder._utils import mz_delta, mz_tol_range, nonzero_mean, \
+                               print_progress_bar, rt_delta, rt_tol_range
 
 
 # Ignore Future Warnings from pandas library
 warnings.simplefilter(action='ignore', category=FutureWarning)
-# Calculate the mass differences produced by the protonation:
-# Proton (H) mass
-PROTON = 1.00727646
-# Hydrogen (H2) mass
-HYDROGEN = 2 * PROTON
-# Electron mass = 0.00054858 (source:
+# The mass differences between polarities are read from the CSV file
+# of the 'offsetsCSVPath' parameter. The default ones (in
+# Data/polarity_offsets.csv) are produced by the protonation:
+#   [M-H]- vs [M+H]+: H2 mass = 2 * proton (1.00727646) = 2.01455292
+#   [M-CH3]- vs [M+H]+: CH4 mass = proton + [CH3]- = 16.030203
+# where [CH3]- mass = 1 * C12 + 3 * H + 2 * electron = 15.02292654,
+# with C12 = 12 and electron = 0.00054858 (source:
 # http://fiehnlab.ucdavis.edu/staff/kind/Metabolomics/MS-Adduct-Calculator)
-# Carbon 12 mass = 12
-# [CH3]- mass = 1 * C12 + 3 * H + 2 * electron
-METHYL_ANION = 15.02292654
-# CH4 mass = H + [CH3]-
-METHANE = PROTON + METHYL_ANION
+# Number of output rows written to the CSV file at a time
+CHUNK_SIZE = 50000
 
 
-def amalgamate_data(negData, posData, parameters, dst=''):
-    # type: (object, object, LFParameters, str) -> None
+def amalgamate_data(negData, posData, parameters, dst='', profile=False,
+                    traceMemory=False, offsets=None):
+    # type: (object, object, LFParameters, str, bool, bool, list) -> None
     """Amalgamate negative and positive ion polarity dataframes.
 
     'negData' and 'posData' have to match the same column layout as the
@@ -65,191 +66,400 @@ def amalgamate_data(negData, posData, parameters, dst=''):
     the same column headings. If 'dst' is not an absolute path, the
     current working directory will be used as starting point. If
     "amalgamated.csv" file already exists, it will be overwritten.
+    If 'profile' is True, the time and memory profile of each stage is
+    written in the log file and saved in "amalgamator_profile.json".
 
     Keyword Arguments:
-        negData    -- negative polarity LFDataFrame or pandas.DataFrame
-                      instance
-        posData    -- positive polarity LFDataFrame or pandas.DataFrame
-                      instance
-        parameters -- LipidFinder's Amalgamator parameters instance
-        dst        -- destination directory where the log file and the
-                      amalgamated data CSV file will be saved
-                      [default: current working directory]
+        negData     -- negative polarity LFDataFrame or pandas.DataFrame
+                       instance
+        posData     -- positive polarity LFDataFrame or pandas.DataFrame
+                       instance
+        parameters  -- LipidFinder's Amalgamator parameters instance
+        dst         -- destination directory where the log file and the
+                       amalgamated data CSV file will be saved
+                       [default: current working directory]
+        profile     -- record the time and memory profile of each
+                       stage? [default: False]
+        traceMemory -- trace the memory allocated by each stage (slow)?
+                       [default: False]
+        offsets     -- mass differences between both polarities, in
+                       order of priority [default: offsets in
+                       'offsetsCSVPath' parameter's file]
+    """
+    amalgamate_batches([negData], [posData], parameters, dst, profile,
+                       traceMemory, offsets)
+
+
+def amalgamate_batches(negBatches, posBatches, parameters, dst='',
+                       profile=False, traceMemory=False, offsets=None):
+    # type: (list, list, LFParameters, str, bool, bool, list) -> None
+    """Amalgamate several batches of negative and positive ion polarity
+    dataframes in a single pass.
+
+    Every batch has to match the same column layout as the output files
+    from LipidFinder's PeakFilter module. The batches of each polarity
+    are matched as a whole, following their order in the list, so the
+    result is the same as amalgamating the concatenation of the
+    negative batches with the concatenation of the positive ones. The
+    merged result is written to "amalgamated.csv" in chunks, but every
+    batch is held in memory for the whole run (a match can involve any
+    two batches), so the batches together must fit in memory. If 'dst'
+    is not an absolute path, the current working directory will be
+    used as starting point. If 'profile' is True, the time and memory
+    profile of each stage is written in the log file and saved in
+    "amalgamator_profile.json".
+
+    Keyword Arguments:
+        negBatches  -- list of negative polarity LFDataFrame or
+                       pandas.DataFrame instances
+        posBatches  -- list of positive polarity LFDataFrame or
+                       pandas.DataFrame instances
+        parameters  -- LipidFinder's Amalgamator parameters instance
+        dst         -- destination directory where the log file and the
+                       amalgamated data CSV file will be saved
+                       [default: current working directory]
+        profile     -- record the time and memory profile of each
+                       stage? [default: False]
+        traceMemory -- trace the memory allocated by each stage (slow)?
+                       [default: False]
+        offsets     -- mass differences between both polarities, in
+                       order of priority [default: offsets in
+                       'offsetsCSVPath' parameter's file]
     """
     # Set the log file where the information about the steps performed
     # is saved
     logFilePath = 'amalgamator.log'
     if (dst):
         logFilePath = os.path.join(dst, logFilePath)
-    # Create logger and its file handler
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(logFilePath)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('[%(asctime)s] %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    with LFRunContext(logFilePath) as context, \
+            LFProfiler(profile or traceMemory, traceMemory) as profiler:
+        _amalgamate_batches(negBatches, posBatches, parameters, dst,
+                            context.logger, profiler, offsets)
+        profiler.log_summary(context.logger)
+        profiler.write_json(os.path.join(dst, 'amalgamator_profile.json'),
+                            'Amalgamator')
+
+
+def _amalgamate_batches(negBatches, posBatches, parameters, dst, logger,
+                        profiler, offsets=None):
+    # type: (list, list, LFParameters, str, Logger, LFProfiler, list)
+    #       -> None
+    """Amalgamate several batches of negative and positive ion polarity
+    dataframes, writing the information about the steps performed in
+    'logger'.
+
+    Keyword Arguments:
+        negBatches -- list of negative polarity LFDataFrame or
+                      pandas.DataFrame instances
+        posBatches -- list of positive polarity LFDataFrame or
+                      pandas.DataFrame instances
+        parameters -- LipidFinder's Amalgamator parameters instance
+        dst        -- destination directory where the amalgamated data
+                      CSV file will be saved
+        logger     -- logger of the run
+        profiler   -- LFProfiler instance of the run
+        offsets    -- mass differences between both polarities, in order
+                      of priority [default: offsets in 'offsetsCSVPath'
+                      parameter's file]
+    """
+    if (offsets is None):
+        offsets = pandas.read_csv(parameters['offsetsCSVPath'])[
+                'Mass Offset'].values
+    batches = list(negBatches) + list(posBatches)
+    numNegRows = sum(len(x.index) for x in negBatches)
+    numPosRows = sum(len(x.index) for x in posBatches)
     # Write initial information in log file
     logger.info(("Starting Amalgamator. Negative dataframe has %d rows and "
-                  "Positive dataframe has %d rows."), len(negData.index),
-                 len(posData.index))
+                  "Positive dataframe has %d rows."), numNegRows, numPosRows)
+    isBatchRun = (len(negBatches) > 1) or (len(posBatches) > 1)
+    if (isBatchRun):
+        logger.info("Amalgamating %d negative and %d positive batches.",
+                    len(negBatches), len(posBatches))
     mzCol = parameters['mzCol']
     rtCol = parameters['rtCol']
-    # Check if columns in both dataframes are the same
-    if (set(negData.columns) != set(posData.columns)):
-        diffCols = set(negData.columns).symmetric_difference(posData.columns)
-        raise IOError(("Input dataframes do not share the same column names: "
-                       "{0}").format(', '.join(diffCols)))
+    # Check if columns in every dataframe are the same
+    for data in batches[1:]:
+        if (set(batches[0].columns) != set(data.columns)):
+            diffCols = set(batches[0].columns).symmetric_difference(
+                    data.columns)
+            raise IOError(("Input dataframes do not share the same column "
+                           "names: {0}").format(', '.join(diffCols)))
     # Check for misspelling errors in m/z or retention time column names
-    if ((mzCol not in negData.columns) or (rtCol not in negData.columns)):
+    if ((mzCol not in batches[0].columns) or (rtCol not in batches[0].columns)):
         raise KeyError("Missing '{0}' or '{1}' column(s)".format(mzCol, rtCol))
     # Get the indices for intensity columns
     firstIndex = parameters['firstSampleIndex'] - 1
     lastIndex = firstIndex + parameters['numSamples']
+    profiler.start('Intensity means', numNegRows + numPosRows)
     # Calculate the mean of every non-zero value of the mean columns of
-    # each input dataframe and round it to the nearest integer. Replace
-    # any NaN output from mean() by zero.
-    totalMean = lambda x: numpy.rint(numpy.nan_to_num(
-            x[numpy.where(x>0)[0]].mean())).astype(int)
-    negData['TotalMean'] = negData.iloc[:, firstIndex : lastIndex].apply(
-            totalMean, axis=1)
-    posData['TotalMean'] = posData.iloc[:, firstIndex : lastIndex].apply(
-            totalMean, axis=1)
-    nind = negData.index.values
-    nmz = negData[mzCol].values
-    nrt = negData[rtCol].values
-    nmeans = negData['TotalMean'].values
-    negCol = list(negData.columns.values)
-    posCol = list(posData.columns.values)
-    # Empty results dataframe
-    results = pandas.DataFrame(columns=negCol)
-    polColIndex = results.columns.get_loc('Polarity')
+    # each input dataframe and round it to the nearest integer
+    means = numpy.rint(numpy.concatenate(
+            [nonzero_mean(data.iloc[:, firstIndex : lastIndex])
+             for data in batches])).astype(int)
+    profiler.stop(numNegRows + numPosRows)
+    profiler.start('Matching', numNegRows + numPosRows)
     # Start progress bar
-    progress = 0
-    total = len(nind) + 1
-    print_progress_bar(progress, total, prefix='Amalgamator progress:')
-    # Loop through indices in negative file
-    for i in nind:
-        # Update progress bar
-        progress += 1
-        print_progress_bar(progress, total, prefix='Amalgamator progress:')
-        negMass = nmz[i]
-        negRT = nrt[i]
-        pmz = posData[mzCol].values
-        prt = posData[rtCol].values
-        pmeans = posData['TotalMean'].values
-        negMassH2 = negMass + HYDROGEN
-        mzRange = mz_tol_range(negMassH2, parameters['mzFixedError'],
-                               parameters['mzPPMError'])
-        rtRange = rt_tol_range(negRT, parameters['maxRTDiffAdjFrame'])
-        matchesH2 = list(numpy.where(
-                (pmz >= mzRange[0]) & (pmz <= mzRange[1]) & (prt >= rtRange[0])
-                & (prt <= rtRange[1]))[0])
-        # First, look for H2 matches
-        if (matchesH2):
-            indMatch = __bestMatch__(matchesH2, negMassH2, pmz, negRT, prt,
-                                     parameters)
-            # Keep the frame with the highest total mean
-            if (pmeans[indMatch] > nmeans[i]):
-                results = results.append(posData.iloc[indMatch],
-                                         ignore_index=True)
-                if (parameters['combineIntensities']):
-                    results.iloc[-1, firstIndex : lastIndex] = \
-                            results.iloc[-1, firstIndex : lastIndex] \
-                            + negData.iloc[i, firstIndex : lastIndex]
-                    results.iloc[-1, polColIndex] += ' (Combined)'
-                else:
-                    results.iloc[-1, polColIndex] += ' (Both)'
-            else:
-                results = results.append(negData.iloc[i], ignore_index=True)
-                if (parameters['combineIntensities']):
-                    results.iloc[-1, firstIndex : lastIndex] = \
-                            results.iloc[-1, firstIndex : lastIndex] \
-                            + posData.iloc[indMatch, firstIndex : lastIndex]
-                    results.iloc[-1, polColIndex] += ' (Combined)'
-                else:
-                    results.iloc[-1, polColIndex] += ' (Both)'
-            logger.info('Match found: Negative ID %d - Positive ID %d.',
-                         negData.iloc[i, 0], posData.iloc[indMatch, 0])
-            # Remove match from positive dataframe, avoiding writing
-            # the action to the log file
-            if (isinstance(posData, LFDataFrame)):
-                super(LFDataFrame, posData).drop(indMatch, inplace=True)
-            else:
-                posData.drop(indMatch, inplace=True)
-            posData.reset_index(inplace=True, drop=True)
-            pmz = posData[mzCol].values
-            prt = posData[rtCol].values
-            pmeans = posData['TotalMean'].values
-            continue
-        # If there are no H2 matches, look for CH4 matches
-        negMassCH4 = negMass + METHANE
-        mzRange = mz_tol_range(negMassCH4, parameters['mzFixedError'],
-                               parameters['mzPPMError'])
-        matchesHCH3 = list(numpy.where(
-                (pmz >= mzRange[0]) & (pmz <= mzRange[1]) & (prt >= rtRange[0])
-                & (prt <= rtRange[1]))[0])
-        if (matchesHCH3):
-            indMatch = __bestMatch__(matchesHCH3, negMassCH4, pmz, negRT, prt,
-                                     parameters)
-            # Keep the frame with the highest total mean
-            if (pmeans[indMatch] > nmeans[i]):
-                results = results.append(posData.iloc[indMatch],
-                                         ignore_index=True)
-                if (parameters['combineIntensities']):
-                    results.iloc[-1, firstIndex : lastIndex] = \
-                            results.iloc[-1, firstIndex : lastIndex] \
-                            + negData.iloc[i, firstIndex : lastIndex]
-                    results.iloc[-1, polColIndex] += ' (Combined)'
-                else:
-                    results.iloc[-1, polColIndex] += ' (Both)'
-            else:
-                results = results.append(negData.iloc[i], ignore_index=True)
-                if (parameters['combineIntensities']):
-                    results.iloc[-1, firstIndex : lastIndex] = \
-                            results.iloc[-1, firstIndex : lastIndex] \
-                            + posData.iloc[indMatch, firstIndex : lastIndex]
-                    results.iloc[-1, polColIndex] += ' (Combined)'
-                else:
-                    results.iloc[-1, polColIndex] += ' (Both)'
+    total = numNegRows + 1
+    print_progress_bar(0, total, prefix='Amalgamator progress:')
+    # Every frame is identified by its position in the concatenation of
+    # all the batches (negative ones first)
+    mz = numpy.concatenate([data[mzCol].values for data in batches])
+    rt = numpy.concatenate([data[rtCol].values for data in batches])
+    negMatches, posMatches = _match_features(
+            mz[:numNegRows], rt[:numNegRows], mz[numNegRows:],
+            rt[numNegRows:], parameters, offsets)
+    posMatches += numNegRows
+    batchIndex = numpy.repeat(numpy.arange(len(batches)),
+                              [len(data.index) for data in batches])
+    rowIndex = numpy.concatenate([numpy.arange(len(data.index))
+                                  for data in batches])
+    ids = numpy.concatenate([data.iloc[:, 0].values for data in batches])
+    for i, j in zip(negMatches, posMatches):
+        if (isBatchRun):
+            logger.info(('Match found: Negative ID %d (batch %d) - Positive '
+                         'ID %d (batch %d).'), ids[i], batchIndex[i] + 1,
+                        ids[j], batchIndex[j] - len(negBatches) + 1)
+        else:
             logger.info('Match found: Negative ID %d - Positive ID %d.',
-                         negData.iloc[i, 0], posData.iloc[indMatch, 0])
-            # Remove match from positive dataframe, avoiding writing
-            # the action to the log file
-            if (isinstance(posData, LFDataFrame)):
-                super(LFDataFrame, posData).drop(indMatch, inplace=True)
-            else:
-                posData.drop(indMatch, inplace=True)
-            posData.reset_index(inplace=True, drop=True)
-            pmz = posData[mzCol].values
-            prt = posData[rtCol].values
-            pmeans = posData['TotalMean'].values
-            continue
-        results = results.append(negData.iloc[i], ignore_index=True)
-    # Append what remains in the positive dataframe (unmatched positive
-    # m/z values)
-    results = results.append(posData, ignore_index=True)
-    if (pandas.__version__ < '0.23.0'):
-        # Fix unexpected column sorting from append() in pandas v0.20.3
-        # or newer (solved in v0.23.0 with argument "sort=False")
-        results = results.reindex(negCol, axis=1)
-    results.drop('TotalMean', axis=1, inplace=True)
-    # Sort results by m/z and retention time and create the CSV file
-    results.sort_values([mzCol, rtCol], inplace=True, kind='mergesort')
-    results.to_csv(os.path.join(dst, 'amalgamated.csv'), index=False)
+                        ids[i], ids[j])
+    profiler.stop(numNegRows + numPosRows)
+    profiler.start('Output', numNegRows + numPosRows)
+    # Every negative frame is kept in its position, replaced by its
+    # positive match if the latter has a higher total mean, and the
+    # unmatched positive frames are appended at the end in their
+    # original order
+    keepPos = means[posMatches] > means[negMatches]
+    unmatched = numpy.ones(numPosRows, dtype=bool)
+    unmatched[posMatches - numNegRows] = False
+    rows = numpy.concatenate((numpy.arange(numNegRows),
+                              numNegRows + numpy.where(unmatched)[0]))
+    rows[negMatches[keepPos]] = posMatches[keepPos]
+    # Frame discarded by each match (-1 if the output frame is not part
+    # of a match)
+    otherRows = numpy.full(len(rows), -1)
+    otherRows[negMatches] = numpy.where(keepPos, negMatches, posMatches)
+    # Sort the output by m/z and retention time (stable, like the
+    # original row-by-row implementation)
+    order = numpy.lexsort((rt[rows], mz[rows]))
+    _write_results(batches, batchIndex, rowIndex, rows[order],
+                   otherRows[order], parameters,
+                   os.path.join(dst, 'amalgamated.csv'))
+    profiler.stop(len(rows))
     # Update progress bar
     print_progress_bar(total, total, prefix='Amalgamator progress:')
-    # Write the final information in log file and remove handler
+    # Write the final information in log file
     logger.info('Amalgamator completed. Output dataframe has %d rows.\n',
-                 len(results.index))
-    handler.close()
-    logger.removeHandler(handler)
+                 len(rows))
+
+
+def _write_results(batches, batchIndex, rowIndex, rows, otherRows,
+                   parameters, filePath):
+    # type: (list, numpy.ndarray, numpy.ndarray, numpy.ndarray,
+    #        numpy.ndarray, LFParameters, str) -> None
+    """Write the amalgamated frames in the given CSV file, in chunks of
+    CHUNK_SIZE rows, with the same column layout as the first batch.
+
+    The frames are identified by their position in the concatenation of
+    every batch. The polarity of every matched frame is labelled as
+    "(Combined)" if the intensities of both frames are summed, or as
+    "(Both)" otherwise.
+
+    Keyword Arguments:
+        batches    -- list of LFDataFrame or pandas.DataFrame instances
+        batchIndex -- batch of each frame
+        rowIndex   -- row index of each frame in its batch
+        rows       -- frames to write, in order
+        otherRows  -- frame discarded by each match (-1 if the frame is
+                      not part of a match)
+        parameters -- LipidFinder's Amalgamator parameters instance
+        filePath   -- path of the CSV file
+    """
+    columns = list(batches[0].columns.values)
+    # Use the same column types for every chunk as if all the batches
+    # had been concatenated
+    dtypes = pandas.concat([pandas.DataFrame(data[columns]).head(1)
+                            for data in batches]).dtypes
+    firstIndex = parameters['firstSampleIndex'] - 1
+    lastIndex = firstIndex + parameters['numSamples']
+    polColIndex = columns.index('Polarity')
+    if (parameters['combineIntensities']):
+        suffix = ' (Combined)'
+    else:
+        suffix = ' (Both)'
+    for start in range(0, max(len(rows), 1), CHUNK_SIZE):
+        chunkRows = rows[start : start + CHUNK_SIZE]
+        chunk = _take_rows(batches, batchIndex, rowIndex, chunkRows,
+                           columns).astype(dtypes)
+        matched = numpy.where(otherRows[start : start + CHUNK_SIZE] >= 0)[0]
+        if (parameters['combineIntensities'] and (len(matched) > 0)):
+            others = _take_rows(
+                    batches, batchIndex, rowIndex,
+                    otherRows[start : start + CHUNK_SIZE][matched],
+                    columns[firstIndex : lastIndex])
+            chunk.iloc[matched, firstIndex : lastIndex] = \
+                    chunk.iloc[matched, firstIndex : lastIndex].values \
+                    + others.values
+        chunk.iloc[matched, polColIndex] = \
+                chunk.iloc[matched, polColIndex].values + suffix
+        chunk.to_csv(filePath, mode='w' if (start == 0) else 'a',
+                     header=(start == 0), index=False)
+
+
+def _take_rows(batches, batchIndex, rowIndex, rows, columns):
+    # type: (list, numpy.ndarray, numpy.ndarray, numpy.ndarray, list)
+    #       -> pandas.DataFrame
+    """Return a dataframe with the given columns of the given frames,
+    in the same order.
+
+    Keyword Arguments:
+        batches    -- list of LFDataFrame or pandas.DataFrame instances
+        batchIndex -- batch of each frame
+        rowIndex   -- row index of each frame in its batch
+        rows       -- frames to take
+        columns    -- columns to take
+    """
+    pieces = []
+    positions = []
+    for i, data in enumerate(batches):
+        inBatch = numpy.where(batchIndex[rows] == i)[0]
+        if (len(inBatch) > 0):
+            pieces.append(pandas.DataFrame(data[columns]).take(
+                    rowIndex[rows[inBatch]]))
+            positions.append(inBatch)
+    if (not pieces):
+        return pandas.DataFrame(batches[0][columns]).iloc[:0]
+    result = pandas.concat(pieces, ignore_index=True)
+    # Restore the requested order
+    return result.take(numpy.argsort(numpy.concatenate(positions),
+                                     kind='mergesort')).reset_index(drop=True)
+
+
+def _match_features(nmz, nrt, pmz, prt, parameters, offsets):
+    # type: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray,
+    #        LFParameters, list) -> tuple
+    """Return the positions of the matched negative frames and the
+    positions of their positive match, both as NumPy arrays.
+
+    The negative frames are processed in order and each positive frame
+    can only be matched once. The offsets are evaluated in order of
+    priority: the candidates of an offset are only considered if none
+    of the previous offsets has a candidate still available. Among the
+    available candidates, the one with the highest hit score is chosen
+    (the first one in case of a tie).
+
+    Keyword Arguments:
+        nmz        -- negative m/z values
+        nrt        -- negative retention times
+        pmz        -- positive m/z values
+        prt        -- positive retention times
+        parameters -- LipidFinder's Amalgamator parameters instance
+        offsets    -- mass differences between both polarities, in order
+                      of priority
+    """
+    numPos = len(pmz)
+    negIdx, priority, posIdx, scores = _get_candidates(
+            nmz, nrt, pmz, prt, offsets, parameters)
+    # Slice of the candidates of each negative frame
+    bounds = numpy.searchsorted(negIdx, numpy.arange(len(nmz) + 1)).tolist()
+    priority = priority.tolist()
+    posIdx = posIdx.tolist()
+    scores = scores.tolist()
+    # Greedy pass in the negative frames' order: a positive frame
+    # cannot be matched again once consumed
+    alive = [True] * numPos
+    firstAlive = 0
+    negMatches = []
+    posMatches = []
+    for i in numpy.unique(negIdx).tolist():
+        found = False
+        maxScore = 0.0
+        match = None
+        offsetIndex = None
+        for k in range(bounds[i], bounds[i + 1]):
+            if (priority[k] != offsetIndex):
+                # Stop at the first offset with an available candidate
+                if (found):
+                    break
+                offsetIndex = priority[k]
+            if (alive[posIdx[k]]):
+                found = True
+                if (scores[k] > maxScore):
+                    maxScore = scores[k]
+                    match = posIdx[k]
+        if (found):
+            if (match is None):
+                # Every available candidate has a hit score of 0: like
+                # the original implementation, take the first positive
+                # frame not matched yet
+                match = firstAlive
+            alive[match] = False
+            while ((firstAlive < numPos) and not alive[firstAlive]):
+                firstAlive += 1
+            negMatches.append(i)
+            posMatches.append(match)
+    return (numpy.array(negMatches, dtype=int),
+            numpy.array(posMatches, dtype=int))
+
+
+def _get_candidates(nmz, nrt, pmz, prt, offsets, parameters):
+    # type: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray,
+    #        list, LFParameters) -> tuple
+    """Return the negative position, offset index, positive position and
+    hit score of every candidate pair, sorted by negative position,
+    offset index and positive position.
+
+    A positive frame is a candidate for a negative frame if its m/z is
+    within the tolerance of the negative m/z plus one of the offsets and
+    its retention time (RT) is within the RT tolerance of the negative
+    RT. The candidates of every offset are found together with a single
+    join of the tolerance windows on the positive m/z values sorted.
+
+    Keyword Arguments:
+        nmz        -- negative m/z values
+        nrt        -- negative retention times
+        pmz        -- positive m/z values
+        prt        -- positive retention times
+        offsets    -- mass differences between both polarities, in order
+                      of priority
+        parameters -- LipidFinder's Amalgamator parameters instance
+    """
+    numOffsets = len(offsets)
+    # One query per negative frame and offset
+    srcNeg = numpy.repeat(numpy.arange(len(nmz)), numOffsets)
+    srcOffset = numpy.tile(numpy.arange(numOffsets), len(nmz))
+    srcMZ = nmz[srcNeg] + numpy.asarray(offsets, dtype=float)[srcOffset]
+    minMZ, maxMZ = mz_tol_range(srcMZ, parameters['mzFixedError'],
+                                parameters['mzPPMError'])
+    minRT, maxRT = rt_tol_range(nrt, parameters['maxRTDiffAdjFrame'])
+    # Index of the positive frames sorted by m/z
+    posOrder = numpy.argsort(pmz, kind='mergesort')
+    sortedMZ = pmz[posOrder]
+    start = numpy.searchsorted(sortedMZ, minMZ, side='left')
+    counts = numpy.searchsorted(sortedMZ, maxMZ, side='right') - start
+    counts = numpy.maximum(counts, 0)
+    query = numpy.repeat(numpy.arange(len(srcMZ)), counts)
+    # Position in 'sortedMZ' of each candidate
+    shift = numpy.arange(counts.sum()) \
+            - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    posIdx = posOrder[numpy.repeat(start, counts) + shift]
+    negIdx = srcNeg[query]
+    inRT = (prt[posIdx] >= minRT[negIdx]) & (prt[posIdx] <= maxRT[negIdx])
+    query = query[inRT]
+    posIdx = posIdx[inRT]
+    # Queries are already sorted by negative position and offset index
+    sortIdx = numpy.lexsort((posIdx, query))
+    query = query[sortIdx]
+    posIdx = posIdx[sortIdx]
+    scores = __hitScore__(srcMZ[query], pmz[posIdx], nrt[srcNeg[query]],
+                          prt[posIdx], parameters)
+    return (srcNeg[query], srcOffset[query], posIdx, scores)
 
 
 def __hitScore__(srcMZ, targetMZ, srcRT, targetRT, parameters):
     # type: (float, float, float, float, LFParameters) -> float
     """Return the hit score of the target frame for the given source
-    frame.
+    frame. Each argument can also be a NumPy array, returning the hit
+    score of every pair.
 
     Keyword Arguments:
         srcMZ      -- source m/z
@@ -260,38 +470,8 @@ def __hitScore__(srcMZ, targetMZ, srcRT, targetRT, parameters):
     """
     mzDelta = mz_delta(srcMZ, parameters['mzFixedError'],
                        parameters['mzPPMError'])
-    mzDiff = abs(srcMZ - targetMZ)
+    mzDiff = numpy.absolute(srcMZ - targetMZ)
     rtDelta = rt_delta(parameters['maxRTDiffAdjFrame'])
-    rtDiff = abs(srcRT - targetRT)
-    return sqrt(min(mzDiff / mzDelta, 1.0) ** 2 \
-                + min(rtDiff / rtDelta, 1.0) ** 2)
-
-
-def __bestMatch__(matches,   # list
-                  negMass,   # float
-                  pmz,       # pandas.Series
-                  negRT,     # float
-                  prt,       # pandas.Series
-                  parameters # LFParameters
-                  ):
-    # type: (...) -> int
-    """Return the index of 'matches' with the highest hit score for the
-    given negative m/z and retention time.
-
-    Keyword Arguments:
-        matches    -- list of indexes of positive frames that match the
-                      negative m/z and retention time (RT)
-        negMass    -- negative m/z
-        pmz        -- all positive m/z
-        negRT      -- negative RT
-        prt        -- all positive RT
-        parameters -- LipidFinder's Amalgamator parameters instance
-    """
-    maxScore = 0.0
-    maxScoreIndex = 0
-    for ind in matches:
-        score = __hitScore__(negMass, pmz[ind], negRT, prt[ind], parameters)
-        if (score > maxScore):
-            maxScore = score
-            maxScoreIndex = ind
-    return maxScoreIndex
+    rtDiff = numpy.absolute(srcRT - targetRT)
+    return numpy.sqrt(numpy.minimum(mzDiff / mzDelta, 1.0) ** 2 \
+                      + numpy.minimum(rtDiff / rtDelta, 1.0) ** 2)
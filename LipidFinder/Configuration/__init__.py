@@ -6,6 +6,7 @@
 """Collection of parameters used to set up each LipidFinder module."""
 
 from collections import OrderedDict
+import hashlib
 import json
 import os
 import warnings
@@ -19,6 +20,64 @@ from LipidFinder._utils import normalise_path, traceless_warning
 
 # List of LipidFinder modules
 MODULES = ['peakfilter', 'amalgamator', 'mssearch']
+# Parameters read by each PeakFilter stage, in the order the stages are
+# run. "Clustering" and "PeakFinder" are mutually exclusive: the former
+# is run for XCMS pre-processed data and the latter for any other
+# pre-processing software.
+PEAKFILTER_STAGES = OrderedDict([
+    ('QCCalcs', ['numQCReps', 'QCRSD', 'firstSampleIndex', 'numSamples',
+                 'numTechReps']),
+    ('SolventCalcs', ['numSolventReps', 'removeSolvents', 'solventMinFoldDiff',
+                      'firstSampleIndex', 'numSamples', 'numTechReps',
+                      'numQCReps', 'intensityRSD', 'intenOutlierCutOff']),
+    ('Clustering', ['preprocSoftware', 'intenSignifCutOff', 'firstSampleIndex',
+                    'numSamples', 'numTechReps', 'mzCol', 'rtCol',
+                    'mzFixedError', 'mzPPMError', 'maxRTDiffAdjFrame']),
+    ('PeakFinder', ['preprocSoftware', 'intenSignifCutOff', 'firstSampleIndex',
+                    'numSamples', 'numTechReps', 'mzCol', 'rtCol',
+                    'mzFixedError', 'mzPPMError', 'maxRTDiffAdjFrame',
+                    'peakMaxRTWidth', 'peakMinFoldDiff', 'concatAllFrames']),
+    ('InSrcFragRemoval', ['removeIonFrags', 'polarity', 'negIonFragsCSVPath',
+                          'posIonFragsCSVPath', 'mzCol', 'rtCol',
+                          'mzFixedError', 'mzPPMError']),
+    ('ContaminantRemoval.contaminants', ['removeContaminants', 'polarity',
+                                         'negContaminantsCSVPath',
+                                         'posContaminantsCSVPath', 'mzCol',
+                                         'mzFixedError', 'mzPPMError']),
+    ('ContaminantRemoval.adducts', ['removeAdducts', 'polarity',
+                                    'negAdductsCSVPath', 'posAdductsCSVPath',
+                                    'negAdductsPairs', 'posAdductsPairs',
+                                    'adductAddition', 'firstSampleIndex',
+                                    'numSamples', 'numTechReps', 'mzCol',
+                                    'rtCol', 'mzFixedError', 'mzPPMError',
+                                    'maxRTDiffAdjFrame']),
+    ('ContaminantRemoval.stacks', ['removeStacks', 'stacksCSVPath',
+                                   'maxStackGap', 'lipidStackAddition',
+                                   'firstSampleIndex', 'numSamples',
+                                   'numTechReps', 'mzCol', 'rtCol',
+                                   'mzFixedError', 'mzPPMError',
+                                   'maxRTDiffAdjFrame']),
+    ('RTCorrection', ['preprocSoftware', 'numTechReps', 'firstSampleIndex',
+                      'numSamples', 'rtCol', 'maxRTDiffAdjFrame',
+                      'intensityStDev']),
+    ('OutlierCorrection', ['firstSampleIndex', 'numSamples', 'numTechReps',
+                           'intensityRSD', 'intenOutlierCutOff']),
+    ('SampleMeansCalc', ['firstSampleIndex', 'numSamples', 'numTechReps']),
+    ('RTCorrection.means', ['correctRTMeans', 'numSamples', 'rtCol',
+                            'maxRTDiffAdjFrame', 'intensityStDev']),
+    ('MassReassignment', ['featMassAssignment', 'mzCol', 'numSamples']),
+    ('BroadContaminant', ['numSamples', 'rtCol', 'minNonZeroPoints',
+                          'intenRSDCutOff', 'rtSDCutOff', 'outlierMinDiff']),
+    ('Deisotoping', ['removeIsotopes', 'numIsotopes', 'isoIntensityCoef',
+                     'polarity', 'numSamples', 'mzCol', 'rtCol',
+                     'mzFixedError', 'mzPPMError', 'maxRTDiffAdjFrame']),
+    ('MassDefectFilter', ['filterMassDefect', 'rtCutOff', 'mzDelta', 'polarity',
+                          'negMassDefectCSVPath', 'posMassDefectCSVPath',
+                          'mzCol', 'rtCol']),
+    ('FalseDiscoveryRate', ['calculateFDR', 'polarity', 'mzCol',
+                            'localSearch', 'structuresCSVPath']),
+    ('Summary', ['rtRange', 'polarity', 'numSamples', 'mzCol', 'rtCol'])
+    ])
 
 
 class LFParameters:
@@ -77,6 +136,18 @@ class LFParameters:
         current working directory. The latter will save them to
         "/home/user/new_parameters.json". If the destination file
         already exists, it will be overwritten without warning.
+
+        For PeakFilter parameters, the fingerprint of each stage (based
+        on the values of the parameters read by the stage and all its
+        predecessors) tells whether two parameter sets would produce
+        the same output up to that stage:
+            >>> other = LFParameters('peakfilter', 'parameters.json')
+            >>> other['mzDelta'] = 0.02
+            >>> fingerprint = params.stage_fingerprint('Deisotoping')
+            >>> other.stage_fingerprint('Deisotoping') == fingerprint
+            True
+            >>> params.changed_stages(other)
+            ['MassDefectFilter', 'FalseDiscoveryRate', 'Summary']
     """
 
     def __init__(self, module='peakfilter', src=''):
@@ -215,6 +286,69 @@ class LFParameters:
         with open(normalise_path(dst), 'w') as paramsFile:
             json.dump(paramsDict, paramsFile, indent=4)
 
+    def get_stages(self):
+        # type: () -> list
+        """Return the ordered list of PeakFilter stages that will be run
+        with the current parameters.
+        """
+        if (self._module != 'peakfilter'):
+            raise ValueError("Stages are only defined for 'peakfilter'")
+        if (self['preprocSoftware'] == 'XCMS'):
+            skipStage = 'PeakFinder'
+        else:
+            skipStage = 'Clustering'
+        return [x for x in PEAKFILTER_STAGES.keys() if x != skipStage]
+
+    def stage_fingerprint(self, stage, cumulative=True):
+        # type: (str, bool) -> str
+        """Return a stable fingerprint (SHA-1 hexadecimal digest) of the
+        values of the parameters read by the given PeakFilter stage.
+
+        The content of the files referenced by "path" parameters is
+        included in the fingerprint, so editing one of them changes it.
+
+        Keyword Arguments:
+            stage      -- PeakFilter stage name (key of
+                          PEAKFILTER_STAGES)
+            cumulative -- include the parameters read by every
+                          preceding stage? [default: True]
+        """
+        stages = self.get_stages()
+        if (stage not in stages):
+            raise ValueError("'stage' must be one of {0}".format(stages))
+        if (cumulative):
+            stages = stages[ : stages.index(stage) + 1]
+        else:
+            stages = [stage]
+        sha = hashlib.sha1()
+        for stageName in stages:
+            for key in PEAKFILTER_STAGES[stageName]:
+                sha.update(json.dumps([stageName, key, self[key]]).encode(
+                        'utf-8'))
+                if ((self._parameters[key]['type'] == 'path')
+                    and self[key] and os.path.isfile(self[key])):
+                    with open(self[key], 'rb') as srcFile:
+                        sha.update(srcFile.read())
+        return sha.hexdigest()
+
+    def changed_stages(self, other):
+        # type: (LFParameters) -> list
+        """Return the ordered list of PeakFilter stages whose output
+        would differ between this and 'other' parameter sets, i.e. the
+        stages that need to be recomputed.
+
+        Keyword Arguments:
+            other -- LipidFinder's PeakFilter parameters instance
+        """
+        stages = self.get_stages()
+        if (stages != other.get_stages()):
+            return stages
+        for index, stage in enumerate(stages):
+            if (self.stage_fingerprint(stage, False)
+                != other.stage_fingerprint(stage, False)):
+                return stages[index : ]
+        return []
+
     def _validate_literal(self, key, value, verbose=True):
         # type: (str, object, bool) -> bool
         """Return True if 'value' is a valid literal for the chosen
@@ -9,6 +9,7 @@ import glob
 import logging
 import os
 
+import numpy
 import pandas
 
 
@@ -36,8 +37,16 @@ class LFDataFrame(pandas.core.frame.DataFrame):
     Attributes:
         src  (Public[str])
             Source path where the data was loaded from.
+        logIDs  (Public[bool])
+            Write the IDs of the removed rows in the log file?
+        logger  (Public[logging.Logger])
+            Logger where drop() writes its messages (if None, the
+            logger named after the module performing the removal).
         _resolution  (Private[int])
             Number of digits after the radix point in floats.
+        _removed  (Private[list])
+            Removal ledger: list of (module, IDs array) tuples, one per
+            row removal, in the order they were performed.
 
     Examples:
         LFDataFrame objects can be created in two different ways:
@@ -64,10 +73,27 @@ class LFDataFrame(pandas.core.frame.DataFrame):
         can be changed assigning a value to 'resolution' variable. It
         has been predefined to 6, a standard value in high-resolution
         liquid-chromatography coupled to mass-spectrometry.
+
+        Every row removal performed through drop() is recorded in the
+        removal ledger, which can be retrieved as a dataframe:
+            >>> csvData.removal_ledger()
+
+        By default, only the number of rows removed is written in the
+        log file. The former behaviour (writing every removed ID) can be
+        restored setting 'logIDs' to True:
+            >>> csvData = LFDataFrame('input_data.csv', params, logIDs=True)
+
+        The log messages can be sent to the logger of a specific run
+        (see LFRunContext) instead of the module's logger:
+            >>> with LFRunContext('peakfilter.log') as context:
+            ...     context.attach(csvData)
     """
 
-    def __init__(self, src, parameters, resolution=6, sheet=0):
-        # type: (str, LFParameters, int, object) -> LFDataFrame
+    # Attributes that are not dataframe columns
+    _metadata = ['src', 'logIDs', 'logger', '_resolution', '_removed']
+
+    def __init__(self, src, parameters, resolution=6, sheet=0, logIDs=False):
+        # type: (str, LFParameters, int, object, bool) -> LFDataFrame
         """Constructor of the class LFDataFrame.
 
         Keyword Arguments:
@@ -79,6 +105,8 @@ class LFDataFrame(pandas.core.frame.DataFrame):
             sheet      -- sheet number or list of sheet numbers to read
                           when input file(s) have XLS or XLSX extension
                           (zero-indexed position) [default: 0]
+            logIDs     -- write the IDs of the removed rows in the log
+                          file? [default: False]
         """
         rtCol = parameters['rtCol']
         if (not os.path.isdir(src)):
@@ -145,7 +173,31 @@ class LFDataFrame(pandas.core.frame.DataFrame):
         data[mzCol] = data[mzCol].apply(round, ndigits=resolution)
         super(LFDataFrame, self).__init__(data=data)
         self.src = src
+        self.logIDs = logIDs
+        self.logger = None
         self._resolution = resolution
+        self._removed = []
+
+    def __finalize__(self, other, method=None, **kwargs):
+        # type: (object, str, ...) -> LFDataFrame
+        """Propagate the metadata from 'other' to self, giving self its
+        own copy of the removal ledger.
+
+        pandas copies the attributes in '_metadata' by reference, so the
+        new dataframe and 'other' would otherwise record their removals
+        in the same list.
+
+        Keyword Arguments:
+            other   -- object to get the metadata from
+            method  -- name of the method that created self
+                       [default: None]
+            *kwargs -- arguments to pass to pandas.DataFrame.__finalize__()
+        """
+        super(LFDataFrame, self).__finalize__(other, method=method, **kwargs)
+        removed = self.__dict__.get('_removed')
+        if (isinstance(removed, list)):
+            object.__setattr__(self, '_removed', list(removed))
+        return self
 
     def drop_empty_frames(self, module, parameters, means=False):
         # type: (str, LFParameters, bool) -> None
@@ -187,22 +239,45 @@ class LFDataFrame(pandas.core.frame.DataFrame):
         """Wrapper of pandas.DataFrame.drop() with logging report.
 
         The report will be updated only if the labels correspond to
-        rows, i.e. kwargs['axis'] == 0 (default value).
+        rows, i.e. kwargs['axis'] == 0 (default value). The IDs of the
+        removed rows are added to the removal ledger.
 
         Keyword Arguments:
             module  -- module name to write in the logging file
             *kwargs -- arguments to pass to pandas.DataFrame.drop()
         """
-        # Create logger to print message to the log file
-        logger = logging.getLogger(module)
-        logger.setLevel(logging.INFO)
+        # Get the logger to print message to the log file
+        if (self.logger is not None):
+            logger = self.logger
+        else:
+            logger = logging.getLogger(module)
+            logger.setLevel(logging.INFO)
         if ((len(kwargs['labels']) > 0) and (kwargs.get('axis', 0) == 0)):
-            idCol = self.columns[0]
-            idList = [str(x) for x in sorted(self.loc[kwargs['labels'], idCol])]
-            logger.info('%s: removed %d rows. IDs: %s', module, len(idList),
-                        ','.join(idList))
+            ids = self.loc[kwargs['labels'], self.columns[0]].values
+            self._removed.append((module, ids))
+            if (self.logIDs):
+                idList = [str(x) for x in numpy.sort(ids)]
+                logger.info('%s: removed %d rows. IDs: %s', module,
+                            len(idList), ','.join(idList))
+            else:
+                logger.info('%s: removed %d rows.', module, len(ids))
         return super(LFDataFrame, self).drop(**kwargs)
 
+    def removal_ledger(self):
+        # type: () -> pandas.DataFrame
+        """Return a dataframe with the module and the ID of every row
+        removed so far, in the order they were removed.
+        """
+        idCol = self.columns[0]
+        if (not self._removed):
+            return pandas.DataFrame(columns=['Module', idCol])
+        modules = numpy.concatenate(
+                [numpy.full(len(ids), module, dtype=object)
+                 for module, ids in self._removed])
+        ids = numpy.concatenate([ids for module, ids in self._removed])
+        return pandas.DataFrame({'Module': modules, idCol: ids},
+                                columns=['Module', idCol])
+
     @staticmethod
     def _read_file(src, parameters, sheet):
         # type: (str, LFParameters, int) -> pandas.core.frame.DataFrame
@@ -0,0 +1,293 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Represent the per-stage time and memory profile of a run of a
+LipidFinder's module."""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+from LipidFinder._utils import Counters
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+class LFProfiler(object):
+    """A LFProfiler object records, for each stage of a run, its wall
+    time, CPU time, the increase of the process' peak resident set size
+    (RSS) and the number of rows of the dataframe before and after the
+    stage. Optionally, it also records the peak memory allocated by the
+    stage, traced with tracemalloc (this slows down the stages, so their
+    times are not representative then). The kernel counters (see
+    _utils.Counters) incremented during each stage are recorded too.
+
+    A disabled profiler does nothing, so the profiling calls can be left
+    in place at no cost.
+
+    Profiling is per process: tracemalloc and the kernel counters are
+    shared by every profiler open in the process, and they are stopped
+    when the last one is closed. The stages of runs profiled at the same
+    time (e.g. in several threads) include each other's allocations and
+    counter increments, so profile concurrent runs in separate processes
+    to get their own figures.
+
+    Attributes:
+        enabled  (Public[bool])
+            Record the stages?
+        traceMemory  (Public[bool])
+            Trace the memory allocated by each stage?
+        records  (Public[list])
+            List of ordered dictionaries with the profile of each stage.
+        _current  (Private[dict])
+            Profile of the stage in progress.
+        _tracing  (Private[bool])
+            Is this profiler one of the users of tracemalloc?
+        _counting  (Private[bool])
+            Is this profiler one of the users of the kernel counters?
+
+    Examples:
+        Stages can be delimited with start() and stop() or with the
+        stage() context manager:
+            >>> from LFProfiler import LFProfiler
+            >>> profiler = LFProfiler(traceMemory=True)
+            >>> profiler.start('Solvent removal', data)
+            >>> SolventCalcs.remove_solvent_calcs(data, parameters)
+            >>> profiler.stop(data)
+            >>> with profiler.stage('Deisotoping', data):
+            ...     Deisotoping.remove_isotopes(data, parameters)
+            >>> profiler.close()
+            >>> profiler.write_json('peakfilter_profile.json', 'PeakFilter')
+
+        It can also be used as a context manager, so it is closed even
+        if the run fails:
+            >>> with LFProfiler(traceMemory=True) as profiler:
+            ...     with profiler.stage('Deisotoping', data):
+            ...         Deisotoping.remove_isotopes(data, parameters)
+    """
+
+    # Number of open profilers tracing memory and recording the kernel
+    # counters, and whether they started tracemalloc and the counters
+    # (so they stop them when the last one is closed)
+    _lock = threading.Lock()
+    _numTracing = 0
+    _numCounting = 0
+    _stopTracing = False
+    _stopCounters = False
+
+    def __init__(self, enabled=True, traceMemory=False):
+        # type: (bool, bool) -> LFProfiler
+        """Constructor of the class LFProfiler.
+
+        Keyword Arguments:
+            enabled     -- record the stages? [default: True]
+            traceMemory -- trace the memory allocated by each stage?
+                           [default: False]
+        """
+        self.enabled = enabled
+        self.traceMemory = enabled and traceMemory
+        self.records = []
+        self._current = None
+        self._tracing = self.traceMemory
+        self._counting = self.enabled
+        cls = LFProfiler
+        with cls._lock:
+            if (self._tracing):
+                if ((cls._numTracing == 0) and not tracemalloc.is_tracing()):
+                    tracemalloc.start()
+                    cls._stopTracing = True
+                cls._numTracing += 1
+            if (self._counting):
+                if ((cls._numCounting == 0) and not Counters.is_enabled()):
+                    Counters.enable()
+                    cls._stopCounters = True
+                cls._numCounting += 1
+
+    def __enter__(self):
+        # type: () -> LFProfiler
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # type: (type, Exception, traceback) -> bool
+        self.close()
+        return False
+
+    def start(self, stage, data=None):
+        # type: (str, pandas.DataFrame) -> None
+        """Start recording the profile of the given stage.
+
+        Keyword Arguments:
+            stage -- stage name
+            data  -- dataframe processed by the stage (or its number of
+                     rows) [default: None]
+        """
+        if (not self.enabled):
+            return
+        memory = 0
+        if (self.traceMemory):
+            if (hasattr(tracemalloc, 'reset_peak')):
+                tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        self._current = {
+                'stage': stage,
+                'rowsIn': self._get_num_rows(data),
+                'wallTime': time.perf_counter(),
+                'cpuTime': time.process_time(),
+                'memory': memory,
+                'maxRSS': self._get_max_rss(),
+                'counters': Counters.get_counters()}
+
+    def stop(self, data=None):
+        # type: (pandas.DataFrame) -> None
+        """Stop recording the profile of the current stage.
+
+        Keyword Arguments:
+            data -- dataframe processed by the stage (or its number of
+                    rows) [default: None]
+        """
+        if (not self.enabled or (self._current is None)):
+            return
+        wallTime = time.perf_counter() - self._current['wallTime']
+        cpuTime = time.process_time() - self._current['cpuTime']
+        peakMemory = None
+        if (self.traceMemory):
+            peakMemory = tracemalloc.get_traced_memory()[1] \
+                         - self._current['memory']
+            peakMemory = round(max(peakMemory, 0) / 1048576.0, 3)
+        rssIncrease = self._get_max_rss() - self._current['maxRSS']
+        # Keep only the counters incremented during the stage
+        counters = OrderedDict()
+        for name, value in sorted(Counters.get_counters().items()):
+            value -= self._current['counters'].get(name, 0)
+            if (value != 0):
+                counters[name] = value
+        self.records.append(OrderedDict([
+                ('stage', self._current['stage']),
+                ('wallTime', round(wallTime, 4)),
+                ('cpuTime', round(cpuTime, 4)),
+                ('peakMemoryMiB', peakMemory),
+                ('rssIncreaseMiB', round(rssIncrease / 1048576.0, 3)),
+                ('rowsIn', self._current['rowsIn']),
+                ('rowsOut', self._get_num_rows(data)),
+                ('counters', counters)]))
+        self._current = None
+
+    @contextmanager
+    def stage(self, stage, data=None):
+        # type: (str, pandas.DataFrame) -> None
+        """Record the profile of the code run inside the context (also
+        if it raises an exception).
+
+        Keyword Arguments:
+            stage -- stage name
+            data  -- dataframe processed by the stage (or its number of
+                     rows) [default: None]
+        """
+        self.start(stage, data)
+        try:
+            yield
+        finally:
+            self.stop(data)
+
+    def close(self):
+        # type: () -> None
+        """Release tracemalloc and the kernel counters, stopping them
+        if this is the last open profiler and a profiler started them.
+        """
+        cls = LFProfiler
+        with cls._lock:
+            if (self._tracing):
+                self._tracing = False
+                cls._numTracing -= 1
+                if ((cls._numTracing == 0) and cls._stopTracing):
+                    tracemalloc.stop()
+                    cls._stopTracing = False
+            if (self._counting):
+                self._counting = False
+                cls._numCounting -= 1
+                if ((cls._numCounting == 0) and cls._stopCounters):
+                    Counters.disable()
+                    cls._stopCounters = False
+
+    def write_json(self, filePath, module):
+        # type: (str, str) -> None
+        """Write the recorded profile in a JSON file.
+
+        Keyword Arguments:
+            filePath -- JSON file path
+            module   -- name of the profiled module
+        """
+        if (not self.enabled):
+            return
+        profile = OrderedDict([
+                ('module', module),
+                ('wallTime', round(sum(x['wallTime'] for x in self.records),
+                                   4)),
+                ('cpuTime', round(sum(x['cpuTime'] for x in self.records), 4)),
+                ('stages', self.records)])
+        with open(filePath, 'w') as jsonFile:
+            json.dump(profile, jsonFile, indent=4)
+
+    def log_summary(self, logger):
+        # type: (logging.Logger) -> None
+        """Write the recorded profile as a table in the given logger.
+
+        Keyword Arguments:
+            logger -- logger where the table is written
+        """
+        if (not self.enabled):
+            return
+        rowFormat = '{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>9} {6:>9}'
+        lines = ['Profile summary:',
+                 rowFormat.format('Stage', 'Wall (s)', 'CPU (s)', 'Peak MiB',
+                                  'RSS+ MiB', 'Rows in', 'Rows out')]
+        for record in self.records:
+            lines.append(rowFormat.format(
+                    record['stage'], '{0:.3f}'.format(record['wallTime']),
+                    '{0:.3f}'.format(record['cpuTime']),
+                    '' if (record['peakMemoryMiB'] is None)
+                        else '{0:.1f}'.format(record['peakMemoryMiB']),
+                    '{0:.1f}'.format(record['rssIncreaseMiB']),
+                    '' if (record['rowsIn'] is None) else record['rowsIn'],
+                    '' if (record['rowsOut'] is None) else record['rowsOut']))
+        for record in self.records:
+            if (record['counters']):
+                lines.append('{0}: {1}'.format(record['stage'], ', '.join(
+                        '{0}={1}'.format(name, value)
+                        for name, value in record['counters'].items())))
+        logger.info('\n'.join(lines))
+
+    @staticmethod
+    def _get_num_rows(data):
+        # type: (object) -> int
+        """Return the number of rows of the given dataframe (None if
+        'data' is None).
+
+        Keyword Arguments:
+            data -- dataframe or number of rows
+        """
+        if ((data is None) or isinstance(data, int)):
+            return data
+        return len(data.index)
+
+    @staticmethod
+    def _get_max_rss():
+        # type: () -> int
+        """Return the peak resident set size of the process in bytes
+        (0 if it is not available in the current platform).
+        """
+        if (resource is None):
+            return 0
+        maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports the value in kilobytes, macOS in bytes
+        return maxRSS if (sys.platform == 'darwin') else maxRSS * 1024
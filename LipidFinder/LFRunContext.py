@@ -0,0 +1,115 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Represent the logging context of a single run of a LipidFinder's
+module."""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+
+
+class LFRunContext(object):
+    """A LFRunContext object provides a logger that writes only to the
+    log file of one run, so several runs can take place concurrently in
+    the same process (e.g. in different threads) without mixing their
+    log messages.
+
+    The logger does not propagate to the root logger. It puts the log
+    records in a queue that is consumed by a background thread writing
+    to the log file, so logging a message never waits for the disk or
+    for other runs.
+
+    Attributes:
+        logger  (Public[logging.Logger])
+            Logger of the run.
+        _listener  (Private[logging.handlers.QueueListener])
+            Background thread writing the queued records to the file.
+        _fileHandler  (Private[logging.FileHandler])
+            Handler of the log file.
+        _frames  (Private[list])
+            List of (LFDataFrame, previous logger) tuples of the
+            dataframes attached to the run.
+
+    Examples:
+        LFRunContext objects are meant to be used as context managers,
+        so the log file is closed even if the run raises an exception:
+            >>> from LFRunContext import LFRunContext
+            >>> with LFRunContext('peakfilter.log') as context:
+            ...     context.attach(data)
+            ...     context.logger.info('Starting PeakFilter.')
+
+        Attaching an LFDataFrame to the run makes drop() write its
+        messages in the run's log file. The previous logger of the
+        dataframe is restored when the context is closed.
+    """
+
+    # Counter to give each run logger a unique name
+    _ids = itertools.count(1)
+
+    def __init__(self, logFilePath, mode='a'):
+        # type: (str, str) -> LFRunContext
+        """Constructor of the class LFRunContext.
+
+        Keyword Arguments:
+            logFilePath -- path of the log file of the run
+            mode        -- mode to open the log file [default: 'a']
+        """
+        self.logger = logging.getLogger(
+                'LipidFinder.run{0}'.format(next(self._ids)))
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self._fileHandler = logging.FileHandler(logFilePath, mode=mode)
+        self._fileHandler.setLevel(logging.INFO)
+        formatter = logging.Formatter('[%(asctime)s] %(message)s')
+        self._fileHandler.setFormatter(formatter)
+        recordQueue = queue.Queue(-1)
+        self.logger.addHandler(logging.handlers.QueueHandler(recordQueue))
+        self._listener = logging.handlers.QueueListener(recordQueue,
+                                                        self._fileHandler)
+        self._listener.start()
+        self._frames = []
+
+    def __enter__(self):
+        # type: () -> LFRunContext
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # type: (type, Exception, traceback) -> bool
+        self.close()
+        return False
+
+    def attach(self, *frames):
+        # type: (LFDataFrame, ...) -> None
+        """Make the given LFDataFrame instances log to the run's log
+        file.
+
+        Keyword Arguments:
+            *frames -- LFDataFrame instances
+        """
+        for data in frames:
+            self._frames.append((data, data.logger))
+            data.logger = self.logger
+
+    def close(self):
+        # type: () -> None
+        """Write any pending log record, close the log file, restore
+        the logger of the attached dataframes and release the run's
+        logger.
+        """
+        if (self._listener is None):
+            return
+        for data, logger in reversed(self._frames):
+            data.logger = logger
+        self._frames = []
+        # Stop the listener after it has processed every queued record
+        self._listener.stop()
+        self._listener = None
+        self._fileHandler.close()
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+        # Remove the logger from the registry so it can be released
+        logging.Logger.manager.loggerDict.pop(self.logger.name, None)
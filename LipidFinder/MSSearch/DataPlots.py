@@ -25,11 +25,14 @@ import os
 import string
 import warnings
 
-from cycler import cycler
+import matplotlib
+# Use a non-interactive backend: the figures are only saved to file, so
+# plotting never waits for a display to be available
+matplotlib.use('Agg')
+import matplotlib.colors
 import matplotlib.style
 import matplotlib.pyplot as pyplot
 import numpy
-import pandas
 
 
 # Ignore Future Warnings from pandas library
@@ -38,6 +41,12 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 CATEGORIES = ['unknown', 'sterol lipids', 'sphingolipids', 'saccharolipids',
               'prenol lipids', 'polyketides', 'other metabolites',
               'glycerophospholipids', 'glycerolipids', 'fatty acyls']
+# Figure style (renamed in matplotlib 3.6)
+STYLE = 'seaborn-v0_8-paper' if ('seaborn-v0_8-paper'
+                                 in matplotlib.style.available) \
+        else 'seaborn-paper'
+# Number of bins per axis of the density image
+DENSITY_BINS = 400
 
 
 def category_scatterplot(data, parameters, dst):
@@ -48,7 +57,10 @@ def category_scatterplot(data, parameters, dst):
     vs retention time (RT) of the input dataframe, which must contain a
     column named "Category" (case sensitive). The plot is saved in the
     file format selected during the parameter configuration (PDF by
-    default).
+    default). The points can be drawn as vector markers, as a raster
+    layer (the axes and legend are kept as vector graphics) or binned
+    into a density image, which is faster and much smaller for large
+    datasets.
 
     Keyword arguments:
         data       -- LFDataFrame or pandas.DataFrame instance
@@ -71,12 +83,13 @@ def category_scatterplot(data, parameters, dst):
         markers = ['o', 'v', '^', '<', '>', 's', 'P', 'X', '*', 'd']
         sizes = [3, 4, 4, 4, 4, 3, 4, 4, 5, 4]
         widths = [0, 0, 0, 0, 0, 0, 0.1, 0, 0, 0.1]
-    # Replace NaN in "Category" column by "unknown"
-    data['Category'].fillna('unknown', inplace=True)
-    # Get the main category for each m/z and RT pair
-    catData = _get_main_categories(data, mzCol, rtCol)
+    # Get the main category for each m/z and RT pair, replacing NaN in
+    # "Category" column by "unknown"
+    catData = data[[mzCol, rtCol]].assign(
+            Category=data['Category'].fillna('unknown'))
+    catData = _get_main_categories(catData, mzCol, rtCol)
     # Configure the plot style, layout and parameters
-    matplotlib.style.use('seaborn-paper')
+    matplotlib.style.use(STYLE)
     ax = pyplot.subplot(111)
     # Calculate the ceiling of the 102% of the maximum retention time
     maxRT = numpy.amax(catData[rtCol].values)
@@ -84,27 +97,37 @@ def category_scatterplot(data, parameters, dst):
     # Calculate the ceiling of the 110% of the maximum m/z
     maxMZ = numpy.amax(catData[mzCol].values)
     maxY = numpy.ceil(1.1 * maxMZ)
-    # Set range of X and Y axes
-    pyplot.xlim([0, maxX])
-    pyplot.ylim([0, maxY])
     # Set label text of X and Y axes
     pyplot.xlabel('Retention time (min)')
     pyplot.ylabel('m/z', fontstyle='italic')
-    # Set a readable and color-blind friendly marker cycle
-    ax.set_prop_cycle(
-            cycler('marker', markers) + cycler('color', colors) +\
-            cycler('markersize', sizes) + cycler('markeredgewidth', widths))
-    # Load each category to the plot
+    catIndex = catData['Category'].str.lower().map(
+            {category: i for i, category in enumerate(CATEGORIES)})
+    if (parameters['figPoints'] == 'density'):
+        # Draw the points binned into an image, coloring each bin with
+        # its most frequent category
+        image = _get_density_image(catData[rtCol].values,
+                                   catData[mzCol].values, catIndex.values,
+                                   colors, maxX, maxY)
+        pyplot.imshow(image, origin='lower', extent=(0, maxX, 0, maxY),
+                      aspect='auto', interpolation='nearest')
+    # Load each category to the plot with its own marker and color, so
+    # each category will always have the same one, allowing an ease
+    # comparison between plots
     for i, category in enumerate(CATEGORIES):
-        catMatches = catData.loc[catData['Category'].str.lower() == category]
+        catMatches = catData.loc[catIndex == i]
         if (len(catMatches) == 0):
-            # Skip to the next marker so each category will always have
-            # the same one, allowing an ease comparison between plots
-            next(ax._get_lines.prop_cycler)
-        else:
-            pyplot.plot(catMatches[rtCol], catMatches[mzCol], linestyle='None',
-                        markeredgecolor='#666666',
-                        label=string.capwords(category))
+            continue
+        if (parameters['figPoints'] == 'density'):
+            # Only add the category to the legend
+            catMatches = catMatches.iloc[:0]
+        pyplot.plot(catMatches[rtCol], catMatches[mzCol], linestyle='None',
+                    marker=markers[i], color=colors[i], markersize=sizes[i],
+                    markeredgewidth=widths[i], markeredgecolor='#666666',
+                    label=string.capwords(category),
+                    rasterized=(parameters['figPoints'] == 'raster'))
+    # Set range of X and Y axes
+    pyplot.xlim([0, maxX])
+    pyplot.ylim([0, maxY])
     # Get handles and labels for legend
     handles, labels = ax.get_legend_handles_labels()
     numCats = len(labels)
@@ -153,26 +176,48 @@ def _get_main_categories(data, mzCol, rtCol, defaultCat='other metabolites'):
     if (defaultCat not in CATEGORIES):
         raise ValueError("'defaultCat' must be one of {0}".format(CATEGORIES))
     # Get count the number of matches per m/z, RT and category
-    categoryCounts = pandas.DataFrame(
-                {'Count': data.groupby([mzCol, rtCol, 'Category'],
-                                       sort=True).size()})
-    categoryCounts.reset_index(inplace=True)
-    # Group the category counts by m/z and RT
-    groupedData = categoryCounts.groupby([mzCol, rtCol])
-    # Set up a new dataframe to save the most frequent categories
-    catData = pandas.DataFrame()
-    for name, group in groupedData:
-        # Append the row with the most frequent category for each m/z
-        # and RT (excluding "Count" column)
-        if (len(group) == 1):
-            catData = catData.append(group[[mzCol, rtCol, 'Category']],
-                                     ignore_index=True)
-        else:
-            # When there are two or more categories, pick the
-            # non-default most frequent one
-            index = group.loc[group['Category'].str.lower() != defaultCat,
-                              'Count'].idxmax()
-            catData = catData.append(
-                    group.loc[index, [mzCol, rtCol, 'Category']],
-                    ignore_index=True)
-    return catData
+    categoryCounts = data.groupby([mzCol, rtCol, 'Category'],
+                                  sort=True).size().reset_index(name='Count')
+    # When there are two or more categories per m/z and RT, exclude the
+    # default one
+    numCategories = categoryCounts.groupby([mzCol, rtCol])['Count'].transform(
+            'size')
+    categoryCounts = categoryCounts[
+            (numCategories == 1)
+            | (categoryCounts['Category'].str.lower() != defaultCat)]
+    # Keep the most frequent category for each m/z and RT (the first
+    # one in alphabetical order in case of a tie)
+    categoryCounts = categoryCounts.sort_values(
+            [mzCol, rtCol, 'Count'], ascending=[True, True, False])
+    catData = categoryCounts.drop_duplicates([mzCol, rtCol])
+    return catData[[mzCol, rtCol, 'Category']].reset_index(drop=True)
+
+
+def _get_density_image(xValues, yValues, catIndex, colors, maxX, maxY):
+    # type: (numpy.array, numpy.array, numpy.array, list, float, float)
+    #     -> numpy.array
+    """Return an RGBA image of the points binned in a grid of
+    DENSITY_BINS x DENSITY_BINS, where each bin has the color of its
+    most frequent category and empty bins are transparent.
+
+    In case of a tie, the category drawn last in the scatter plot (the
+    latest in CATEGORIES) is chosen.
+
+    Keyword arguments:
+        xValues  -- X coordinate of each point
+        yValues  -- Y coordinate of each point
+        catIndex -- index in CATEGORIES of each point's category
+        colors   -- color of each category in CATEGORIES
+        maxX     -- upper limit of the X axis
+        maxY     -- upper limit of the Y axis
+    """
+    counts = numpy.zeros((len(CATEGORIES), DENSITY_BINS, DENSITY_BINS))
+    for i in range(len(CATEGORIES)):
+        mask = catIndex == i
+        counts[i] = numpy.histogram2d(
+                yValues[mask], xValues[mask], bins=DENSITY_BINS,
+                range=[[0, maxY], [0, maxX]])[0]
+    topCategory = len(CATEGORIES) - 1 - numpy.argmax(counts[::-1], axis=0)
+    image = matplotlib.colors.to_rgba_array(colors)[topCategory]
+    image[counts.sum(axis=0) == 0] = 0
+    return image
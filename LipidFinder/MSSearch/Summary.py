@@ -5,7 +5,7 @@
 # included as part of this software.
 """Set of methods aimed to summarise the putative profile:
     > create_summary():
-        Create a summary XLSX file containing only one row per m/z and
+        Create a summary file containing only one row per m/z and
         retention time with the most common lipid category.
 
 Examples:
@@ -27,12 +27,15 @@ Examples:
 
 import os
 
+import numpy
 import pandas
 
+from LipidFinder.MSSearch.Writer import OutputWriter
+
 
 def create_summary(data, parameters, dst=''):
     # type: (object, LFParameters, str) -> None
-    """Create a summary XLSX file containing only one row per m/z and
+    """Create a summary file containing only one row per m/z and
     retention time with the most common lipid category.
 
     'data' must have, at least, m/z, retention time (RT), "Main Class"
@@ -42,50 +45,82 @@ def create_summary(data, parameters, dst=''):
     in that case the second one will be selected. The same rule applies
     for the main class.
     If 'dst' is not an absolute path, the current working directory will
-    be used as starting point. If "mssearch_<db>_summary.xlsx"
+    be used as starting point. If "mssearch_<db>_summary.<ext>"
     file already exists, it will be overwritten without warning.
-    "<db>" stands for the selected LIPID MAPS database.
+    "<db>" stands for the selected LIPID MAPS database and "<ext>" for
+    the output file format.
 
     Keyword Arguments:
         data       -- LFDataFrame or pandas.DataFrame instance
         parameters -- LipidFinder's MS Search parameters instance
-        dst        -- destination directory where the XSLX file will be
+        dst        -- destination directory where the file will be
                       created [default: current working directory]
     """
     mzCol = parameters['mzCol']
     rtCol = parameters['rtCol']
-    # Get the list of unique m/z values from 'data'
-    mzList = data[mzCol].unique().tolist()
-    summary = pandas.DataFrame(columns=list(data))
-    # Iterate over the groups of identifications for the same m/z and RT
-    for name, group in data.groupby([mzCol, rtCol]):
-        categories = group['Category'].value_counts()
-        if (categories.empty):
-            # No matches were returned for this group
-            summary = summary.append(group, ignore_index=True)
-        else:
-            bestCategory = categories.index[0]
-            # Keep only those rows for the most frequent category
-            subgroup = group[group['Category'] == bestCategory]
-            if (bestCategory == 'other metabolites'):
-                if ((len(categories) == 1) or (categories[0] > categories[1])):
-                    # "Other metabolites" has empty "Main Class", but it
-                    # can have more than one row, so keep the first one
-                    summary = summary.append(subgroup.head(1),
-                                             ignore_index=True)
-                    continue
-                else:
-                    # Change the best category for a specialized one
-                    # with the same number of matches (next category)
-                    bestCategory = categories.index[1]
-                    subgroup = group[group['Category'] == bestCategory]
-            # Get the most frequent main class and keep its first row
-            mainClass = subgroup['Main Class'].value_counts().index[0]
-            summary = summary.append(
-                    subgroup[subgroup['Main Class'] == mainClass].head(1),
-                    ignore_index=True)
-    # Create XLSX file with the summary putative profiling in 'dst'
-    fileName = 'mssearch_{0}_summary.xlsx'.format(
-            parameters['database'].lower())
-    summary.to_excel(os.path.join(dst, fileName), index=False,
-                     engine='xlsxwriter')
+    # Number the groups of identifications for the same m/z and RT in
+    # groupby()'s order (rows with a missing m/z or RT get -1)
+    rows = pandas.DataFrame(
+            {'group': data.groupby([mzCol, rtCol]).ngroup().values,
+             'category': data['Category'].values,
+             'mainClass': data['Main Class'].values,
+             'pos': numpy.arange(len(data))})
+    rows = rows[rows['group'] >= 0]
+    matched = rows[rows['category'].notna()]
+    # Get the most and second most frequent categories of each group
+    categories = _rank_values(matched, 'category')
+    best = categories[categories['rank'] == 0].set_index('group')
+    second = categories[categories['rank'] == 1].set_index('group')
+    secondCount = second['count'].reindex(best.index)
+    # "Other metabolites" has empty "Main Class", so keep its first row
+    # unless a specialized category has the same number of matches
+    isOther = best['category'] == 'other metabolites'
+    keepOther = isOther & (secondCount != best['count'])
+    bestCategory = best['category'].where(
+            ~isOther | keepOther, second['category'].reindex(best.index))
+    # Keep only those rows for the selected category of each group
+    subgroups = matched[
+            (matched['category'] == matched['group'].map(bestCategory))
+            & ~matched['group'].map(keepOther)]
+    # Get the most frequent main class and keep its first row
+    mainClasses = _rank_values(subgroups[subgroups['mainClass'].notna()],
+                               'mainClass')
+    firstRows = subgroups.groupby('group')['pos'].min()
+    classRows = mainClasses[mainClasses['rank'] == 0].set_index('group')
+    classRows = classRows['first'].reindex(firstRows.index).fillna(firstRows)
+    # Groups with no matches are kept unchanged
+    unmatched = rows[~rows['group'].isin(best.index)]
+    selected = pandas.concat(
+            [best.loc[keepOther, 'first'], classRows,
+             unmatched.set_index('group')['pos']]).reset_index()
+    selected.columns = ['group', 'pos']
+    selected.sort_values(['group', 'pos'], inplace=True)
+    summary = data.iloc[selected['pos'].astype(int).values]
+    summary = summary.reset_index(drop=True)
+    # Create the file with the summary putative profiling in 'dst'
+    fileName = 'mssearch_{0}_summary.{1}'.format(
+            parameters['database'].lower(), parameters['outputFormat'])
+    with OutputWriter(os.path.join(dst, fileName), parameters['outputFormat'],
+                      list(summary)) as writer:
+        writer.write(summary)
+
+
+def _rank_values(data, column):
+    # type: (pandas.DataFrame, str) -> pandas.DataFrame
+    """Return the number of rows of each value of 'column' per group,
+    the position of its first row and its rank within the group.
+
+    The values are ranked by descending number of rows, breaking ties
+    by their first appearance in 'data' (as value_counts() does).
+
+    Keyword Arguments:
+        data   -- dataframe with "group", "pos" and 'column' columns
+        column -- column to rank
+    """
+    counts = data.groupby(['group', column], sort=False)['pos'].agg(
+            ['size', 'min']).reset_index()
+    counts.columns = ['group', column, 'count', 'first']
+    counts.sort_values(['group', 'count', 'first'],
+                       ascending=[True, False, True], inplace=True)
+    counts['rank'] = counts.groupby('group').cumcount()
+    return counts
@@ -0,0 +1,185 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Write the MSSearch output tables in chunks, without building the
+whole file contents (e.g. the XLSX workbook) in memory:
+    > OutputWriter:
+        Append dataframe chunks to a XLSX, CSV, TSV or Parquet file.
+
+The table written still has to be in memory: the chunks only bound the
+memory used by the file format on top of it.
+
+The XLSX files are written with xlsxwriter's "constant_memory" mode, so
+each row is flushed to disk as soon as it is written, and a new sheet
+is started every time the current one reaches Excel's maximum number of
+rows. The Parquet format requires the optional "pyarrow" package.
+
+Examples:
+    >>> from MSSearch.Writer import OutputWriter
+    >>> with OutputWriter('mssearch_comp_db.xlsx', 'xlsx',
+    ...                   list(result)) as writer:
+    ...     for start in range(0, len(result), 50000):
+    ...         writer.write(result.iloc[start : start + 50000])
+"""
+
+import math
+
+import xlsxwriter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Optional dependency, only needed for the Parquet format
+    pyarrow = None
+
+
+# Supported file formats and their column separators (text formats)
+FORMATS = {'xlsx': None, 'csv': ',', 'tsv': '\t', 'parquet': None}
+# Maximum number of rows of a XLSX sheet (header included)
+MAX_XLSX_ROWS = 1048576
+
+
+class OutputWriter(object):
+    """An OutputWriter object writes dataframe batches with the same
+    columns, one after another, into a single output file.
+
+    Attributes:
+        path  (Public[str])
+            Path of the output file.
+        fileFormat  (Public[str])
+            Output file format ("xlsx", "csv", "tsv" or "parquet").
+        columns  (Public[list])
+            Column names of the output table.
+        _file  (Private[object])
+            Output file, XLSX workbook or Parquet writer.
+        _sheet  (Private[xlsxwriter.Worksheet])
+            XLSX sheet currently being written.
+        _headerFormat  (Private[xlsxwriter.Format])
+            Cell format of the XLSX header.
+        _row  (Private[int])
+            Next row of the XLSX sheet, or number of batches written in
+            the text and Parquet formats.
+    """
+
+    def __init__(self, path, fileFormat, columns, data=None):
+        # type: (str, str, list, pandas.DataFrame) -> OutputWriter
+        """Constructor of the class OutputWriter.
+
+        Keyword Arguments:
+            path       -- path of the output file (overwritten if it
+                          already exists)
+            fileFormat -- "xlsx", "csv", "tsv" or "parquet"
+            columns    -- column names of the output table
+            data       -- whole dataframe to be written, to take the
+                          Parquet column types from (otherwise they are
+                          inferred from the first batch) [default: None]
+        """
+        fileFormat = fileFormat.lower()
+        if (fileFormat not in FORMATS):
+            raise ValueError("Unknown output format '{0}'".format(fileFormat))
+        if ((fileFormat == 'parquet') and (pyarrow is None)):
+            raise ImportError(("The Parquet output format requires the "
+                               "'pyarrow' package."))
+        self.path = path
+        self.fileFormat = fileFormat
+        self.columns = list(columns)
+        self._file = None
+        self._sheet = None
+        self._headerFormat = None
+        self._row = 0
+        if (fileFormat == 'xlsx'):
+            self._file = xlsxwriter.Workbook(path, {'constant_memory': True})
+            # Same header style as pandas.DataFrame.to_excel()
+            self._headerFormat = self._file.add_format(
+                    {'bold': True, 'border': 1, 'align': 'center',
+                     'valign': 'top'})
+            self._add_sheet()
+        elif (FORMATS[fileFormat] is not None):
+            self._file = open(path, 'w', newline='')
+        elif (data is not None):
+            # A column without values in the first batch would be
+            # inferred with a different type than in the later ones
+            schema = pyarrow.Schema.from_pandas(data[self.columns],
+                                                preserve_index=False)
+            self._file = pyarrow.parquet.ParquetWriter(path, schema)
+
+    def __enter__(self):
+        # type: () -> OutputWriter
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # type: (type, Exception, traceback) -> bool
+        self.close()
+        return False
+
+    def write(self, data):
+        # type: (pandas.DataFrame) -> None
+        """Append the rows of 'data' to the output file.
+
+        Keyword Arguments:
+            data -- dataframe with the columns of the output table
+        """
+        data = data[self.columns]
+        if (self.fileFormat == 'xlsx'):
+            self._write_xlsx(data)
+        elif (self.fileFormat == 'parquet'):
+            if (self._file is None):
+                table = pyarrow.Table.from_pandas(data, preserve_index=False)
+                self._file = pyarrow.parquet.ParquetWriter(self.path,
+                                                           table.schema)
+            else:
+                table = pyarrow.Table.from_pandas(
+                        data, schema=self._file.schema, preserve_index=False)
+            self._file.write_table(table)
+        else:
+            data.to_csv(self._file, sep=FORMATS[self.fileFormat],
+                        header=(self._row == 0), index=False)
+            self._row += 1
+
+    def close(self):
+        # type: () -> None
+        """Write the pending information and close the output file."""
+        if (self.fileFormat == 'parquet'):
+            if (self._file is None):
+                # No batches were written: create an empty table
+                schema = pyarrow.schema([(x, pyarrow.null())
+                                         for x in self.columns])
+                self._file = pyarrow.parquet.ParquetWriter(self.path, schema)
+        if (self._file is not None):
+            self._file.close()
+            self._file = None
+
+    def _add_sheet(self):
+        # type: () -> None
+        """Start a new XLSX sheet, writing the header in its first
+        row.
+        """
+        self._sheet = self._file.add_worksheet()
+        self._sheet.write_row(0, 0, self.columns, self._headerFormat)
+        self._row = 1
+
+    def _write_xlsx(self, data):
+        # type: (pandas.DataFrame) -> None
+        """Write the rows of 'data' in the current XLSX sheet, starting
+        a new sheet whenever the current one is full.
+
+        Missing values are left as empty cells, as in
+        pandas.DataFrame.to_excel().
+
+        Keyword Arguments:
+            data -- dataframe with the columns of the output table
+        """
+        # Convert every column to a list of Python objects at once
+        values = [data[x].tolist() for x in self.columns]
+        for row in zip(*values):
+            if (self._row == MAX_XLSX_ROWS):
+                self._add_sheet()
+            for col, value in enumerate(row):
+                if ((value is None)
+                    or (isinstance(value, float) and math.isnan(value))):
+                    continue
+                self._sheet.write(self._row, col, value)
+            self._row += 1
@@ -6,7 +6,7 @@
 """Search the lipid-alike features on the selected LIPID MAPS database
 for bulk structure identification.
 
-The output XLSX file will include every feature with its matched lipid
+The output file (XLSX by default) will include every feature with its matched lipid
 bulk structure and its relevant information such as lipid category or
 formula. It will also include the unmatched features for completeness.
 Optionally, it will generate a lipid category scatter plot from the
@@ -31,37 +31,42 @@ Examples:
     >>> MSSearch.bulk_structure_search(data, parameters)
 """
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import json
-import logging
 import os
 import re
-import requests
 import time
 import warnings
 
 import numpy
 import pandas
 import pkg_resources
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 
+from LipidFinder.LFProfiler import LFProfiler
+from LipidFinder.LFRunContext import LFRunContext
 from LipidFinder.MSSearch import DataPlots
 from LipidFinder.MSSearch import Summary
+from LipidFinder.MSSearch.Writer import OutputWriter
 from LipidFinder._py3k import viewitems, StringIO, quote_plus
 from LipidFinder._utils import print_progress_bar
+from LipidFinder._utils import LipidMaps
+from LipidFinder._utils.LipidDatabase import load_database
+from LipidFinder._utils.LipidMaps import LipidMapsCache, LipidMapsClient, \
+                                         get_cache_path
 
 
 # Ignore Future Warnings from pandas library
 warnings.simplefilter(action='ignore', category=FutureWarning)
 # Deactivate pandas warnings
 pandas.options.mode.chained_assignment = None
-LIPIDMAPS_URL = 'https://www.lipidmaps.org/tools/ms/py_bulk_search.php'
-# Maximum number of m/z values to send at once to LIPID MAPS
-BATCH_SIZE = 150
+LIPIDMAPS_URL = LipidMaps.LIPIDMAPS_URL
+# Number of rows written at once in the output file
+CHUNK_SIZE = 50000
 
 
-def bulk_structure_search(data, parameters, dst=''):
-    # type: (object, LFParameters, str) -> None
+def bulk_structure_search(data, parameters, dst='', profile=False,
+                          traceMemory=False):
+    # type: (object, LFParameters, str, bool, bool) -> None
     """Search in LIPID MAPS for matches of the m/z values in the input
     dataframe.
 
@@ -72,31 +77,54 @@ def bulk_structure_search(data, parameters, dst=''):
     The resulting dataframe will include every bulk structure match for
     each m/z, including its RT, main class, category and other relevant
     information. If 'dst' is not an absolute path, the current working
-    directory will be used as starting point. If "mssearch_<db>.xslx"
+    directory will be used as starting point. If "mssearch_<db>.<ext>"
     already exists, it will be overwritten without warning.
-    "<db>" stands for the selected LIPID MAPS database.
+    "<db>" stands for the selected LIPID MAPS database and "<ext>" for
+    the output file format (XLSX, CSV, TSV or Parquet).
+    If 'profile' is True, the time and memory profile of each stage is
+    written in the log file and saved in "mssearch_profile.json".
 
     Keyword arguments:
-        data       -- LFDataFrame or pandas.DataFrame instance
-        parameters -- LipidFinder's MS Search parameters instance
-        dst        -- destination directory where the log file, the
-                      output XSLX file and the category scatter plot
-                      figure (if selected) will be saved
-                      [default: current working directory]
+        data        -- LFDataFrame or pandas.DataFrame instance
+        parameters  -- LipidFinder's MS Search parameters instance
+        dst         -- destination directory where the log file, the
+                       output file and the category scatter plot
+                       figure (if selected) will be saved
+                       [default: current working directory]
+        profile     -- record the time and memory profile of each
+                       stage? [default: False]
+        traceMemory -- trace the memory allocated by each stage (slow)?
+                       [default: False]
     """
     # Set the log file where the information about the steps performed
     # is saved
     logFilePath = 'mssearch.log'
     if (dst):
         logFilePath = os.path.join(dst, logFilePath)
-    # Create logger and its file handler
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(logFilePath)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('[%(asctime)s] %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    with LFRunContext(logFilePath) as context, \
+            LFProfiler(profile or traceMemory, traceMemory) as profiler:
+        _bulk_structure_search(data, parameters, dst, context.logger,
+                               profiler)
+        profiler.log_summary(context.logger)
+        profiler.write_json(os.path.join(dst, 'mssearch_profile.json'),
+                            'MSSearch')
+
+
+def _bulk_structure_search(data, parameters, dst, logger, profiler):
+    # type: (object, LFParameters, str, Logger, LFProfiler) -> None
+    """Search in LIPID MAPS for matches of the m/z values in the input
+    dataframe, writing the information about the steps performed in
+    'logger'.
+
+    Keyword arguments:
+        data       -- LFDataFrame or pandas.DataFrame instance
+        parameters -- LipidFinder's MS Search parameters instance
+        dst        -- destination directory where the output file and
+                      the category scatter plot figure (if selected)
+                      will be saved
+        logger     -- logger of the run
+        profiler   -- LFProfiler instance of the run
+    """
     # Write initial information in log file
     logger.info('Starting MS Search on %s. Input dataframe has %d rows.',
                  parameters['database'], len(data.index))
@@ -115,65 +143,16 @@ def bulk_structure_search(data, parameters, dst=''):
     if (not targetAdducts):
         # If the list is empty, use the complete list of ion adducts
         targetAdducts = parameters._parameters['targetAdducts']['options']
-    # Keep only the adduct information between brackets
-    targetAdducts = [x[x.find('[') + 1 : x.find(']')] for x in targetAdducts]
-    targetAdducts = ','.join(targetAdducts)
-    if (parameters['mzToleranceUnit'] == 'Daltons'):
-        tolerance = parameters['mzTolerance']
-    # Get matches in batches to balance the number of requests and the
-    # amount of information requested
-    matches = pandas.DataFrame()
-    # Calculate progress increment for each batch
-    increment = 63.0 / numpy.ceil(float(numMZ) / BATCH_SIZE)
-    for start in range(0, numMZ, BATCH_SIZE):
-        mzBatch = mzList[start : start + BATCH_SIZE]
-        # Get a string with one m/z per line (text file alike)
-        mzStr = os.linesep.join(map(str, mzBatch))
-        if (parameters['mzToleranceUnit'] == 'PPM'):
-            # Calculate maximum tolerance in Da from tolerance in parts
-            # per million (ppm)
-            tolerance = mzBatch[-1] * parameters['mzTolerance'] / 1e6
-        # Create the data package with the query
-        if (parameters['categories']):
-            mpData = MultipartEncoder(
-                    fields={'CHOICE': parameters['database'], 'sort': 'DELTA',
-                            'file': ('file', StringIO(mzStr), 'text/plain'),
-                            'tol': str(tolerance), 'ion': targetAdducts,
-                            'even': '2' if parameters['evenChains'] else '1',
-                            'category': ','.join(parameters['categories'])})
-        else:
-            mpData = MultipartEncoder(
-                    fields={'CHOICE': parameters['database'], 'sort': 'DELTA',
-                            'file': ('file', StringIO(mzStr), 'text/plain'),
-                            'tol': str(tolerance), 'ion': targetAdducts,
-                            'even': '2' if parameters['evenChains'] else '1'})
-        # Request the table containing the matches from LIPID MAPS
-        try:
-            response = requests.post(
-                    LIPIDMAPS_URL, data=mpData,
-                    headers={'Content-Type': mpData.content_type})
-        except:
-            raise Exception(("Connection error with the database. Please check "
-                             "your network and try again after a few minutes."))
-        # Go to next batch if this one returned nothing
-        if (len(response.text) == 0):
-            # Update progress bar
-            progress += increment
-            print_progress_bar(progress, 100, prefix='MSSearch progress:')
-            continue
-        # Process the response to create a dataframe
-        batchMatches = pandas.read_csv(StringIO(response.text), sep='\t',
-                                         engine='python', index_col=False)
-        if (batchMatches.empty):
-            # Update progress bar
-            progress += increment
-            print_progress_bar(progress, 100, prefix='MSSearch progress:')
-            continue
-        # Join all the information already gathered
-        matches = matches.append(batchMatches, ignore_index=True)
-        # Update progress bar
-        progress += increment
-        print_progress_bar(progress, 100, prefix='MSSearch progress:')
+    # Get matches from the local structure database if selected, or
+    # from LIPID MAPS otherwise
+    profiler.start('LIPID MAPS search', data)
+    if (parameters['localSearch']):
+        matches = _local_search(mzList, targetAdducts, parameters)
+    else:
+        matches = _lipidmaps_search(mzList, targetAdducts, parameters,
+                                    logger)
+    progress = 63
+    print_progress_bar(progress, 100, prefix='MSSearch progress:')
     if (matches.empty):
         matches = pandas.DataFrame(
                 columns=[mzCol, 'Matched MZ', 'Delta', 'Bulk Structure',
@@ -181,6 +160,8 @@ def bulk_structure_search(data, parameters, dst=''):
     else:
         # Rename m/z column
         matches.rename(columns={'Input Mass': mzCol}, inplace=True)
+    profiler.stop(matches)
+    profiler.start('Match assembly', data)
     # Round 'Input Mass' values that might have been altered by LIPID
     # MAPS server
     matches[mzCol] = matches[mzCol].apply(round, ndigits=data._resolution)
@@ -194,8 +175,6 @@ def bulk_structure_search(data, parameters, dst=''):
     # rows in 'data' that did not have a match
     matches.insert(3, rtCol, 0.0)
     matches.insert(4, 'Polarity', '')
-    # Calculate progress increment for each batch
-    increment = 33.0 / numpy.ceil(len(data) / float(BATCH_SIZE))
     # Create result dataframe with all the columns in that dataframe
     colNames = [x for x in list(data) if x not in [mzCol, rtCol, 'Polarity']]
     extraCols = []
@@ -207,60 +186,205 @@ def bulk_structure_search(data, parameters, dst=''):
             # if that column name is already in the dataframe
             extraCols.append('src_' + column)
             data.rename(columns={column: 'src_' + column}, inplace=True)
-    result = pandas.DataFrame(columns=list(matches) + extraCols)
-    # Ensure the polarity column contains only strings so the
-    # conditional test in the next loop works as expected
+    # Ensure the polarity column contains only strings so the polarity
+    # masks below work as expected
     data['Polarity'].replace(numpy.nan, '', regex=True, inplace=True)
-    # For those m/z values with more than one RT, the whole set of
-    # matches is replicated for every RT
-    for index, row in data.iterrows():
-        mzMatches = matches.loc[matches[mzCol] == row[mzCol]]
-        # Remove positive adduct matches for m/z found in negative mode,
-        # and negative adduct matches for m/z found in positive mode
-        if (row['Polarity'].lower().startswith('n')):
-            mzMatches = mzMatches.loc[mzMatches['Adduct'].str[-1] != '+']
-        elif (row['Polarity'].lower().startswith('p')):
-            mzMatches = mzMatches.loc[mzMatches['Adduct'].str[-1] != '-']
-        if (mzMatches.empty):
-            # Unmatched m/z from 'data'
-            mzMatches = mzMatches.append(row[[mzCol, rtCol, 'Polarity']],
-                                         ignore_index = True)
-        else:
-            # Copy RT and polarity values to each matched m/z
-            mzMatches[rtCol] = row[rtCol]
-            mzMatches['Polarity'] = row['Polarity']
-        # Copy the extra columns (if any) to each matched m/z
-        for col in extraCols:
-            mzMatches[col] = row[col]
-        result = result.append(mzMatches, ignore_index=True)
-        if ((index + 1) % BATCH_SIZE == 0):
-            # Update progress bar
-            progress += increment
-            print_progress_bar(progress, 100, prefix='MSSearch progress:')
+    result = _assemble_results(data, matches, mzCol, rtCol, extraCols)
+    # Update progress bar
+    progress += 33
+    print_progress_bar(progress, 100, prefix='MSSearch progress:')
+    profiler.stop(result)
+    profiler.start('Output', result)
     # Sort the results by m/z, delta PPM and matched m/z to ease the
-    # manipulation of the output XLSX file
+    # manipulation of the output file
     result.sort_values([mzCol, 'Delta_PPM', 'Matched MZ'], inplace=True,
                        kind='mergesort')
-    # Create the XLSX file with the whole putative profiling dataframe
-    outPath = os.path.join(
-            dst, 'mssearch_{0}.xlsx'.format(parameters['database'].lower()))
-    result.to_excel(outPath, index=False, engine='xlsxwriter')
+    # Create the output file with the whole putative profiling
+    # dataframe, written in chunks (the dataframe is sorted and used by
+    # the summary and the plot, so it is assembled in memory anyway)
+    outPath = os.path.join(dst, 'mssearch_{0}.{1}'.format(
+            parameters['database'].lower(), parameters['outputFormat']))
+    with OutputWriter(outPath, parameters['outputFormat'], list(result),
+                      result) as writer:
+        for start in range(0, len(result), CHUNK_SIZE):
+            writer.write(result.iloc[start : start + CHUNK_SIZE])
     if (parameters['summary']):
-        # Create summary XLSX file from the putative profiling
+        # Create summary file from the putative profiling
         # dataframe, keeping only one row per m/z and RT with the most
         # frequent lipid category
         Summary.create_summary(result, parameters, dst)
+    profiler.stop(result)
     # Update progress bar
     print_progress_bar(98, 100, prefix='MSSearch progress:')
     # Generate the category scatter plot of the most common lipid
     # category per m/z and RT
     if (parameters['plotCategories']):
+        profiler.start('Category plot', result)
         DataPlots.category_scatterplot(result, parameters, dst)
+        profiler.stop(result)
     # Update progress bar
     print_progress_bar(100, 100, prefix='MSSearch progress:')
-    # Write the final information in log file and close handler
+    # Write the final information in log file
     matches = result[result['Category'].notna()]
     logger.info('MS Search completed. %d matches found for %d m/z values.\n',
                  len(matches), len(matches[mzCol].unique()))
-    handler.close()
-    logger.removeHandler(handler)
+
+
+def _assemble_results(data, matches, mzCol, rtCol, extraCols):
+    # type: (object, pandas.DataFrame, str, str, list) -> pandas.DataFrame
+    """Return a dataframe with the matches of every row of 'data',
+    joined on the m/z value, with the RT, polarity and extra columns of
+    that row. The rows of 'data' without matches are included once,
+    with empty match information.
+
+    For those m/z values with more than one RT, the whole set of matches
+    is replicated for every RT. Positive adduct matches are discarded
+    for rows in negative mode, and negative adduct matches for rows in
+    positive mode. The rows follow the order of 'data', and the matches
+    of each row the order of 'matches'.
+
+    Keyword arguments:
+        data      -- LFDataFrame or pandas.DataFrame instance
+        matches   -- dataframe of matches
+        mzCol     -- m/z column name
+        rtCol     -- retention time column name
+        extraCols -- columns of 'data' copied to each match
+    """
+    # Join every row of 'data' with the matches of its m/z at once
+    pairs = pandas.merge(
+            pandas.DataFrame({'key': data[mzCol].values,
+                              'dataIdx': numpy.arange(len(data))}),
+            pandas.DataFrame({'key': matches[mzCol].values,
+                              'matchIdx': numpy.arange(len(matches))}),
+            on='key', how='inner')
+    dataIdx = pairs['dataIdx'].values
+    matchIdx = pairs['matchIdx'].values
+    # Remove positive adduct matches for m/z found in negative mode, and
+    # negative adduct matches for m/z found in positive mode
+    polarity = data['Polarity'].str.lower()
+    isNegative = polarity.str.startswith('n').values[dataIdx]
+    isPositive = polarity.str.startswith('p').values[dataIdx]
+    charge = matches['Adduct'].str[-1].values[matchIdx]
+    keep = ~((isNegative & (charge == '+')) | (isPositive & (charge == '-')))
+    dataIdx = dataIdx[keep]
+    matchIdx = matchIdx[keep]
+    # Get the rows of 'data' left without matches (anti-join)
+    unmatched = numpy.ones(len(data), dtype=bool)
+    unmatched[dataIdx] = False
+    unmatchedIdx = numpy.flatnonzero(unmatched)
+    # Copy RT, polarity and extra columns (if any) to each matched m/z
+    matched = matches.iloc[matchIdx].reset_index(drop=True)
+    for col in [rtCol, 'Polarity'] + extraCols:
+        matched[col] = data[col].values[dataIdx]
+    unmatched = pandas.DataFrame(
+            OrderedDict((col, data[col].values[unmatchedIdx])
+                        for col in [mzCol, rtCol, 'Polarity'] + extraCols))
+    result = pandas.concat([matched, unmatched], ignore_index=True)
+    # Restore the order of 'data', keeping the order of the matches of
+    # each row
+    order = numpy.argsort(numpy.concatenate((dataIdx, unmatchedIdx)),
+                          kind='mergesort')
+    result = result.iloc[order].reset_index(drop=True)
+    return result[list(matches) + extraCols]
+
+
+def _lipidmaps_search(mzList, targetAdducts, parameters, logger):
+    # type: (list, list, LFParameters, Logger) -> pandas.DataFrame
+    """Return a dataframe with the matches of every m/z in 'mzList'
+    found by LIPID MAPS bulk search service.
+
+    Keyword arguments:
+        mzList        -- list of unique m/z values
+        targetAdducts -- list of target ion adducts (e.g. "[M+H]+")
+        parameters    -- LipidFinder's MS Search parameters instance
+        logger        -- logger of the run
+    """
+    # The tolerance in PPM is converted to Daltons per batch, so the
+    # requests of a later run would rarely match the cached ones
+    useCache = (parameters['useCache']
+                and (parameters['mzToleranceUnit'] == 'Daltons'))
+    if (useCache):
+        logger.info('Using the LIPID MAPS cache in "%s".', get_cache_path())
+    elif (parameters['useCache']):
+        logger.info('The LIPID MAPS cache is not used with a tolerance in '
+                    'PPM.')
+    # Keep only the adduct information between brackets
+    targetAdducts = [x[x.find('[') + 1 : x.find(']')] for x in targetAdducts]
+    targetAdducts = ','.join(targetAdducts)
+    if (parameters['mzToleranceUnit'] == 'Daltons'):
+        tolerance = parameters['mzTolerance']
+    # Get matches in batches to balance the number of requests and the
+    # amount of information requested
+    batchSize = parameters['batchSize']
+    queries = []
+    for start in range(0, len(mzList), batchSize):
+        mzBatch = mzList[start : start + batchSize]
+        if (parameters['mzToleranceUnit'] == 'PPM'):
+            # Calculate maximum tolerance in Da from tolerance in parts
+            # per million (ppm)
+            tolerance = mzBatch[-1] * parameters['mzTolerance'] / 1e6
+        # Create the data package with the query, including a string
+        # with one m/z per line (text file alike)
+        fields = OrderedDict([
+                ('CHOICE', parameters['database']), ('sort', 'DELTA'),
+                ('file', os.linesep.join(map(str, mzBatch))),
+                ('tol', str(tolerance)), ('ion', targetAdducts),
+                ('even', '2' if parameters['evenChains'] else '1')])
+        if (parameters['categories']):
+            fields['category'] = ','.join(parameters['categories'])
+        queries.append(fields)
+    # Calculate progress increment for each batch
+    increment = 63.0 / max(len(queries), 1)
+    numDone = [0]
+    def update_progress(index):
+        # Update progress bar after each response
+        numDone[0] += 1
+        print_progress_bar(numDone[0] * increment, 100,
+                           prefix='MSSearch progress:')
+    # Request the tables containing the matches from LIPID MAPS,
+    # several batches at a time
+    cache = LipidMapsCache() if (useCache) else None
+    try:
+        with LipidMapsClient(LIPIDMAPS_URL, parameters['maxRequests'],
+                             cache=cache) as client:
+            texts = client.search(queries, update_progress)
+    finally:
+        if (cache is not None):
+            cache.close()
+    batches = []
+    for text in texts:
+        # Skip the batches that returned nothing
+        if (len(text) == 0):
+            continue
+        # Process the response to create a dataframe
+        batchMatches = pandas.read_csv(StringIO(text), sep='\t',
+                                       engine='python', index_col=False)
+        if (not batchMatches.empty):
+            batches.append(batchMatches)
+    # Join all the information gathered
+    return pandas.concat(batches, ignore_index=True) if (batches) \
+           else pandas.DataFrame()
+
+
+def _local_search(mzList, targetAdducts, parameters):
+    # type: (list, list, LFParameters) -> pandas.DataFrame
+    """Return a dataframe with the matches of every m/z in 'mzList'
+    found in the local structure database, with the same columns as the
+    tables returned by LIPID MAPS bulk search service.
+
+    Keyword arguments:
+        mzList        -- list of unique m/z values
+        targetAdducts -- list of target ion adducts (e.g. "[M+H]+")
+        parameters    -- LipidFinder's MS Search parameters instance
+    """
+    if (not parameters['structuresCSVPath']):
+        raise ValueError(("The local search requires the CSV file with the "
+                          "structures of the database (structuresCSVPath)."))
+    database = load_database(parameters['structuresCSVPath'])
+    tolerance = parameters['mzTolerance']
+    if (parameters['mzToleranceUnit'] == 'PPM'):
+        # Calculate the tolerance in Da of each m/z from the tolerance
+        # in parts per million (ppm)
+        tolerance = numpy.asarray(mzList, dtype=float) * tolerance / 1e6
+    return database.search(mzList, tolerance, targetAdducts,
+                           parameters['categories'], parameters['evenChains'])
@@ -0,0 +1,160 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Set of methods aimed to run PeakFilter over several input datasets in
+a pool of long-lived worker processes:
+    > read_manifest():
+        Return the list of jobs described in a CSV or JSON manifest.
+
+    > peak_filter_batch():
+        Run PeakFilter for every job and return the table with the
+        outcome of each one.
+
+Each job has its own output folder (with its own "peakfilter.log" file)
+inside the batch destination directory. Worker processes are reused
+across jobs, so Python, pandas, scipy and matplotlib are only imported
+once per worker.
+
+Examples:
+    >>> from PeakFilter import Batch
+    >>> jobs = Batch.read_manifest('manifest.csv')
+    >>> Batch.peak_filter_batch(jobs, 'results', numWorkers=4)
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+
+import pandas
+
+from LipidFinder import PeakFilter
+from LipidFinder.Configuration import LFParameters
+from LipidFinder.LFDataFrame import LFDataFrame
+
+
+# Columns of the manifest file ("output" is optional)
+MANIFEST_COLUMNS = ['input', 'params', 'output']
+
+
+def read_manifest(src):
+    # type: (str) -> list
+    """Return the list of jobs described in the given CSV or JSON
+    manifest file.
+
+    The manifest must have an "input" (file or folder with input data)
+    and a "params" (parameters JSON file) field per job, and optionally
+    an "output" field with the name of the job's output folder (by
+    default, "job_<number>"). The output folders must be different, as
+    each job would overwrite the files of the previous one otherwise. A
+    JSON manifest must contain a list of objects. Relative paths are
+    resolved from the manifest's folder.
+
+    Keyword Arguments:
+        src -- manifest file path
+    """
+    if (src.lower().endswith('.json')):
+        manifest = pandas.read_json(src, orient='records', dtype=False)
+    else:
+        manifest = pandas.read_csv(src, dtype=str, keep_default_na=False)
+    missing = set(MANIFEST_COLUMNS[:2]) - set(manifest.columns)
+    if (missing):
+        raise ValueError("Missing manifest column(s): {0}".format(
+                ', '.join(sorted(missing))))
+    srcDir = os.path.dirname(os.path.abspath(src))
+    jobs = []
+    for index, row in enumerate(manifest.to_dict('records'), start=1):
+        output = row.get('output', '')
+        if (not isinstance(output, str) or not output):
+            output = 'job_{0:03d}'.format(index)
+        jobs.append({'input': os.path.join(srcDir, row['input']),
+                     'params': os.path.join(srcDir, row['params']),
+                     'output': output})
+    # Reject jobs sharing their output folder
+    outputs = pandas.Series([os.path.normpath(job['output']) for job in jobs])
+    duplicates = outputs[outputs.duplicated()].unique()
+    if (len(duplicates) > 0):
+        raise ValueError("Duplicated manifest output(s): {0}".format(
+                ', '.join(duplicates)))
+    return jobs
+
+
+def peak_filter_batch(jobs, dst='', numWorkers=None):
+    # type: (list, str, int) -> pandas.DataFrame
+    """Run PeakFilter for every job and return the table with the
+    outcome of each one.
+
+    A failed job does not stop the batch: its error message is reported
+    in the "Error" column. The table is saved in "batch_summary.csv"
+    inside 'dst', and the overall throughput (files per hour and input
+    rows per second) is printed at the end.
+
+    Keyword Arguments:
+        jobs       -- list of jobs as returned by read_manifest()
+        dst        -- destination directory [default: current working
+                      directory]
+        numWorkers -- number of worker processes
+                      [default: number of processors]
+    """
+    tasks = [(job['input'], job['params'], os.path.join(dst, job['output']))
+             for job in jobs]
+    startTime = time.time()
+    pool = multiprocessing.Pool(processes=numWorkers,
+                                initializer=_init_worker)
+    try:
+        results = list(pool.imap(_run_job, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    elapsedTime = time.time() - startTime
+    summary = pandas.DataFrame(
+            results, columns=['Input', 'Output', 'Input Rows', 'Output Rows',
+                              'FDR', 'Seconds', 'Error'])
+    # Keep row counts as integers even if some jobs failed
+    summary[['Input Rows', 'Output Rows']] = \
+            summary[['Input Rows', 'Output Rows']].astype('Int64')
+    summary.to_csv(os.path.join(dst, 'batch_summary.csv'), index=False)
+    # Report the overall throughput of the successful jobs
+    successful = summary[summary['Error'] == '']
+    print(("Processed {0} of {1} files in {2:.1f} seconds: {3:.1f} files/hour, "
+           "{4:.1f} rows/sec").format(
+            len(successful), len(summary), elapsedTime,
+            len(successful) * 3600.0 / elapsedTime,
+            successful['Input Rows'].sum() / elapsedTime))
+    return summary
+
+
+def _init_worker():
+    # type: () -> None
+    """Silence the progress bars of the worker processes."""
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _run_job(task):
+    # type: (tuple) -> list
+    """Run PeakFilter for the given job and return its outcome: input
+    path, output folder, number of input and output rows, False
+    Discovery Rate, elapsed seconds and error message (empty if
+    successful).
+
+    Keyword Arguments:
+        task -- tuple with the input data path, the parameters JSON
+                file path and the destination directory
+    """
+    src, paramsSrc, dst = task
+    startTime = time.time()
+    numRows = None
+    try:
+        parameters = LFParameters(module='peakfilter', src=paramsSrc)
+        data = LFDataFrame(src, parameters)
+        numRows = len(data.index)
+        if (not os.path.isdir(dst)):
+            os.makedirs(dst)
+        fdrValue = PeakFilter.peak_filter(data, parameters, dst)
+    except Exception as e:
+        return [src, dst, numRows, None, None, time.time() - startTime,
+                '{0}: {1}'.format(type(e).__name__, e)]
+    return [src, dst, numRows, len(data.index), fdrValue,
+            time.time() - startTime, '']
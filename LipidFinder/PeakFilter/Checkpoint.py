@@ -0,0 +1,170 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Set of methods aimed to save and restore the state of the data
+between PeakFilter stages:
+    > get_stage_keys():
+        Return the checkpoint key of each stage for the given input data
+        and parameters.
+
+    > save_checkpoint():
+        Save the current state of the data in a binary checkpoint file.
+
+    > restore_latest():
+        Restore the data from the latest valid checkpoint file found.
+
+    > remove_checkpoints():
+        Remove the checkpoint files of a folder.
+
+The key of each stage is computed from a hash of the input data and the
+stage fingerprint provided by LFParameters (based on the parameters
+read by that stage and all its predecessors), so changing a parameter
+only invalidates the checkpoints of the stages that depend on it.
+
+Examples:
+    >>> from Configuration import LFParameters
+    >>> from LFDataFrame import LFDataFrame
+    >>> from PeakFilter import Checkpoint
+    >>> parameters = LFParameters('peakfilter', 'parameters.json')
+    >>> data = LFDataFrame('dataset.csv', parameters)
+    >>> keys = Checkpoint.get_stage_keys(data, parameters,
+    ...                                  ['QCCalcs', 'SolventCalcs'])
+    >>> data, numStages = Checkpoint.restore_latest(data, 'checkpoints',
+    ...                                             keys)
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+import pandas
+
+
+def get_stage_keys(data, parameters, stages):
+    # type: (LFDataFrame, LFParameters, list) -> list
+    """Return the checkpoint key of each stage in 'stages'.
+
+    Each key is the SHA-1 digest of the input data hash and the
+    cumulative fingerprint of the stage, so it depends on every
+    preceding stage too.
+
+    Keyword Arguments:
+        data       -- LFDataFrame instance before any stage is applied
+        parameters -- LipidFinder's PeakFilter parameters instance
+        stages     -- ordered list of stage names
+    """
+    # Hash the content of the input data, including its column names
+    sha = hashlib.sha1()
+    sha.update(json.dumps(list(map(str, data.columns))).encode('utf-8'))
+    sha.update(pandas.util.hash_pandas_object(data, index=True).values)
+    dataHash = sha.hexdigest()
+    keys = []
+    for stage in stages:
+        sha = hashlib.sha1(dataHash.encode('utf-8'))
+        sha.update(parameters.stage_fingerprint(stage).encode('utf-8'))
+        keys.append(sha.hexdigest())
+    return keys
+
+
+def save_checkpoint(data, dst, key):
+    # type: (LFDataFrame, str, str) -> None
+    """Save the current state of 'data' (including its removal ledger)
+    in a binary checkpoint file named after 'key'. The logger of 'data'
+    is not saved.
+
+    Keyword Arguments:
+        data -- LFDataFrame instance
+        dst  -- checkpoint directory
+        key  -- stage checkpoint key
+    """
+    if (not os.path.isdir(dst)):
+        os.makedirs(dst)
+    filePath = _checkpoint_path(dst, key)
+    # Write to a temporary file first so an interrupted run cannot leave
+    # a corrupted checkpoint behind
+    tmpPath = '{0}.{1}.tmp'.format(filePath, os.getpid())
+    logger = data.logger
+    data.logger = None
+    try:
+        with open(tmpPath, 'wb') as chkFile:
+            pickle.dump(data, chkFile, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        data.logger = logger
+    os.replace(tmpPath, filePath)
+
+
+def restore_latest(data, src, keys):
+    # type: (LFDataFrame, str, list) -> tuple
+    """Return the LFDataFrame restored from the latest valid checkpoint
+    found in 'src' and the number of stages it covers, or 'data' and 0
+    if none was found.
+
+    The restored LFDataFrame uses the logger of 'data'. The checkpoint
+    files are loaded with pickle, so 'src' must only contain files
+    created by save_checkpoint() (never load checkpoints from an
+    untrusted source).
+
+    Keyword Arguments:
+        data -- LFDataFrame instance
+        src  -- checkpoint directory
+        keys -- checkpoint key of each stage, in order
+    """
+    for index in range(len(keys) - 1, -1, -1):
+        filePath = _checkpoint_path(src, keys[index])
+        if (not os.path.isfile(filePath)):
+            continue
+        try:
+            with open(filePath, 'rb') as chkFile:
+                restored = pickle.load(chkFile)
+        except (EOFError, pickle.UnpicklingError):
+            # Ignore corrupted checkpoints
+            continue
+        if (not isinstance(restored, type(data))):
+            # Ignore checkpoints saved in a former format
+            continue
+        restored.logger = data.logger
+        return (restored, index + 1)
+    return (data, 0)
+
+
+def remove_checkpoints(src, keys=None):
+    # type: (str, list) -> int
+    """Remove the checkpoint files of the given keys (or every
+    checkpoint file, including the temporary ones left by interrupted
+    runs) from 'src' and return the number of files removed. The folder
+    is removed too if it is left empty.
+
+    Keyword Arguments:
+        src  -- checkpoint directory
+        keys -- checkpoint keys to remove [default: every checkpoint]
+    """
+    if (not os.path.isdir(src)):
+        return 0
+    if (keys is None):
+        filePaths = glob.glob(os.path.join(src, 'peakfilter_*.pkl')) \
+                    + glob.glob(os.path.join(src, 'peakfilter_*.pkl.*.tmp'))
+    else:
+        filePaths = [_checkpoint_path(src, key) for key in keys]
+    numRemoved = 0
+    for filePath in filePaths:
+        if (os.path.isfile(filePath)):
+            os.remove(filePath)
+            numRemoved += 1
+    if (not os.listdir(src)):
+        os.rmdir(src)
+    return numRemoved
+
+
+def _checkpoint_path(src, key):
+    # type: (str, str) -> str
+    """Return the path of the checkpoint file for the given key.
+
+    Keyword Arguments:
+        src -- checkpoint directory
+        key -- stage checkpoint key
+    """
+    return os.path.join(src, 'peakfilter_{0}.pkl'.format(key))
@@ -28,9 +28,12 @@ Examples:
     >>> ContaminantRemoval.remove_stacks(data, parameters)
 """
 
+from bisect import bisect_left, bisect_right
+
 import numpy
 import pandas
 
+from LipidFinder._utils import Counters
 from LipidFinder._utils import mz_delta, mz_tol_range, rt_tol_range
 
 
@@ -70,8 +73,8 @@ def remove_contaminants(data, parameters):
         data.reset_index(inplace=True, drop=True)
 
 
-def remove_adducts(data, parameters):
-    # type: (LFDataFrame, LFParameters) -> None
+def remove_adducts(data, parameters, engine='reference'):
+    # type: (LFDataFrame, LFParameters, str) -> None
     """Retain only the highest intensity adduct from those found in
     the input data.
 
@@ -84,6 +87,9 @@ def remove_adducts(data, parameters):
     Keyword Arguments:
         data       -- LFDataFrame instance
         parameters -- LipidFinder's PeakFilter parameters instance
+        engine     -- "reference" or "fast" implementation of the
+                      adduct search (same results)
+                      [default: "reference"]
     """
     firstSampleIndex = parameters['firstSampleIndex'] - 1
     lastSampleIndex = firstSampleIndex \
@@ -99,8 +105,12 @@ def remove_adducts(data, parameters):
     rtArray = data[parameters['rtCol']].values
     # Get the replicates intensities as a new dataframe
     replicates = data.iloc[:, firstSampleIndex : lastSampleIndex]
+    if (engine == 'fast'):
+        repAdductRemoval = _rep_adduct_removal_fast
+    else:
+        repAdductRemoval = __rep_adduct_removal__
     replicates = replicates.apply(
-            __rep_adduct_removal__, adductsPairs=adductsPairs,
+            repAdductRemoval, adductsPairs=adductsPairs,
             adducts=adducts, mzArray=mzArray, rtArray=rtArray,
             parameters=parameters)
     # Overwrite data in original dataframe
@@ -144,6 +154,9 @@ def __rep_adduct_removal__(replicate,    # pandas.Series
     # (default: "")
     adductTags = numpy.empty_like(nonZeroIndices, dtype=str)
     adductTags.fill('')
+    # Number of tolerance-window queries and candidates examined
+    numQueries = 0
+    numCandidates = 0
     for pair in adductsPairs:
         # Get the adducts information of the pair to create the lambda
         # function to calculate the offset of the given mass
@@ -178,6 +191,8 @@ def __rep_adduct_removal__(replicate,    # pandas.Series
             potentialAdducts = numpy.where(
                     (nzMZ >= minAdductMZ) & (nzMZ <= maxAdductMZ)
                     & (nzRT >= minRT) & (nzRT <= maxRT))[0]
+            numQueries += 1
+            numCandidates += potentialAdducts.size
             if (potentialAdducts.size > 0):
                 # Get the index of the adduct with the closest RT to the
                 # subject RT
@@ -220,6 +235,154 @@ def __rep_adduct_removal__(replicate,    # pandas.Series
                     nzRT = numpy.delete(nzRT, adductIndex)
                     adductTags = numpy.delete(adductTags, adductIndex)
             index += 1
+    Counters.increment('ContaminantRemoval.adductQueries', numQueries)
+    Counters.increment('ContaminantRemoval.adductCandidates', numCandidates)
+    return replicate
+
+
+def _rep_adduct_removal_fast(replicate,    # pandas.Series
+                             adductsPairs, # list
+                             adducts,      # pandas.DataFrame
+                             mzArray,      # numpy.array
+                             rtArray,      # numpy.array
+                             parameters    # LFParameters
+                             ):
+    # type: (...) -> pandas.Series
+    """Detect pairs of adducts in the given sample replicate and set to
+    zero the lowest intensity of each pair.
+
+    Same outcome as __rep_adduct_removal__(), but the tolerance limits
+    of every frame are computed at once for each pair, the m/z window of
+    each query is located with a binary search over the m/z values
+    sorted once, and the frames set to zero are flagged instead of
+    deleted from every array, so each query only examines the frames
+    inside its window. The frames are visited in the same order and
+    ties are broken the same way as in the reference implementation.
+
+    Keyword Arguments:
+        replicate    -- replicate's intensities
+        pairs        -- list of paired adducts
+        adducts      -- adducts information
+        mzArray      -- sample replicate's m/z values
+        rtArray      -- sample replicate's rt values
+        parameters   -- LipidFinder's PeakFilter parameters instance
+    """
+    values = replicate.values
+    nonZeroIndices = values.nonzero()[0]
+    nzIntensities = numpy.copy(values[nonZeroIndices])
+    nzMZ = numpy.copy(mzArray[nonZeroIndices])
+    nzRT = numpy.copy(rtArray[nonZeroIndices])
+    numFrames = nonZeroIndices.size
+    # Same dtype as in the reference implementation, so the tags are
+    # compared the same way
+    adductTags = numpy.empty_like(nonZeroIndices, dtype=str)
+    adductTags.fill('')
+    # Positions sorted by m/z (stable, so equal m/z values keep their
+    # original order) to locate each tolerance window
+    order = numpy.argsort(nzMZ, kind='mergesort')
+    sortedMZ = nzMZ[order].tolist()
+    order = order.tolist()
+    rtList = nzRT.tolist()
+    # RT tolerance limits of every frame
+    minRTs, maxRTs = rt_tol_range(nzRT, parameters['maxRTDiffAdjFrame'])
+    minRTs = minRTs.tolist()
+    maxRTs = maxRTs.tolist()
+    alive = [True] * numFrames
+    lastAlive = numFrames - 1
+    adductAddition = parameters['adductAddition']
+    # Number of tolerance-window queries and candidates examined
+    numQueries = 0
+    numCandidates = 0
+
+    def next_alive(position):
+        # Return the first alive position after 'position' (None if
+        # there is none)
+        position += 1
+        while (position < numFrames):
+            if (alive[position]):
+                return position
+            position += 1
+        return None
+
+    def remove(position, lastAlive):
+        # Flag 'position' as removed and return the updated last alive
+        # position
+        alive[position] = False
+        while ((lastAlive >= 0) and not alive[lastAlive]):
+            lastAlive -= 1
+        return lastAlive
+
+    for pair in adductsPairs:
+        pairInfo = adducts.loc[adducts.iloc[:, 0].isin(pair)]
+        # m/z tolerance limits of the adduct of every frame (same
+        # operations as get_offset() in the reference implementation)
+        adductMZ = nzMZ + numpy.absolute(
+                nzMZ - (pairInfo.iloc[1, 1] * (nzMZ - pairInfo.iloc[0, 2])
+                        / pairInfo.iloc[0, 1] + pairInfo.iloc[1, 2]))
+        minAdductMZs, maxAdductMZs = mz_tol_range(
+                adductMZ, parameters['mzFixedError'],
+                parameters['mzPPMError'])
+        minAdductMZs = minAdductMZs.tolist()
+        maxAdductMZs = maxAdductMZs.tolist()
+        srcTag = pairInfo.iloc[0, 0]
+        dstTag = pairInfo.iloc[1, 0]
+        position = 0 if (numFrames > 0) else None
+        if ((position is not None) and not alive[position]):
+            position = next_alive(position)
+        while ((position is not None) and (position < lastAlive)):
+            tag = adductTags[position]
+            if (tag and (tag != pair[0])):
+                position = next_alive(position)
+                continue
+            minRT = minRTs[position]
+            maxRT = maxRTs[position]
+            potentialAdducts = []
+            for i in range(bisect_left(sortedMZ, minAdductMZs[position]),
+                           bisect_right(sortedMZ, maxAdductMZs[position])):
+                candidate = order[i]
+                if (alive[candidate]
+                    and (minRT <= rtList[candidate] <= maxRT)):
+                    potentialAdducts.append(candidate)
+            # Keep the order of the reference implementation
+            potentialAdducts.sort()
+            numQueries += 1
+            numCandidates += len(potentialAdducts)
+            if (not potentialAdducts):
+                position = next_alive(position)
+                continue
+            # Closest RT to the subject RT (first one in case of ties)
+            adductIndex = potentialAdducts[numpy.absolute(
+                    nzRT[potentialAdducts] - nzRT[position]).argmin()]
+            if (nzIntensities[adductIndex] > nzIntensities[position]):
+                if (not adductTags[adductIndex]):
+                    adductTags[adductIndex] = dstTag
+                    if (adductAddition):
+                        values[nonZeroIndices[adductIndex]] += \
+                                nzIntensities[position]
+                    values[nonZeroIndices[position]] = 0
+                    lastAlive = remove(position, lastAlive)
+                    position = next_alive(position)
+                    continue
+                position = next_alive(position)
+            else:
+                if (not tag):
+                    adductTags[position] = srcTag
+                if (adductAddition):
+                    values[nonZeroIndices[position]] += \
+                            nzIntensities[adductIndex]
+                values[nonZeroIndices[adductIndex]] = 0
+                lastAlive = remove(adductIndex, lastAlive)
+                if (adductIndex <= position):
+                    # The reference implementation deletes the adduct
+                    # from the arrays before moving to the next index,
+                    # so it skips the frame right after the current one
+                    position = next_alive(position)
+                    if (position is not None):
+                        position = next_alive(position)
+                else:
+                    position = next_alive(position)
+    Counters.increment('ContaminantRemoval.adductQueries', numQueries)
+    Counters.increment('ContaminantRemoval.adductCandidates', numCandidates)
     return replicate
 
 
@@ -376,6 +539,9 @@ def _collect_stack(array, index, rtGap, stackMZ, parameters):
     rtDiff = 0
     stackList = [index]
     gapCount = 0
+    # Number of tolerance-window queries and candidates examined
+    numQueries = 0
+    numCandidates = 0
     while (gapCount <= parameters['maxStackGap']):
         # Calculate the expected m/z and RT of next stack feature
         nextMZ += stackMZ
@@ -388,6 +554,8 @@ def _collect_stack(array, index, rtGap, stackMZ, parameters):
         matches = numpy.where(
                 (minMZ <= array[:, 0]) & (array[:, 0] <= maxMZ)
                 & (minRT <= array[:, 1]) & (array[:, 1] <= maxRT))[0]
+        numQueries += 1
+        numCandidates += len(matches)
         if (len(matches) == 0):
             gapCount += 1
         else:
@@ -404,4 +572,6 @@ def _collect_stack(array, index, rtGap, stackMZ, parameters):
             rtDiff = 0
             # Reset the number of gaps
             gapCount = 0
+    Counters.increment('ContaminantRemoval.stackQueries', numQueries)
+    Counters.increment('ContaminantRemoval.stackCandidates', numCandidates)
     return (stackList)
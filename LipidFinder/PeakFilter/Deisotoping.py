@@ -19,6 +19,7 @@ Examples:
 import numpy
 
 from LipidFinder._py3k import range, viewvalues, viewitems
+from LipidFinder._utils import Counters
 from LipidFinder._utils import mz_tol_range, rt_tol_range
 
 
@@ -75,6 +76,9 @@ def _detect_sample_isotopes(array, parameters):
     tagArray = numpy.full(len(array), '', dtype=object)
     # Loop over each m/z to search for isotopes
     isotopesIndex = set()
+    # Number of tolerance-window queries and candidates examined
+    numQueries = 0
+    numCandidates = 0
     for index in range(0, len(array)):
         # Skip if frame has already been identified as an isotope
         if (array[index, 3] in isotopesIndex):
@@ -88,6 +92,8 @@ def _detect_sample_isotopes(array, parameters):
             minMZ, maxMZ = mz_tol_range(isotopeMZ, parameters['mzFixedError'],
                                         parameters['mzPPMError'])
             mzMatches = numpy.searchsorted(array[:, 0], [minMZ, maxMZ])
+            numQueries += 1
+            numCandidates += mzMatches[1] - mzMatches[0]
             if (mzMatches[0] == mzMatches[1]):
                 # Have not found any analyte with an isotope-like m/z
                 if (isoPeak == 1):
@@ -155,4 +161,6 @@ def _detect_sample_isotopes(array, parameters):
         else:
             # Tag the analyte as parent
             tagArray[index] = '[{0}][M]{1}'.format(tagID, polSign)
+    Counters.increment('Deisotoping.windowQueries', numQueries)
+    Counters.increment('Deisotoping.candidates', int(numCandidates))
     return tagArray
@@ -18,17 +18,23 @@ Examples:
 """
 
 import os
-import requests
 
 import pandas
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from LipidFinder._py3k import StringIO, range
+from LipidFinder._utils import LipidMaps
+from LipidFinder._utils.LipidDatabase import load_database
+from LipidFinder._utils.LipidMaps import LipidMapsCache, LipidMapsClient
 
 
-LIPIDMAPS_URL = 'https://www.lipidmaps.org/tools/ms/py_bulk_search.php'
+LIPIDMAPS_URL = LipidMaps.LIPIDMAPS_URL
 # Maximum number of m/z values to send at once to LIPID MAPS
-BATCH_SIZE = 150
+BATCH_SIZE = LipidMaps.BATCH_SIZE
+# Mass tolerance (in Daltons) of the target and decoy searches
+TOLERANCE = 0.001
+# Mass added to every structure of the target database to create the
+# decoy database (a very rare lipid mass defect)
+DECOY_SHIFT = 0.5
 
 
 def get_fdr(data, parameters):
@@ -54,16 +60,48 @@ def get_fdr(data, parameters):
                          "M+2K,M+Li,M+2Li")
     else:
         targetAdducts = 'M-H,M-CH3,M-2H,M-3H,M-4H,M.F,M.HF2,M.Cl,M.OAc,M.HCOO'
+    if (parameters['localSearch']):
+        # Match every m/z against the local target database and its
+        # decoy (0.5 Da added to every structure) at once
+        adducts = ['[{0}]{1}'.format(
+                x, '+' if (parameters['polarity'] == 'Positive') else '-')
+                   for x in targetAdducts.split(',')]
+        database = load_database(parameters['structuresCSVPath'])
+        numTargetHits, numDecoyHits = database.count_hits(
+                mzList, TOLERANCE, adducts, (0.0, DECOY_SHIFT))
+        return _get_fdr(numTargetHits, numDecoyHits)
     # Get the number of matches in batches to balance the number of
-    # requests and the amount of information requested
-    numTargetHits = 0
-    numDecoyHits = 0
+    # requests and the amount of information requested. The target and
+    # decoy requests of every batch are sent concurrently.
+    queries = []
     for start in range(0, len(mzList), BATCH_SIZE):
         mzBatch = mzList[start : start + BATCH_SIZE]
         # Get a string with one m/z per line (text file alike)
         mzStr = os.linesep.join(map(str, mzBatch))
-        numTargetHits += _get_num_matches('COMP_DB', mzStr, targetAdducts)
-        numDecoyHits += _get_num_matches('COMP_DB_5', mzStr, targetAdducts)
+        queries.append(_get_query('COMP_DB', mzStr, targetAdducts))
+        queries.append(_get_query('COMP_DB_5', mzStr, targetAdducts))
+    cache = LipidMapsCache() if (parameters['useCache']) else None
+    try:
+        with LipidMapsClient(LIPIDMAPS_URL, cache=cache) as client:
+            texts = client.search(queries)
+    finally:
+        if (cache is not None):
+            cache.close()
+    numTargetHits = sum(_get_num_matches(x) for x in texts[0::2])
+    numDecoyHits = sum(_get_num_matches(x) for x in texts[1::2])
+    return _get_fdr(numTargetHits, numDecoyHits)
+
+
+def _get_fdr(numTargetHits, numDecoyHits):
+    # type: (int, int) -> float
+    """Return the FDR for the given number of target and decoy hits.
+
+    Keyword Arguments:
+        numTargetHits -- number of m/z with matches in the target
+                         database
+        numDecoyHits  -- number of m/z with matches in the decoy
+                         database
+    """
     # Raise an exception if there are no matches in the target database
     if (numTargetHits == 0):
         raise ValueError(("No matches found in the target database. The FDR "
@@ -72,36 +110,34 @@ def get_fdr(data, parameters):
     return float(numDecoyHits) / numTargetHits
 
 
-def _get_num_matches(db, mzStr, adducts, tolerance=0.001):
-    # type: (str, str, str, float) -> int
-    """Return the number of matches for the selected database and
-    parameters.
+def _get_query(db, mzStr, adducts, tolerance=TOLERANCE):
+    # type: (str, str, str, float) -> dict
+    """Return the fields of the LIPID MAPS request for the selected
+    database and parameters.
 
     Keyword Arguments:
         db        -- LIPID MAPS' database
         mzStr     -- string with one m/z per line (text file alike)
         adducts   -- list of adducts separated by commas
         tolerance -- mass tolerance in Daltons (+/- to each m/z)
-                     [default: 0.001]
+                     [default: TOLERANCE]
     """
-    # Create the target data package with the query
-    mpData = MultipartEncoder(
-            fields={'CHOICE': db, 'ion': adducts,
-                    'file': ('file', StringIO(mzStr), 'text/plain'),
-                    'tol': str(tolerance), 'sort': 'DELTA'})
-    # Request the table containing the matches from LIPID MAPS
-    try:
-        response = requests.post(LIPIDMAPS_URL, data=mpData,
-                                 headers={'Content-Type': mpData.content_type})
-    except:
-        raise Exception(("Connection error with the database. Please check your"
-                         " network and try again after a few minutes."))
-    # Process the response to create a dataframe and count the number of
-    # hits (number of m/z that got at least one match in the database)
-    if (len(response.text) == 0):
+    return {'CHOICE': db, 'ion': adducts, 'file': mzStr,
+            'tol': str(tolerance), 'sort': 'DELTA'}
+
+
+def _get_num_matches(text):
+    # type: (str) -> int
+    """Return the number of hits (number of m/z that got at least one
+    match in the database) of the given LIPID MAPS response.
+
+    Keyword Arguments:
+        text -- text of the response (tab-separated table of matches)
+    """
+    if (len(text) == 0):
         return 0
     else:
-        matches = pandas.read_csv(StringIO(response.text), sep='\t',
+        matches = pandas.read_csv(StringIO(text), sep='\t',
                                   engine='python', index_col=False)
         if (matches.empty):
             return 0
@@ -24,6 +24,7 @@ import numpy
 import pandas
 
 from LipidFinder.PeakFilter import Clustering
+from LipidFinder._utils import Counters
 
 
 def process_features(data, parameters):
@@ -130,9 +131,12 @@ def __feat_peak_analysis__(parameters, intensities, repRT):
     # is categorised it is removed, leaving only uncatergorised
     # intensities so the highest can be be selected.
     intensityPeakCat = numpy.copy(intensities)
+    # Number of peaks analysed
+    numPeaks = 0
     # Do while there are uncategorised frames within the feature group.
     # numpy.count_nonzero() counts the number of intensities equal to 0.
     while (sum(peakCategory == '--') > numpy.count_nonzero(intensities == 0)):
+        numPeaks += 1
         intensityPeakCat[numpy.where(peakCategory != '--')[0]] = -1
         # Get the index of the highest intensity uncategorised and set
         # it as the peak centre
@@ -409,6 +413,8 @@ def __feat_peak_analysis__(parameters, intensities, repRT):
                         intensities[peakLowestIndex : nextIndex][pfsArray].max()
     # Set all non "PC" frames to 0
     intensities[numpy.where(peakCategory != 'PC')[0]] = 0
+    Counters.increment('PeakFinder.features')
+    Counters.increment('PeakFinder.peaks', numPeaks)
 
 
 def __solvents_low_rt__(parameters,      # LFParameters
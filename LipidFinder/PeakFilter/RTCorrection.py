@@ -21,6 +21,7 @@ import numpy
 import pandas
 
 from LipidFinder._py3k import range
+from LipidFinder._utils import Counters
 
 
 def correct_retention_time(data, parameters, means=False):
@@ -117,7 +118,10 @@ def __process_sample__(intensity, rtDiff, parameters, repsPerGroup):
         parameters   -- LipidFinder's PeakFilter parameters instance
         repsPerGroup -- number of replicates per sample
     """
+    # Number of passes until no more modifications are performed
+    numPasses = 0
     while True:
+        numPasses += 1
         # Copy 'intensity' array to check later if it has been modified
         oldIntensity = numpy.copy(intensity)
         # Number of frames and replicates in the given feature cluster
@@ -197,3 +201,5 @@ def __process_sample__(intensity, rtDiff, parameters, repsPerGroup):
         # Repeat the process until no more modifications are performed
         if (numpy.array_equal(intensity, oldIntensity)):
             break
+    Counters.increment('RTCorrection.samples')
+    Counters.increment('RTCorrection.passes', numPasses)
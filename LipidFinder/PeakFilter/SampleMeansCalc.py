@@ -22,6 +22,7 @@ import re
 import numpy
 
 from LipidFinder._py3k import range
+from LipidFinder._utils import nonzero_mean
 
 
 def calculate_sample_means(data, parameters):
@@ -51,10 +52,7 @@ def calculate_sample_means(data, parameters):
             # Create the column name for the mean of the current sample
             colName = re.sub('\d+$', "", data.columns[firstIndex]) + '_mean'
             # Get means (not taking into account zeros) of the sample
-            rawMeans = data.iloc[:, firstIndex : lastIndex].apply(
-                    lambda x: x.sum() /
-                        (x.astype(bool).sum() if (x.astype(bool).sum()) else 1),
-                    axis=1)
+            rawMeans = nonzero_mean(data.iloc[:, firstIndex : lastIndex])
             # Round to nearest integer, cast to integer and insert
             # sample means into the dataframe
-            data[colName] = rawMeans.round(0).astype("int64")
+            data[colName] = numpy.round(rawMeans, 0).astype("int64")
@@ -28,6 +28,7 @@ import re
 import pandas
 
 from LipidFinder.PeakFilter import OutlierCorrection
+from LipidFinder._utils import nonzero_mean
 
 
 def remove_solvent_effect(data, parameters):
@@ -50,10 +51,7 @@ def remove_solvent_effect(data, parameters):
     # Insert mean colvent intensity column into the dataframe
     solMeanCol = re.sub('\d+$', "", data.columns[firstIndex]) + '_mean'
     # Get means (not taking into account zeros) of solvent samples
-    solMeans = data.iloc[:, firstIndex : lastIndex].apply(
-        lambda x: x[numpy.where(x>0)[0]].mean(), axis=1).fillna(0)
-    # Round to nearest integer and convert means to integer types
-    data[solMeanCol] = solMeans
+    data[solMeanCol] = nonzero_mean(data.iloc[:, firstIndex : lastIndex])
     # Subtracts solvent mean intensity from each sample replicate
     firstIndex = parameters['firstSampleIndex'] - 1
     lastIndex = firstIndex \
@@ -0,0 +1,233 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Set of methods aimed to run PeakFilter over the same input data with
+a grid of parameter values:
+    > get_configurations():
+        Return the list of parameter sets resulting from the combination
+        of every value in the grid.
+
+    > peak_filter_sweep():
+        Run PeakFilter for every parameter set, computing only once the
+        stages shared by several of them.
+
+The parameter sets are arranged in a prefix tree based on the cumulative
+fingerprint of each stage (see LFParameters.stage_fingerprint()): every
+internal node computes the stages shared by all the parameter sets below
+it and saves a checkpoint, which is then resumed by each of its
+branches. Independent branches are run in parallel in a process pool.
+
+Examples:
+    >>> from Configuration import LFParameters
+    >>> from LFDataFrame import LFDataFrame
+    >>> from PeakFilter import Sweep
+    >>> parameters = LFParameters('peakfilter', 'parameters.json')
+    >>> data = LFDataFrame('dataset.csv', parameters)
+    >>> grid = {'mzPPMError': [3.0, 4.0], 'solventMinFoldDiff': [2.0, 3.0]}
+    >>> Sweep.peak_filter_sweep(data, parameters, grid, 'sweep')
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import copy
+import itertools
+import os
+import sys
+
+import pandas
+
+from LipidFinder import PeakFilter
+from LipidFinder.PeakFilter import Checkpoint
+
+
+def get_configurations(parameters, grid):
+    # type: (LFParameters, dict) -> list
+    """Return the list of (name, LFParameters) pairs resulting from the
+    combination of every value of each parameter in 'grid'.
+
+    Keyword Arguments:
+        parameters -- LipidFinder's PeakFilter parameters instance used
+                      as base for every parameter set
+        grid       -- dictionary with parameter names as keys and lists
+                      of values as values
+    """
+    keys = sorted(grid.keys())
+    for key in keys:
+        if (key not in parameters):
+            raise KeyError("Unknown PeakFilter parameter '{0}'".format(key))
+    configs = []
+    for index, values in enumerate(
+            itertools.product(*[grid[key] for key in keys]), start=1):
+        config = copy.deepcopy(parameters)
+        for key, value in zip(keys, values):
+            config[key] = value
+            if (config[key] != value):
+                raise ValueError("Invalid value for '{0}': {1}".format(
+                        key, value))
+        configs.append(('config_{0:03d}'.format(index), config))
+    return configs
+
+
+def peak_filter_sweep(data, parameters, grid, dst='', numWorkers=None,
+                      keepCheckpoints=False):
+    # type: (LFDataFrame, LFParameters, dict, str, int, bool)
+    #       -> pandas.DataFrame
+    """Run PeakFilter for every combination of the parameter values in
+    'grid' and return the comparison table of the results.
+
+    One output folder is created inside 'dst' per parameter set, with
+    the same files as peak_filter() plus the parameters JSON file. The
+    comparison table, with the value of each grid parameter, the number
+    of rows and the False Discovery Rate of every parameter set, is
+    saved in "sweep_summary.csv". The checkpoints of the shared stages
+    are saved in the "checkpoints" folder, which is removed once every
+    parameter set has been run unless 'keepCheckpoints' is True.
+
+    Keyword Arguments:
+        data       -- LFDataFrame instance
+        parameters -- LipidFinder's PeakFilter parameters instance used
+                      as base for every parameter set
+        grid       -- dictionary with parameter names as keys and lists
+                      of values as values
+        dst        -- destination directory [default: current working
+                      directory]
+        numWorkers -- maximum number of worker processes
+                      [default: number of processors]
+        keepCheckpoints -- keep the "checkpoints" folder after the
+                           sweep? [default: False]
+    """
+    configs = get_configurations(parameters, grid)
+    checkpointDir = os.path.join(dst, 'checkpoints')
+    results = {}
+    with ProcessPoolExecutor(max_workers=numWorkers,
+                             initializer=_init_worker) as executor:
+        pending = {}
+        nodes = _build_tree([config for _, config in configs])
+        while (nodes or pending):
+            for node in nodes:
+                if ('config' in node):
+                    name, config = configs[node['config']]
+                    configDst = os.path.join(dst, name)
+                    future = executor.submit(_run_config, data, config,
+                                             configDst, checkpointDir)
+                else:
+                    config = configs[node['configs'][0]][1]
+                    future = executor.submit(_run_prefix, data, config,
+                                             checkpointDir, node['depth'])
+                pending[future] = node
+            nodes = []
+            done = wait(pending, return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                node = pending.pop(future)
+                if ('config' in node):
+                    results[node['config']] = future.result()
+                else:
+                    # Raise any exception from the worker
+                    future.result()
+                    nodes.extend(node['children'])
+    if (not keepCheckpoints):
+        Checkpoint.remove_checkpoints(checkpointDir)
+    # Create the comparison table of the results
+    keys = sorted(grid.keys())
+    rows = []
+    for index, (name, config) in enumerate(configs):
+        numRows, fdrValue = results[index]
+        rows.append([name] + [config[key] for key in keys]
+                    + [numRows, fdrValue])
+    summary = pandas.DataFrame(rows,
+                               columns=['Configuration'] + keys + ['Rows', 'FDR'])
+    summary.to_csv(os.path.join(dst, 'sweep_summary.csv'), index=False)
+    return summary
+
+
+def _build_tree(configs):
+    # type: (list) -> list
+    """Return the root nodes of the prefix tree of the parameter sets
+    based on the cumulative fingerprint of each stage that modifies the
+    data.
+
+    Internal nodes are dictionaries with the number of stages to compute
+    ("depth"), the indices of the parameter sets below ("configs") and
+    the list of child nodes ("children"). Leaves only hold the index of
+    their parameter set ("config"). If the parameter sets do not share
+    any stage, the roots are the subtrees of each first stage
+    fingerprint, so no node computes zero stages.
+
+    Keyword Arguments:
+        configs -- list of LipidFinder's PeakFilter parameters instances
+    """
+    # Only the stages that modify the data can be shared
+    numStages = len(PeakFilter._get_stages(configs[0]))
+    fingerprints = [[x.stage_fingerprint(stage)
+                     for stage in x.get_stages()[ : numStages]]
+                    for x in configs]
+
+    def split(group, depth):
+        # Extend the prefix while every parameter set shares it
+        while ((depth < numStages)
+               and (len(set(fingerprints[i][depth] for i in group)) == 1)):
+            depth += 1
+        if (len(group) == 1):
+            return [{'config': group[0]}]
+        if (depth == numStages):
+            children = [{'config': i} for i in group]
+        else:
+            # Group the parameter sets by their next stage fingerprint
+            # (keeping their original order)
+            subgroups = {}
+            for i in group:
+                subgroups.setdefault(fingerprints[i][depth], []).append(i)
+            children = []
+            for subgroup in sorted(subgroups.values()):
+                children.extend(split(subgroup, depth + 1))
+        if (depth == 0):
+            # No stage is shared: there is nothing to compute
+            return children
+        return [{'depth': depth, 'configs': group, 'children': children}]
+
+    return split(list(range(len(configs))), 0)
+
+
+def _init_worker():
+    # type: () -> None
+    """Silence the progress bars of the worker processes."""
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _run_prefix(data, parameters, checkpointDir, depth):
+    # type: (LFDataFrame, LFParameters, str, int) -> None
+    """Run and save the checkpoints of the first 'depth' stages.
+
+    Keyword Arguments:
+        data          -- LFDataFrame instance
+        parameters    -- LipidFinder's PeakFilter parameters instance
+        checkpointDir -- folder where the stage checkpoints are saved
+        depth         -- number of stages to run
+    """
+    PeakFilter.run_stages(data, parameters, checkpointDir, depth)
+
+
+def _run_config(data, parameters, dst, checkpointDir):
+    # type: (LFDataFrame, LFParameters, str, str) -> tuple
+    """Run PeakFilter for the given parameter set and return the number
+    of rows of the output data and its False Discovery Rate.
+
+    Keyword Arguments:
+        data          -- LFDataFrame instance
+        parameters    -- LipidFinder's PeakFilter parameters instance
+        dst           -- destination directory
+        checkpointDir -- folder where the stage checkpoints are saved
+                         and restored from
+    """
+    if (not os.path.isdir(dst)):
+        os.makedirs(dst)
+    parameters.write(os.path.join(dst, 'parameters.json'))
+    fdrValue = PeakFilter.peak_filter(data, parameters, dst,
+                                      checkpointDir=checkpointDir)
+    # 'data' is left unchanged when PeakFilter resumes from a checkpoint,
+    # so count the rows of the output file
+    outFileName = 'peakfilter_{0}.csv'.format(parameters['polarity'].lower())
+    numRows = len(pandas.read_csv(os.path.join(dst, outFileName),
+                                  usecols=[0]).index)
+    return (numRows, fdrValue)
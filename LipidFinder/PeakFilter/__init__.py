@@ -36,7 +36,16 @@ Step 19 - False Discovery Rate.
 Finally, a summary file (CSV format) is created with the most relevant
 information of the data after being processed: id, m/z, retention time,
 polarity and samples mean. Additionally, the complete filtered data can
-be saved in a CSV file too.
+be saved in a CSV file too. The IDs of the frames removed at each step
+are saved in a removal ledger CSV file.
+
+Some stages have two implementations with the same results: the
+original one ("reference" engine) and an optimised one ("fast" engine).
+The engine is selected with the "engine" parameter, or with the
+LIPIDFINDER_ENGINE environment variable, which takes precedence and
+accepts either an engine name or a comma-separated list of the stages
+to run with the "fast" engine. Both engines can be run and compared
+stage by stage with the 'crossCheck' argument of peak_filter().
 
 Examples:
     >>> from Configuration import LFParameters
@@ -47,13 +56,18 @@ Examples:
     >>> PeakFilter.peak_filter(data, parameters)
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
+import pickle
 import warnings
 
 import pandas
 
+from LipidFinder.LFProfiler import LFProfiler
+from LipidFinder.LFRunContext import LFRunContext
 from LipidFinder.PeakFilter import BroadContaminant
+from LipidFinder.PeakFilter import Checkpoint
 from LipidFinder.PeakFilter import Clustering
 from LipidFinder.PeakFilter import ContaminantRemoval
 from LipidFinder.PeakFilter import FalseDiscoveryRate
@@ -69,87 +83,40 @@ from LipidFinder.PeakFilter import SampleMeansCalc
 from LipidFinder.PeakFilter import SolventCalcs
 from LipidFinder.PeakFilter import Summary
 from LipidFinder._utils import print_progress_bar
+from LipidFinder._utils.LipidMaps import get_cache_path
 
 
 # Ignore Future Warnings from pandas library
 warnings.simplefilter(action='ignore', category=FutureWarning)
 # Progress bar increment per step
 INCREMENT = 100.0 / 18
+# Implementations available for the stages
+ENGINES = ['reference', 'fast']
+# Environment variable that overrides the "engine" parameter
+ENGINE_ENV_VAR = 'LIPIDFINDER_ENGINE'
+# Logger of the copies of the data run with the other engine when
+# cross-checking, so their removals are not reported twice
+_checkLogger = logging.getLogger(__name__ + '.crosscheck')
+_checkLogger.addHandler(logging.NullHandler())
+_checkLogger.propagate = False
 
-def _update_status(data, stepDst, verbose, stepNum):
-    # type: (LFDataFrame, str, bool, int) -> None
-    """Create CSV file from 'data' in 'stepDst', update progress bar and
-    return incremented step number.
-
-    Keyword Arguments:
-        data    -- LFDataFrame instance
-        stepDst -- destination directory for CSV 'data' file
-        verbose -- create CSV 'data' file?
-        stepNum -- step number completed
-    """
-    # Update progress bar
-    print_progress_bar(INCREMENT * stepNum, 100, prefix='PeakFilter progress:')
-    if (verbose):
-        # Create a CSV file with the whole processed dataframe
-        outFileName = 'peakfilter_step_{:02d}.csv'.format(stepNum)
-        data.to_csv(os.path.join(stepDst, outFileName), index=False)
-    stepNum += 1
-    return stepNum
-
-
-def peak_filter(data, parameters, dst='', verbose=False):
-    # type: (LFDataFrame, LFParameters, str, bool) -> None
-    """Filter contaminants and redundant artifacts from a LC/MS data
-    pre-processed by XCMS or another pre-processing tool.
-
-    If 'dst' is not an absolute path, the current working directory will
-    be used as starting point. If either "peakfilter_<polarity>.csv" or
-    "peakfilter_<polarity>_summary.csv" files already exist, they will
-    be overwritten. "<polarity>" stands for "positive" or "negative", as
-    stated in the parameters.
 
-    Keyword Arguments:
-        data       -- LFDataFrame instance
-        parameters -- LipidFinder's PeakFilter parameters instance
-        dst        -- destination directory where the log file, the
-                      processed data CSV file and the summary CSV file
-                      will be saved [default: current working directory]
-        verbose    -- create folder inside 'dst' where the intermediate
-                      results will be saved in CSV files
-    """
-    # Start progress bar
-    print_progress_bar(0, 100, prefix='PeakFilter progress:')
-    # Set the log file where the information about the steps performed
-    # is saved
-    logFilePath = 'peakfilter.log'
-    if (dst):
-        logFilePath = os.path.join(dst, logFilePath)
-    # Create logger and its file handler
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(logFilePath)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('[%(asctime)s] %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    # Write initial information in log file
-    logger.info('Starting PeakFilter. Input dataframe ("%s") has %d rows.',
-                 data.src, len(data.index))
-    # Prepare the folder structure to store the intermediate files
-    stepDst = os.path.join(dst, 'step_by_step')
-    if (verbose and not os.path.isdir(stepDst)):
-        os.makedirs(stepDst)
-    stepNum = 1
-    # QC Sample Calculations
+def _qc_calcs(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> str
+    """Step 1: QC samples calculations and reporting."""
     if (parameters['numQCReps'] > 0):
         # Perform mean and RSD on QC samples
         qcRatio = QCCalcs.qc_rsd_ratio(data, parameters)
-        # Write report in log file
-        logger.info(("QC Sample Calculations completed. %.1f%% samples between"
-                      " %d%% and %d%% QC-RSD"), qcRatio, parameters["QCRSD"][0],
-                     parameters["QCRSD"][1])
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Solvent Calculations
+        return ("QC Sample Calculations completed. {0:.1f}% samples between "
+                "{1:d}% and {2:d}% QC-RSD").format(
+                        qcRatio, parameters["QCRSD"][0],
+                        parameters["QCRSD"][1])
+    return None
+
+
+def _solvent_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 2: solvent removal."""
     if ((parameters['numSolventReps'] > 0) and parameters['removeSolvents']):
         # Perform mean and RSD on solvent samples, perform the outlier
         # correction, remove frames where all technical replicates of
@@ -157,7 +124,13 @@ def peak_filter(data, parameters, dst='', verbose=False):
         # solvent mean, and remove solvent mean intensity from remaining
         # intensities of samples replicates
         SolventCalcs.remove_solvent_effect(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
+
+
+def _feature_detection(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Steps 3 to 6: low intensity removal, mass clustering, feature set
+    clustering and feature peak analysis.
+    """
     # Background correction: remove low intensity frames
     SolventCalcs.remove_low_intensity_frames(data, parameters)
     if (parameters['preprocSoftware'] == 'XCMS'):
@@ -170,80 +143,523 @@ def peak_filter(data, parameters, dst='', verbose=False):
     else:
         # Perform peak finding for any other pre-processing software
         PeakFinder.process_features(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # In-source ion fragment removal
+
+
+def _in_src_frag_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 7: in-source ion fragment removal."""
     if (parameters['removeIonFrags']):
         InSrcFragRemoval.remove_in_src_frags(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Contaminant removal
+
+
+def _contaminant_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 8: mass contaminant removal."""
     if (parameters['removeContaminants']):
         ContaminantRemoval.remove_contaminants(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Adduct removal
+
+
+def _adduct_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 9: adduct ion removal."""
     if (parameters['removeAdducts']):
         ContaminantRemoval.remove_adducts(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Stack removal
+
+
+def _adduct_removal_fast(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 9: adduct ion removal (fast engine)."""
+    if (parameters['removeAdducts']):
+        ContaminantRemoval.remove_adducts(data, parameters, engine='fast')
+
+
+def _stack_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 10: stack removal."""
     if (parameters['removeStacks']):
         ContaminantRemoval.remove_stacks(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Retention time correction of each set of sample replicates to fix
-    # other pre-processing tool's likely alignment errors
+
+
+def _replicate_rt_correction(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 11: retention time correction of each set of sample
+    replicates to fix other pre-processing tool's likely alignment
+    errors.
+    """
     if ((parameters['numTechReps'] > 1)
         and (parameters['preprocSoftware'] == 'Other')):
         RTCorrection.correct_retention_time(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Remove outliers from sample replicates
+
+
+def _outlier_correction(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 12: remove outliers from sample replicates."""
     OutlierCorrection.remove_outliers(data, parameters, src='samples')
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Calculate and add the mean of each sample's replicates
+
+
+def _sample_means(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 13: calculate and add the mean of each sample's replicates.
+    """
     SampleMeansCalc.calculate_sample_means(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Retention time correction to the means of the sample replicates
+
+
+def _mean_rt_correction(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 14: retention time correction to the means of the sample
+    replicates.
+    """
     if (parameters['correctRTMeans']):
         RTCorrection.correct_retention_time(data, parameters, True)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Assign each m/z in either a mass or feature cluster to the m/z of
-    # the row containing the highest sample mean intensity
+
+
+def _mass_reassignment(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 15: assign each m/z in either a mass or feature cluster to
+    the m/z of the row containing the highest sample mean intensity.
+    """
     MassReassignment.reassign_frame_masses(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Remove ions with similar intensities for the same m/z that are
-    # likely to be contaminants
+
+
+def _broad_contaminant_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 16: remove ions with similar intensities for the same m/z
+    that are likely to be contaminants.
+    """
     BroadContaminant.process_all_features(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Isotope removal
+
+
+def _isotope_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 17: isotope removal."""
     Deisotoping.remove_isotopes(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Mass defect filter: remove salt clusters
+
+
+def _salt_cluster_removal(data, parameters):
+    # type: (LFDataFrame, LFParameters) -> None
+    """Step 18: mass defect filter (salt cluster removal)."""
     if (parameters['filterMassDefect']):
         MassDefectFilter.remove_salt_clusters(data, parameters)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Calculate the False Discovery Rate
-    if (parameters['calculateFDR']):
-        try:
-            fdrValue = FalseDiscoveryRate.get_fdr(data, parameters)
-            message = ("False Discovery Rate for selected data and parameters: "
-                       "{0:.2%}").format(fdrValue)
-        except ValueError as e:
-            message = 'ValueError: ' + e.args[0]
-        except Exception as oe:
-            message = 'OtherError: ' + oe.args[0]
-        logger.info(message)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Create summary CSV file from the processed dataframe
-    Summary.create_summary(data, parameters, dst)
-    stepNum = _update_status(data, stepDst, verbose, stepNum)
-    # Create a CSV file with the whole processed dataframe
-    data['Polarity'] = parameters['polarity']
-    outFileName = 'peakfilter_{0}.csv'.format(parameters['polarity'].lower())
-    data.to_csv(os.path.join(dst, outFileName), index=False)
+
+
+def _get_stages(parameters):
+    # type: (LFParameters) -> list
+    """Return the ordered list of (name, function) pairs of the stages
+    that modify the data, one per progress bar step.
+
+    Each function receives the LFDataFrame and the parameters, and
+    returns the message to write in the log file (if any).
+
+    Keyword Arguments:
+        parameters -- LipidFinder's PeakFilter parameters instance
+    """
+    if (parameters['preprocSoftware'] == 'XCMS'):
+        featureStage = 'Clustering'
+    else:
+        featureStage = 'PeakFinder'
+    return [('QCCalcs', _qc_calcs),
+            ('SolventCalcs', _solvent_removal),
+            (featureStage, _feature_detection),
+            ('InSrcFragRemoval', _in_src_frag_removal),
+            ('ContaminantRemoval.contaminants', _contaminant_removal),
+            ('ContaminantRemoval.adducts', _adduct_removal),
+            ('ContaminantRemoval.stacks', _stack_removal),
+            ('RTCorrection', _replicate_rt_correction),
+            ('OutlierCorrection', _outlier_correction),
+            ('SampleMeansCalc', _sample_means),
+            ('RTCorrection.means', _mean_rt_correction),
+            ('MassReassignment', _mass_reassignment),
+            ('BroadContaminant', _broad_contaminant_removal),
+            ('Deisotoping', _isotope_removal),
+            ('MassDefectFilter', _salt_cluster_removal)]
+
+
+# Implementation of the stages run by the "fast" engine. The rest of the
+# stages run their reference implementation with either engine.
+FAST_STAGES = {'ContaminantRemoval.adducts': _adduct_removal_fast}
+
+
+def get_stage_engines(parameters):
+    # type: (LFParameters) -> dict
+    """Return a dictionary with the engine ("reference" or "fast") that
+    will run each stage that modifies the data.
+
+    The LIPIDFINDER_ENGINE environment variable, if set, takes
+    precedence over the "engine" parameter. Its value can be either an
+    engine name or a comma-separated list of the stages to run with the
+    "fast" engine (the rest run with the "reference" one).
+
+    Keyword Arguments:
+        parameters -- LipidFinder's PeakFilter parameters instance
+    """
+    envValue = os.environ.get(ENGINE_ENV_VAR, '').strip()
+    if (not envValue):
+        envValue = parameters['engine']
+    if (envValue in ENGINES):
+        fastStages = FAST_STAGES.keys() if (envValue == 'fast') else []
+    else:
+        fastStages = [x.strip() for x in envValue.split(',') if x.strip()]
+        unknown = [x for x in fastStages if x not in FAST_STAGES]
+        if (unknown):
+            raise ValueError(("{0} must be one of {1} or a list of stages "
+                              "from {2}. Unknown: {3}").format(
+                                      ENGINE_ENV_VAR, ENGINES,
+                                      sorted(FAST_STAGES.keys()), unknown))
+    return {name: 'fast' if (name in fastStages) else 'reference'
+            for name, _ in _get_stages(parameters)}
+
+
+def _copy_data(data):
+    # type: (LFDataFrame) -> LFDataFrame
+    """Return an independent copy of 'data' (including its removal
+    ledger) whose removals are not written in the log file.
+
+    Keyword Arguments:
+        data -- LFDataFrame instance
+    """
+    logger = data.logger
+    data.logger = None
+    try:
+        dataCopy = pickle.loads(pickle.dumps(
+                data, protocol=pickle.HIGHEST_PROTOCOL))
+    finally:
+        data.logger = logger
+    dataCopy.logger = _checkLogger
+    return dataCopy
+
+
+def _cross_check(data, other, stage):
+    # type: (LFDataFrame, LFDataFrame, str) -> None
+    """Raise an AssertionError if 'data' and 'other' differ after
+    running 'stage' with each engine.
+
+    Keyword Arguments:
+        data  -- LFDataFrame instance processed by the selected engine
+        other -- LFDataFrame instance processed by the other engine
+        stage -- stage name
+    """
+    try:
+        pandas.testing.assert_frame_equal(
+                pandas.DataFrame(data), pandas.DataFrame(other),
+                check_exact=True)
+        pandas.testing.assert_frame_equal(data.removal_ledger(),
+                                          other.removal_ledger())
+    except AssertionError as e:
+        raise AssertionError(("Cross-check failed: the reference and fast "
+                              "engines differ after stage \"{0}\".\n{1}"
+                              ).format(stage, e))
+
+
+def _run_stages(data, parameters, checkpointDir='', numStages=None,
+                stepDst='', verbose=False, profiler=None, crossCheck=None,
+                onFinish=None):
+    # type: (LFDataFrame, LFParameters, str, int, str, bool, LFProfiler,
+    #        list, callable) -> tuple
+    """Run the stages that modify the data (resuming from the latest
+    valid checkpoint, if any) with the engine selected for each one.
+
+    Return the processed LFDataFrame and the number of stages run. The
+    stages modify 'data' in place, but if a checkpoint is restored the
+    processed LFDataFrame is a new instance.
+
+    Keyword Arguments:
+        data          -- LFDataFrame instance
+        parameters    -- LipidFinder's PeakFilter parameters instance
+        checkpointDir -- folder where the stage checkpoints are saved
+                         and restored from [default: no checkpoints]
+        numStages     -- number of stages to run [default: all]
+        stepDst       -- destination directory for intermediate CSV
+                         files [default: current working directory]
+        verbose       -- create intermediate CSV files?
+                         [default: False]
+        profiler      -- LFProfiler instance where to record the
+                         profile of each stage run [default: None]
+        crossCheck    -- list of stages to run with both engines,
+                         raising an AssertionError if their results
+                         differ [default: None]
+        onFinish      -- function called with 'data' as soon as the
+                         last stage has been run (or restored), before
+                         saving its checkpoint and intermediate CSV file
+                         [default: None]
+    """
+    if (profiler is None):
+        profiler = LFProfiler(enabled=False)
+    # Use the logger of the run the data is attached to, if any
+    logger = data.logger if (data.logger is not None) else logging.getLogger()
+    stages = _get_stages(parameters)[ : numStages]
+    engines = get_stage_engines(parameters)
+    fastStages = [name for name, _ in stages if (engines[name] == 'fast')]
+    if (fastStages):
+        logger.info('Stages run with the fast engine: %s.',
+                    ', '.join(fastStages))
+    if (crossCheck is None):
+        crossCheck = []
+    numRestored = 0
+    if (checkpointDir):
+        keys = Checkpoint.get_stage_keys(data, parameters,
+                                         [name for name, _ in stages])
+        data, numRestored = Checkpoint.restore_latest(data, checkpointDir,
+                                                      keys)
+        if (numRestored > 0):
+            logger.info(('Resuming PeakFilter from checkpoint after stage '
+                         '"%s". Restored dataframe has %d rows.'),
+                        stages[numRestored - 1][0], len(data.index))
+    for stepNum, (name, stage) in enumerate(stages, start=1):
+        if (stepNum <= numRestored):
+            # Update progress bar
+            print_progress_bar(INCREMENT * stepNum, 100,
+                               prefix='PeakFilter progress:')
+            continue
+        if (engines[name] == 'fast'):
+            stage, otherStage = FAST_STAGES[name], stage
+        else:
+            otherStage = FAST_STAGES.get(name)
+        check = (name in crossCheck) and (otherStage is not None)
+        if (check):
+            other = _copy_data(data)
+        profiler.start(name, data)
+        message = stage(data, parameters)
+        profiler.stop(data)
+        if (message):
+            logger.info(message)
+        if (check):
+            otherStage(other, parameters)
+            _cross_check(data, other, name)
+            logger.info('Cross-check of stage "%s": both engines match.',
+                        name)
+        if ((stepNum == len(stages)) and (onFinish is not None)):
+            onFinish(data)
+        if (checkpointDir):
+            Checkpoint.save_checkpoint(data, checkpointDir, keys[stepNum - 1])
+        _update_status(data, stepDst, verbose, stepNum)
+    if ((numRestored == len(stages)) and (onFinish is not None)):
+        # Every stage was restored from a checkpoint (or there were none)
+        onFinish(data)
+    return (data, len(stages))
+
+
+def run_stages(data, parameters, checkpointDir, numStages=None):
+    # type: (LFDataFrame, LFParameters, str, int) -> LFDataFrame
+    """Run the first 'numStages' stages that modify the data, saving a
+    checkpoint after each one, without creating any output file, and
+    return the processed LFDataFrame ('data' itself unless a checkpoint
+    is restored).
+
+    The process resumes from the latest valid checkpoint in
+    'checkpointDir', so a later call to peak_filter() with the same
+    checkpoint folder will only run the remaining stages. Useful to
+    compute once the stages shared by several parameter sets.
+
+    Keyword Arguments:
+        data          -- LFDataFrame instance
+        parameters    -- LipidFinder's PeakFilter parameters instance
+        checkpointDir -- folder where the stage checkpoints are saved
+                         and restored from
+        numStages     -- number of stages to run [default: all]
+    """
+    return _run_stages(data, parameters, checkpointDir, numStages)[0]
+
+
+def _update_status(data, stepDst, verbose, stepNum):
+    # type: (LFDataFrame, str, bool, int) -> None
+    """Create CSV file from 'data' in 'stepDst', update progress bar and
+    return incremented step number.
+
+    Keyword Arguments:
+        data    -- LFDataFrame instance
+        stepDst -- destination directory for CSV 'data' file
+        verbose -- create CSV 'data' file?
+        stepNum -- step number completed
+    """
     # Update progress bar
-    print_progress_bar(100, 100, prefix='PeakFilter progress:')
-    # Print False Discovery Rate message
-    if (parameters['calculateFDR']):
-        print(message)
-    # Write the final information in log file and close handler
-    logger.info('PeakFilter completed. Output dataframe has %d rows.\n',
-                 len(data.index))
-    handler.close()
-    logger.removeHandler(handler)
+    print_progress_bar(INCREMENT * stepNum, 100, prefix='PeakFilter progress:')
+    if (verbose):
+        # Create a CSV file with the whole processed dataframe
+        outFileName = 'peakfilter_step_{:02d}.csv'.format(stepNum)
+        data.to_csv(os.path.join(stepDst, outFileName), index=False)
+    stepNum += 1
+    return stepNum
+
+
+def _calculate_fdr(data, parameters, logger):
+    # type: (LFDataFrame, LFParameters, Logger) -> tuple
+    """Return the False Discovery Rate (FDR) of 'data' (None if it could
+    not be calculated) and the message reporting it, which is also
+    written in 'logger'.
+
+    Keyword Arguments:
+        data       -- LFDataFrame or pandas.DataFrame instance
+        parameters -- LipidFinder's PeakFilter parameters instance
+        logger     -- logger of the run
+    """
+    fdrValue = None
+    if (parameters['useCache'] and not parameters['localSearch']):
+        logger.info('Using the LIPID MAPS cache in "%s".', get_cache_path())
+    try:
+        fdrValue = FalseDiscoveryRate.get_fdr(data, parameters)
+        message = ("False Discovery Rate for selected data and "
+                   "parameters: {0:.2%}").format(fdrValue)
+    except ValueError as e:
+        message = 'ValueError: ' + e.args[0]
+    except Exception as oe:
+        message = 'OtherError: ' + oe.args[0]
+    logger.info(message)
+    return (fdrValue, message)
+
+
+def _start_fdr(data, parameters, logger):
+    # type: (LFDataFrame, LFParameters, Logger) -> Future
+    """Start calculating the False Discovery Rate (FDR) of 'data' in a
+    separate thread and return the future of _calculate_fdr() result.
+
+    The m/z column is copied beforehand, so 'data' can keep changing
+    while the FDR is calculated.
+
+    Keyword Arguments:
+        data       -- LFDataFrame instance
+        parameters -- LipidFinder's PeakFilter parameters instance
+        logger     -- logger of the run
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(_calculate_fdr,
+                             data[[parameters['mzCol']]].copy(), parameters,
+                             logger)
+    # Release the thread as soon as the FDR is calculated
+    executor.shutdown(wait=False)
+    return future
+
+
+def peak_filter(data, parameters, dst='', verbose=False, checkpointDir='',
+                profile=False, traceMemory=False, crossCheck=False):
+    # type: (LFDataFrame, LFParameters, str, bool, str, bool, bool,
+    #        object) -> float
+    """Filter contaminants and redundant artifacts from a LC/MS data
+    pre-processed by XCMS or another pre-processing tool.
+
+    Return the False Discovery Rate (FDR) of the filtered data, or None
+    if it has not been calculated.
+
+    If 'dst' is not an absolute path, the current working directory will
+    be used as starting point. If either "peakfilter_<polarity>.csv",
+    "peakfilter_<polarity>_summary.csv" or
+    "peakfilter_<polarity>_removed.csv" files already exist, they will
+    be overwritten. "<polarity>" stands for "positive" or "negative", as
+    stated in the parameters.
+
+    If 'checkpointDir' is given, the state of the data is saved in that
+    folder after each stage, and the process resumes automatically from
+    the latest checkpoint that matches the input data and the parameters
+    read by the stages it covers. The intermediate CSV files of the
+    stages restored from a checkpoint are not created again. In that
+    case the processed data is restored into a new LFDataFrame, so
+    'data' is not modified. The checkpoints are loaded with pickle:
+    only use folders whose files were created by LipidFinder.
+
+    If 'profile' is True, the wall time, CPU time, peak RSS increase and
+    number of input and output rows of each stage are written as a table
+    in the log file and saved in "peakfilter_profile.json". The peak
+    memory allocated by each stage is included if 'traceMemory' is True.
+
+    If 'crossCheck' is True, every stage with a fast implementation is
+    run with both engines and an AssertionError is raised as soon as
+    their results differ. A list of stage names restricts the check to
+    those stages.
+
+    Keyword Arguments:
+        data          -- LFDataFrame instance
+        parameters    -- LipidFinder's PeakFilter parameters instance
+        dst           -- destination directory where the log file, the
+                         processed data CSV file, the summary CSV file
+                         and the removal ledger CSV file will be saved
+                         [default: current working directory]
+        verbose       -- create folder inside 'dst' where the
+                         intermediate results will be saved in CSV files
+        checkpointDir -- folder where the stage checkpoints are saved
+                         and restored from (trusted files only)
+                         [default: no checkpoints]
+        profile       -- record the time and memory profile of each
+                         stage? [default: False]
+        traceMemory   -- trace the memory allocated by each stage (slow)?
+                         [default: False]
+        crossCheck    -- run both engines and compare their results?
+                         (True, False or list of stage names)
+                         [default: False]
+    """
+    if (crossCheck is True):
+        crossCheck = list(FAST_STAGES.keys())
+    elif (not crossCheck):
+        crossCheck = None
+    # Start progress bar
+    print_progress_bar(0, 100, prefix='PeakFilter progress:')
+    # Set the log file where the information about the steps performed
+    # is saved
+    logFilePath = 'peakfilter.log'
+    if (dst):
+        logFilePath = os.path.join(dst, logFilePath)
+    with LFRunContext(logFilePath) as context, \
+            LFProfiler(profile or traceMemory, traceMemory) as profiler:
+        context.attach(data)
+        logger = context.logger
+        # Write initial information in log file
+        logger.info('Starting PeakFilter. Input dataframe ("%s") has %d rows.',
+                     data.src, len(data.index))
+        # Prepare the folder structure to store the intermediate files
+        stepDst = os.path.join(dst, 'step_by_step')
+        if (verbose and not os.path.isdir(stepDst)):
+            os.makedirs(stepDst)
+        # Calculate the False Discovery Rate in the background (if
+        # selected) as soon as the data stops changing, while the last
+        # checkpoint and the output files are written
+        fdrValue = None
+        fdrFuture = []
+        onFinish = None
+        if (parameters['calculateFDR'] and parameters['fdrInBackground']):
+            onFinish = lambda x: fdrFuture.append(
+                    _start_fdr(x, parameters, logger))
+        # The processed data is a new LFDataFrame if a checkpoint is
+        # restored
+        data, numStages = _run_stages(
+                data, parameters, checkpointDir, stepDst=stepDst,
+                verbose=verbose, profiler=profiler, crossCheck=crossCheck,
+                onFinish=onFinish)
+        stepNum = numStages + 1
+        if (parameters['calculateFDR'] and not fdrFuture):
+            profiler.start('FalseDiscoveryRate', data)
+            fdrValue, message = _calculate_fdr(data, parameters, logger)
+            profiler.stop(data)
+        stepNum = _update_status(data, stepDst, verbose, stepNum)
+        # Create summary CSV file from the processed dataframe
+        profiler.start('Summary', data)
+        Summary.create_summary(data, parameters, dst)
+        profiler.stop(data)
+        stepNum = _update_status(data, stepDst, verbose, stepNum)
+        # Create a CSV file with the whole processed dataframe
+        profiler.start('Output', data)
+        data['Polarity'] = parameters['polarity']
+        outFileName = 'peakfilter_{0}.csv'.format(
+                parameters['polarity'].lower())
+        data.to_csv(os.path.join(dst, outFileName), index=False)
+        # Create a CSV file with the IDs of the frames removed at each
+        # step
+        outFileName = 'peakfilter_{0}_removed.csv'.format(
+                parameters['polarity'].lower())
+        data.removal_ledger().to_csv(os.path.join(dst, outFileName),
+                                     index=False)
+        profiler.stop(data)
+        if (fdrFuture):
+            # Only the time spent waiting for the FDR is recorded
+            profiler.start('FalseDiscoveryRate', data)
+            fdrValue, message = fdrFuture[0].result()
+            profiler.stop(data)
+        profiler.log_summary(logger)
+        profiler.write_json(os.path.join(dst, 'peakfilter_profile.json'),
+                            'PeakFilter')
+        # Update progress bar
+        print_progress_bar(100, 100, prefix='PeakFilter progress:')
+        # Print False Discovery Rate message
+        if (parameters['calculateFDR']):
+            print(message)
+        # Write the final information in log file
+        logger.info('PeakFilter completed. Output dataframe has %d rows.\n',
+                     len(data.index))
+    return fdrValue
@@ -0,0 +1,105 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Registry of named counters incremented inside the hot loops of the
+stage kernels (e.g. number of tolerance-window queries or candidates
+examined), to correlate the shape of the data with the running time:
+    > enable():
+        Start recording the counters.
+
+    > disable():
+        Stop recording the counters.
+
+    > increment():
+        Add the given value to a counter (no-op while disabled).
+
+    > get_counters():
+        Return a copy of the current value of every counter.
+
+    > reset():
+        Set every counter to zero.
+
+The registry is disabled by default. While disabled, increment() is
+bound to an empty function, so the kernels can call it unconditionally.
+Kernels are expected to accumulate their counts in local variables and
+call increment() once per call, outside their inner loops.
+
+The registry is per process: increments are thread-safe, but the runs
+recording counters at the same time add up to the same values.
+
+Examples:
+    >>> from LipidFinder._utils import Counters
+    >>> Counters.enable()
+    >>> Deisotoping.remove_isotopes(data, parameters)
+    >>> Counters.get_counters()
+    {'Deisotoping.windowQueries': 1422, 'Deisotoping.candidates': 301}
+    >>> Counters.disable()
+"""
+
+from collections import Counter
+import threading
+
+
+# Current value of every counter
+_counters = Counter()
+# Lock guarding the counters (increments may come from several threads)
+_lock = threading.Lock()
+
+
+def _increment(name, value=1):
+    # type: (str, int) -> None
+    """Add 'value' to the counter 'name'.
+
+    Keyword Arguments:
+        name  -- counter name
+        value -- value to add [default: 1]
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def _ignore(name, value=1):
+    # type: (str, int) -> None
+    """Ignore the increment (registry disabled)."""
+    pass
+
+
+# Rebound by enable() and disable()
+increment = _ignore
+
+
+def enable():
+    # type: () -> None
+    """Start recording the counters."""
+    global increment
+    increment = _increment
+
+
+def disable():
+    # type: () -> None
+    """Stop recording the counters (their values are kept)."""
+    global increment
+    increment = _ignore
+
+
+def is_enabled():
+    # type: () -> bool
+    """Return True if the counters are being recorded, False otherwise.
+    """
+    return increment is _increment
+
+
+def get_counters():
+    # type: () -> dict
+    """Return a copy of the current value of every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    # type: () -> None
+    """Set every counter to zero."""
+    with _lock:
+        _counters.clear()
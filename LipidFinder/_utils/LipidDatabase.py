@@ -0,0 +1,299 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Offline search of m/z values in a local copy of a LIPID MAPS
+structure database, as an alternative to the bulk search service:
+    > LipidDatabase:
+        Structures of a LIPID MAPS export indexed by the m/z of each
+        of their ion adducts.
+
+    > load_database():
+        Return the LipidDatabase of the given structure export, loading
+        it only once per process.
+
+The structure export is a CSV file with, at least, the exact mass,
+formula, main class and category of each structure, and its name or
+bulk structure abbreviation. Column names are case-insensitive and
+spaces and underscores are interchangeable (e.g. "EXACT_MASS" or
+"Exact Mass"). The m/z of each ion adduct is calculated from the offset
+and charge in "Data/lipidmaps_adducts.csv".
+
+Examples:
+    >>> from LipidFinder._utils.LipidDatabase import load_database
+    >>> database = load_database('comp_db.csv')
+    >>> matches = database.search([760.5851, 782.5670], 0.005,
+    ...                           ['[M+H]+', '[M+Na]+'])
+    >>> numTargetHits, numDecoyHits = database.count_hits(
+    ...         [760.5851, 782.5670], 0.001, ['[M+H]+'], (0.0, 0.5))
+"""
+
+import os
+import re
+
+import numpy
+import pandas
+import pkg_resources
+
+
+# Columns of the search results, as returned by the bulk search service
+COLUMNS = ['Input Mass', 'Matched MZ', 'Delta', 'Bulk Structure', 'Formula',
+           'Adduct', 'Main Class', 'Category']
+# Accepted names for each column of the structure export (after
+# upper-casing them and replacing spaces by underscores)
+_EXPORT_COLUMNS = {
+        'Exact Mass': ['EXACT_MASS', 'MASS'],
+        'Formula': ['FORMULA'],
+        'Main Class': ['MAIN_CLASS'],
+        'Category': ['CATEGORY'],
+        'Bulk Structure': ['BULK_STRUCTURE', 'ABBREVIATION', 'NAME',
+                           'COMMON_NAME']}
+# Number of decimal digits of "Matched MZ" and "Delta" (as in the
+# bulk search service)
+DECIMALS = 4
+# Number of carbons (and double bonds) of each chain of a structure
+_CARBONS_REGEX = re.compile(r'(\d+):\d+')
+
+# Databases already loaded, by path
+_databases = {}
+
+
+def load_database(src, adductsPath=None):
+    # type: (str, str) -> LipidDatabase
+    """Return the LipidDatabase of the structure export 'src'.
+
+    The database is loaded only once per process and reloaded if the
+    file is modified, so repeated searches (e.g. PeakFilter batch runs)
+    reuse the same mass indexes.
+
+    Keyword Arguments:
+        src         -- path to the CSV file of the structure export
+        adductsPath -- path to the CSV file with the offset and charge
+                       of each ion adduct
+                       [default: "Data/lipidmaps_adducts.csv"]
+    """
+    key = (os.path.realpath(src), os.path.getmtime(src), adductsPath)
+    if (key not in _databases):
+        _databases.clear()
+        _databases[key] = LipidDatabase(src, adductsPath)
+    return _databases[key]
+
+
+class LipidDatabase(object):
+    """A LipidDatabase object holds the structures of a LIPID MAPS
+    export and searches m/z values in them.
+
+    For every combination of ion adduct, category filter, chain filter
+    and mass shift requested, the m/z values of the structures are
+    computed and sorted once, so each search is a vectorized binary
+    search over the sorted arrays.
+
+    Attributes:
+        structures  (Public[pandas.DataFrame])
+            Bulk structure, formula, exact mass, main class and category
+            of each structure.
+        adducts  (Public[pandas.DataFrame])
+            Charge and offset of each ion adduct, indexed by adduct.
+        _indexes  (Private[dict])
+            Sorted m/z values and structure indices of each adduct.
+    """
+
+    def __init__(self, src, adductsPath=None):
+        # type: (str, str) -> LipidDatabase
+        """Constructor of the class LipidDatabase.
+
+        Keyword Arguments:
+            src         -- path to the CSV file of the structure export
+            adductsPath -- path to the CSV file with the offset and
+                           charge of each ion adduct
+                           [default: "Data/lipidmaps_adducts.csv"]
+        """
+        self.structures = _read_export(src)
+        if (not adductsPath):
+            adductsPath = pkg_resources.resource_filename(
+                    'LipidFinder', 'Data/lipidmaps_adducts.csv')
+        self.adducts = pandas.read_csv(adductsPath, index_col='Adduct')
+        self._indexes = {}
+
+    def search(self, mzValues, tolerance, adducts, categories=None,
+               evenChains=False, massShift=0.0):
+        # type: (list, object, list, list, bool, float) -> pandas.DataFrame
+        """Return a dataframe with every structure whose ion adduct m/z
+        is within the tolerance of each m/z value.
+
+        The dataframe has the same columns as the tables returned by
+        the bulk search service ("Input Mass", "Matched MZ", "Delta",
+        "Bulk Structure", "Formula", "Adduct", "Main Class" and
+        "Category"), with the matches of each m/z in input order, sorted
+        by delta.
+
+        Keyword Arguments:
+            mzValues   -- list or array of m/z values
+            tolerance  -- mass tolerance (in Daltons), either a single
+                          value or one per m/z
+            adducts    -- list of ion adducts (e.g. "[M+H]+")
+            categories -- list of lipid categories to search (e.g.
+                          "Glycerolipids [GL]") [default: all]
+            evenChains -- keep only the structures with an even total
+                          number of carbons? [default: False]
+            massShift  -- mass added to every structure (e.g. 0.5 Da
+                          for a decoy database) [default: 0.0]
+        """
+        mzArray = numpy.asarray(mzValues, dtype=float)
+        tolArray = numpy.broadcast_to(numpy.asarray(tolerance, dtype=float),
+                                      mzArray.shape)
+        inputIdx = []
+        structIdx = []
+        adductIdx = []
+        for i, adduct in enumerate(adducts):
+            ionMZ, order = self._get_index(adduct, categories, evenChains,
+                                           massShift)
+            # Find the range of sorted ion m/z values within the
+            # tolerance of every m/z at once
+            start = numpy.searchsorted(ionMZ, mzArray - tolArray, 'left')
+            stop = numpy.searchsorted(ionMZ, mzArray + tolArray, 'right')
+            counts = numpy.maximum(stop - start, 0)
+            total = counts.sum()
+            if (total == 0):
+                continue
+            # Expand each range into the positions it covers
+            offsets = numpy.arange(total) - numpy.repeat(
+                    numpy.cumsum(counts) - counts, counts)
+            positions = numpy.repeat(start, counts) + offsets
+            inputIdx.append(numpy.repeat(numpy.arange(len(mzArray)), counts))
+            structIdx.append(order[positions])
+            adductIdx.append(numpy.full(total, i))
+        if (not inputIdx):
+            return pandas.DataFrame(columns=COLUMNS)
+        inputIdx = numpy.concatenate(inputIdx)
+        structIdx = numpy.concatenate(structIdx)
+        adductIdx = numpy.concatenate(adductIdx)
+        adductInfo = self.adducts.loc[list(adducts)]
+        charges = adductInfo['Charge'].values[adductIdx]
+        matchedMZ = (self.structures['Exact Mass'].values[structIdx]
+                     + massShift + adductInfo['Adduct Offset'].values[
+                             adductIdx]) / charges
+        delta = numpy.abs(matchedMZ - mzArray[inputIdx])
+        # Keep the matches of each m/z together, from the smallest to
+        # the largest delta
+        order = numpy.lexsort((delta, inputIdx))
+        structIdx = structIdx[order]
+        matches = pandas.DataFrame(
+                {'Input Mass': mzArray[inputIdx[order]],
+                 'Matched MZ': numpy.round(matchedMZ[order], DECIMALS),
+                 'Delta': numpy.round(delta[order], DECIMALS),
+                 'Bulk Structure':
+                        self.structures['Bulk Structure'].values[structIdx],
+                 'Formula': self.structures['Formula'].values[structIdx],
+                 'Adduct': numpy.asarray(adducts, dtype=object)[
+                         adductIdx[order]],
+                 'Main Class': self.structures['Main Class'].values[structIdx],
+                 'Category': self.structures['Category'].values[structIdx]},
+                columns=COLUMNS)
+        return matches
+
+    def count_hits(self, mzValues, tolerance, adducts, massShifts=(0.0, )):
+        # type: (list, object, list, tuple) -> numpy.ndarray
+        """Return the number of m/z values with at least one match for
+        every mass shift (e.g. 0.0 Da for the target database and 0.5 Da
+        for its decoy), without building the table of matches.
+
+        Keyword Arguments:
+            mzValues   -- list or array of m/z values
+            tolerance  -- mass tolerance (in Daltons), either a single
+                          value or one per m/z
+            adducts    -- list of ion adducts (e.g. "[M+H]+")
+            massShifts -- mass added to every structure for each count
+                          [default: (0.0, )]
+        """
+        mzArray = numpy.asarray(mzValues, dtype=float)
+        tolArray = numpy.broadcast_to(numpy.asarray(tolerance, dtype=float),
+                                      mzArray.shape)
+        lower = mzArray - tolArray
+        upper = mzArray + tolArray
+        hits = numpy.zeros((len(massShifts), len(mzArray)), dtype=bool)
+        for i, massShift in enumerate(massShifts):
+            for adduct in adducts:
+                ionMZ = self._get_index(adduct, None, False, massShift)[0]
+                hits[i] |= (numpy.searchsorted(ionMZ, upper, 'right')
+                            > numpy.searchsorted(ionMZ, lower, 'left'))
+        return hits.sum(axis=1)
+
+    def _get_index(self, adduct, categories, evenChains, massShift):
+        # type: (str, list, bool, float) -> tuple
+        """Return the sorted m/z values of the given ion adduct for the
+        structures that pass the filters, and the index of the structure
+        of each m/z.
+
+        Keyword Arguments:
+            adduct     -- ion adduct (e.g. "[M+H]+")
+            categories -- list of lipid categories to search
+            evenChains -- keep only the structures with an even total
+                          number of carbons?
+            massShift  -- mass added to every structure
+        """
+        key = (adduct, tuple(categories) if categories else (),
+               bool(evenChains), massShift)
+        if (key not in self._indexes):
+            if (adduct not in self.adducts.index):
+                raise ValueError(("Unknown ion adduct '{0}'. The offset and "
+                                  "charge of every adduct must be in the "
+                                  "adducts CSV file.").format(adduct))
+            mask = numpy.ones(len(self.structures), dtype=bool)
+            if (categories):
+                # Compare the category names without the abbreviation
+                # between brackets (e.g. "Glycerolipids [GL]")
+                names = set(_strip_abbreviation(x) for x in categories)
+                mask &= self.structures['Category'].map(
+                        _strip_abbreviation).isin(names).values
+            if (evenChains):
+                # Add up the carbons of every chain (structures without
+                # chains are kept)
+                carbons = self.structures['Bulk Structure'].str.extractall(
+                        _CARBONS_REGEX)[0].astype(int).groupby(level=0).sum()
+                carbons = carbons.reindex(self.structures.index)
+                mask &= ~(carbons % 2 == 1).values
+            indices = numpy.flatnonzero(mask)
+            charge, offset = self.adducts.loc[adduct,
+                                              ['Charge', 'Adduct Offset']]
+            ionMZ = (self.structures['Exact Mass'].values[indices]
+                     + massShift + offset) / charge
+            order = numpy.argsort(ionMZ, kind='mergesort')
+            self._indexes[key] = (ionMZ[order], indices[order])
+        return self._indexes[key]
+
+
+def _read_export(src):
+    # type: (str) -> pandas.DataFrame
+    """Return a dataframe with the bulk structure, formula, exact mass,
+    main class and category of each structure of a LIPID MAPS export.
+
+    Keyword Arguments:
+        src -- path to the CSV file of the structure export
+    """
+    export = pandas.read_csv(src, dtype=str, keep_default_na=False)
+    names = dict((x.strip().upper().replace(' ', '_'), x) for x in export)
+    structures = pandas.DataFrame()
+    for column, aliases in _EXPORT_COLUMNS.items():
+        found = [names[x] for x in aliases if x in names]
+        if (not found):
+            raise ValueError(("Column '{0}' not found in the structure "
+                              "export '{1}'.").format(column, src))
+        structures[column] = export[found[0]].str.strip()
+    structures['Exact Mass'] = pandas.to_numeric(structures['Exact Mass'],
+                                                 errors='coerce')
+    # Discard the structures without a valid exact mass
+    structures = structures[structures['Exact Mass'].notna()]
+    return structures.reset_index(drop=True)
+
+
+def _strip_abbreviation(category):
+    # type: (str) -> str
+    """Return the lipid category name without its abbreviation between
+    brackets, in lower case.
+
+    Keyword Arguments:
+        category -- lipid category name (e.g. "Glycerolipids [GL]")
+    """
+    return category.split('[')[0].strip().lower()
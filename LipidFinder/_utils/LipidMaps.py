@@ -0,0 +1,522 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Client of the LIPID MAPS bulk search service shared by MSSearch and
+the False Discovery Rate:
+    > LipidMapsClient:
+        Send bulk search requests to LIPID MAPS concurrently, with a
+        bounded number of requests in flight.
+
+    > LipidMapsCache:
+        Persistent on-disk cache of the matches of each m/z.
+
+    > get_url():
+        Return the URL of the bulk search service.
+
+    > get_cache_path():
+        Return the path of the default cache file.
+
+The requests share a single HTTP session, so the connections to the
+server are kept alive and reused between batches. Connection errors,
+timeouts and transient server errors (HTTP 429 and 5xx) are retried
+with exponential backoff. The URL of the service can be replaced (e.g.
+by a mirror or a local mock server) setting the environment variable
+LIPIDFINDER_LIPIDMAPS_URL.
+
+When a cache is given to the client, the matches of every m/z are
+stored in a SQLite database, keyed by the search fields (database,
+adducts, tolerance, even chains and categories), and only the m/z
+values not found in the cache are sent to the server. Entries expire
+after CACHE_TTL seconds, and the least recently used ones are evicted
+when the cache holds more than CACHE_MAX_ENTRIES m/z values. The
+default cache file can be changed setting the environment variable
+LIPIDFINDER_CACHE_PATH.
+
+Examples:
+    >>> from LipidFinder._utils.LipidMaps import LipidMapsClient
+    >>> with LipidMapsClient(maxRequests=4) as client:
+    ...     texts = client.search([{'CHOICE': 'COMP_DB', 'ion': 'M-H',
+    ...                             'tol': '0.001', 'file': '760.5851'}])
+    >>> with LipidMapsCache() as cache, LipidMapsClient(cache=cache) as client:
+    ...     texts = client.search(queries)
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import sqlite3
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+from LipidFinder._py3k import StringIO
+from LipidFinder._utils import Counters
+
+
+LIPIDMAPS_URL = 'https://www.lipidmaps.org/tools/ms/py_bulk_search.php'
+# Environment variable to replace the URL of the bulk search service
+URL_ENV_VAR = 'LIPIDFINDER_LIPIDMAPS_URL'
+# Maximum number of m/z values to send at once to LIPID MAPS
+BATCH_SIZE = 150
+# Maximum number of requests in flight at the same time
+MAX_REQUESTS = 4
+# Number of times a failed request is retried, and seconds to wait
+# before the first retry (doubled after each one)
+MAX_RETRIES = 3
+BACKOFF = 1.0
+# Seconds to wait for the server to answer each request
+TIMEOUT = 120.0
+# HTTP status codes worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Environment variable to replace the path of the cache file
+CACHE_ENV_VAR = 'LIPIDFINDER_CACHE_PATH'
+# Seconds a cached entry remains valid (30 days)
+CACHE_TTL = 30 * 24 * 3600
+# Maximum number of m/z entries kept in the cache
+CACHE_MAX_ENTRIES = 1000000
+# Maximum number of parameters of a SQLite query
+_SQL_MAX_PARAMS = 500
+
+
+def get_url(default=LIPIDMAPS_URL):
+    # type: (str) -> str
+    """Return the URL of the LIPID MAPS bulk search service: the value
+    of LIPIDFINDER_LIPIDMAPS_URL environment variable if set, 'default'
+    otherwise.
+
+    Keyword Arguments:
+        default -- URL to use if the environment variable is not set
+                   [default: LIPIDMAPS_URL]
+    """
+    return os.environ.get(URL_ENV_VAR, '') or default
+
+
+def get_cache_path():
+    # type: () -> str
+    """Return the path of the default cache file: the value of
+    LIPIDFINDER_CACHE_PATH environment variable if set,
+    "~/.cache/LipidFinder/lipidmaps.sqlite" otherwise.
+    """
+    return os.environ.get(CACHE_ENV_VAR, '') \
+           or os.path.join(os.path.expanduser('~'), '.cache', 'LipidFinder',
+                           'lipidmaps.sqlite')
+
+
+class LipidMapsClient(object):
+    """A LipidMapsClient object sends bulk search requests to LIPID MAPS
+    through a shared HTTP session with connection pooling.
+
+    Attributes:
+        url  (Public[str])
+            URL of the bulk search service.
+        maxRequests  (Public[int])
+            Maximum number of requests in flight at the same time.
+        maxRetries  (Public[int])
+            Number of times a failed request is retried.
+        backoff  (Public[float])
+            Seconds to wait before the first retry.
+        timeout  (Public[float])
+            Seconds to wait for the server to answer each request.
+        cache  (Public[LipidMapsCache])
+            Cache of the matches of each m/z (None if disabled).
+        _session  (Private[requests.Session])
+            HTTP session shared by every request.
+    """
+
+    def __init__(self, url=None, maxRequests=MAX_REQUESTS,
+                 maxRetries=MAX_RETRIES, backoff=BACKOFF, timeout=TIMEOUT,
+                 cache=None):
+        # type: (str, int, int, float, float, LipidMapsCache)
+        #       -> LipidMapsClient
+        """Constructor of the class LipidMapsClient.
+
+        Keyword Arguments:
+            url         -- URL of the bulk search service
+                           [default: see get_url()]
+            maxRequests -- maximum number of requests in flight at the
+                           same time [default: MAX_REQUESTS]
+            maxRetries  -- number of times a failed request is retried
+                           [default: MAX_RETRIES]
+            backoff     -- seconds to wait before the first retry,
+                           doubled after each one [default: BACKOFF]
+            timeout     -- seconds to wait for the server to answer
+                           each request [default: TIMEOUT]
+            cache       -- LipidMapsCache instance [default: None]
+        """
+        self.url = get_url(url if (url) else LIPIDMAPS_URL)
+        self.maxRequests = max(1, maxRequests)
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self._session = requests.Session()
+        # Keep one connection alive per request in flight
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.maxRequests)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def __enter__(self):
+        # type: () -> LipidMapsClient
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # type: (type, Exception, traceback) -> bool
+        self.close()
+        return False
+
+    def close(self):
+        # type: () -> None
+        """Close the connections of the HTTP session."""
+        self._session.close()
+
+    def post(self, fields):
+        # type: (dict) -> str
+        """Send a bulk search request and return the text of the
+        response (the tab-separated table of matches).
+
+        Keyword Arguments:
+            fields -- request fields, where 'file' holds the m/z values
+                      to search, one per line
+        """
+        for attempt in range(self.maxRetries + 1):
+            if (attempt > 0):
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            # The encoder is a stream, so it has to be created for
+            # every attempt
+            encFields = dict(fields)
+            encFields['file'] = ('file', StringIO(fields['file']),
+                                 'text/plain')
+            mpData = MultipartEncoder(fields=encFields)
+            try:
+                response = self._session.post(
+                        self.url, data=mpData, timeout=self.timeout,
+                        headers={'Content-Type': mpData.content_type})
+            except (requests.ConnectionError, requests.Timeout):
+                continue
+            if (response.status_code in RETRY_STATUS):
+                continue
+            if (response.status_code != 200):
+                # Error pages must not be taken as (or cached as) tables
+                # of matches
+                raise Exception(("LIPID MAPS answered with HTTP status {0}. "
+                                 "Please check the search parameters and "
+                                 "the URL of the bulk search service.")
+                                .format(response.status_code))
+            return response.text
+        raise Exception(("Connection error with the database. Please check "
+                         "your network and try again after a few minutes."))
+
+    def search(self, queries, callback=None):
+        # type: (list, callable) -> list
+        """Send the bulk search requests of 'queries' and return the
+        text of their responses, in the same order.
+
+        At most 'maxRequests' requests are in flight at the same time.
+        If 'callback' is given, it is called with the index of each
+        query as soon as its response is received (or straight away if
+        every m/z of the query is cached).
+
+        Keyword Arguments:
+            queries  -- list of request fields (see post())
+            callback -- function called after each response
+                        [default: None]
+        """
+        if (self.cache is None):
+            return self._send(queries, callback)
+        # Look up the m/z values of every query in the cache
+        keys = [_get_key(fields) for fields in queries]
+        mzLists = [_get_mz_list(fields) for fields in queries]
+        entries = {}
+        pending = OrderedDict()
+        for key, fields, mzList in zip(keys, queries, mzLists):
+            if (key not in entries):
+                entries[key] = {}
+            cached = self.cache.get(key, mzList)
+            entries[key].update(cached)
+            if (key not in pending):
+                # The missing m/z values are kept in order, without
+                # duplicates
+                pending[key] = (fields, OrderedDict(), len(mzList))
+            missing = pending[key][1]
+            for mz in mzList:
+                if (mz not in entries[key]):
+                    missing[mz] = None
+            # Keep the size of the largest query of the key as batch
+            # size of its cache misses
+            pending[key] = (fields, missing, max(pending[key][2],
+                                                 len(mzList)))
+        # Regroup the cache misses of the queries sharing the same
+        # fields into batches of the original size
+        missQueries = []
+        missKeys = []
+        missBatch = {}
+        for key, (fields, missing, batchSize) in pending.items():
+            missing = list(missing)
+            for start in range(0, len(missing), max(batchSize, 1)):
+                batch = missing[start : start + batchSize]
+                missFields = OrderedDict(fields)
+                missFields['file'] = os.linesep.join(batch)
+                for mz in batch:
+                    missBatch[(key, mz)] = len(missQueries)
+                missQueries.append(missFields)
+                missKeys.append(key)
+        numMisses = sum(len(x[1]) for x in pending.values())
+        Counters.increment('LipidMaps.cacheHits',
+                           sum(len(x) for x in mzLists) - numMisses)
+        Counters.increment('LipidMaps.cacheMisses', numMisses)
+        # Get the batches of cache misses each query is waiting for
+        waiting = {}
+        batchQueries = [[] for _ in missQueries]
+        for index, (key, mzList) in enumerate(zip(keys, mzLists)):
+            batches = set(missBatch[(key, mz)] for mz in mzList
+                          if (mz not in entries[key]))
+            if (batches):
+                waiting[index] = batches
+                for batchIndex in batches:
+                    batchQueries[batchIndex].append(index)
+        if (callback is not None):
+            # Report the queries with every m/z cached straight away
+            for index in range(len(queries)):
+                if (index not in waiting):
+                    callback(index)
+
+        def report(batchIndex):
+            # type: (int) -> None
+            # Report each query once all its batches are answered
+            for index in batchQueries[batchIndex]:
+                waiting[index].discard(batchIndex)
+                if (not waiting[index]):
+                    callback(index)
+
+        texts = self._send(missQueries,
+                           report if (callback is not None) else None)
+        for key, fields, text in zip(missKeys, missQueries, texts):
+            found = _split_response(text, _get_mz_list(fields))
+            self.cache.put(key, found)
+            entries[key].update(found)
+        return [_join_entries([entries[key][mz] for mz in mzList])
+                for key, mzList in zip(keys, mzLists)]
+
+    def _send(self, queries, callback=None):
+        # type: (list, callable) -> list
+        """Send the bulk search requests of 'queries' concurrently and
+        return the text of their responses, in the same order.
+
+        Keyword Arguments:
+            queries  -- list of request fields (see post())
+            callback -- function called with the index of each query
+                        after its response [default: None]
+        """
+        texts = [None] * len(queries)
+        if ((self.maxRequests == 1) or (len(queries) <= 1)):
+            for index, fields in enumerate(queries):
+                texts[index] = self.post(fields)
+                if (callback is not None):
+                    callback(index)
+            return texts
+        with ThreadPoolExecutor(max_workers=self.maxRequests) as executor:
+            futures = {executor.submit(self.post, fields): index
+                       for index, fields in enumerate(queries)}
+            for future in as_completed(futures):
+                index = futures[future]
+                texts[index] = future.result()
+                if (callback is not None):
+                    callback(index)
+        return texts
+
+
+class LipidMapsCache(object):
+    """A LipidMapsCache object stores the LIPID MAPS matches of each m/z
+    in a SQLite database.
+
+    Every entry holds the header and the rows of the response table for
+    one m/z (no rows if it had no matches), so the tables of later
+    searches can be rebuilt without contacting the server.
+
+    Attributes:
+        path  (Public[str])
+            Path of the SQLite database file.
+        ttl  (Public[float])
+            Seconds an entry remains valid.
+        maxEntries  (Public[int])
+            Maximum number of entries kept.
+        _conn  (Private[sqlite3.Connection])
+            Connection to the database.
+    """
+
+    def __init__(self, path=None, ttl=CACHE_TTL,
+                 maxEntries=CACHE_MAX_ENTRIES):
+        # type: (str, float, int) -> LipidMapsCache
+        """Constructor of the class LipidMapsCache.
+
+        Keyword Arguments:
+            path       -- path of the SQLite database file (created if
+                          it does not exist) [default: see
+                          get_cache_path()]
+            ttl        -- seconds an entry remains valid
+                          [default: CACHE_TTL]
+            maxEntries -- maximum number of entries kept
+                          [default: CACHE_MAX_ENTRIES]
+        """
+        self.path = path if (path) else get_cache_path()
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if (not os.path.isdir(folder)):
+            os.makedirs(folder)
+        # Several processes (e.g. PeakFilter batch runs) may share the
+        # same cache file
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        with self._conn:
+            self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS entries (key TEXT, mz TEXT, '
+                    'header TEXT, rows TEXT, created REAL, accessed REAL, '
+                    'PRIMARY KEY (key, mz))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS accessed_index '
+                               'ON entries (accessed)')
+
+    def __enter__(self):
+        # type: () -> LipidMapsCache
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # type: (type, Exception, traceback) -> bool
+        self.close()
+        return False
+
+    def close(self):
+        # type: () -> None
+        """Close the connection to the database."""
+        self._conn.close()
+
+    def get(self, key, mzList):
+        # type: (str, list) -> dict
+        """Return a dictionary with the (header, rows) entry of every
+        m/z in 'mzList' found in the cache for the given search key.
+
+        Keyword Arguments:
+            key    -- search key (see _get_key())
+            mzList -- list of m/z values (as sent to the server)
+        """
+        now = time.time()
+        found = {}
+        for start in range(0, len(mzList), _SQL_MAX_PARAMS):
+            mzBatch = mzList[start : start + _SQL_MAX_PARAMS]
+            cursor = self._conn.execute(
+                    ('SELECT mz, header, rows FROM entries WHERE key = ? AND '
+                     'created >= ? AND mz IN ({0})').format(
+                            ','.join('?' * len(mzBatch))),
+                    [key, now - self.ttl] + mzBatch)
+            for mz, header, rows in cursor:
+                found[mz] = (header, rows)
+        if (found):
+            with self._conn:
+                self._conn.executemany(
+                        'UPDATE entries SET accessed = ? WHERE key = ? AND '
+                        'mz = ?', [(now, key, mz) for mz in found])
+        return found
+
+    def put(self, key, entries):
+        # type: (str, dict) -> None
+        """Store the (header, rows) entry of every m/z in 'entries' for
+        the given search key, removing the expired entries and the
+        least recently used ones above the maximum size.
+
+        Keyword Arguments:
+            key     -- search key (see _get_key())
+            entries -- dictionary of m/z (as sent to the server) and
+                       (header, rows) pairs
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                    [(key, mz, header, rows, now, now)
+                     for mz, (header, rows) in entries.items()])
+            self._conn.execute('DELETE FROM entries WHERE created < ?',
+                               (now - self.ttl, ))
+            numEntries = self._conn.execute(
+                    'SELECT COUNT(*) FROM entries').fetchone()[0]
+            if (numEntries > self.maxEntries):
+                self._conn.execute(
+                        'DELETE FROM entries WHERE rowid IN (SELECT rowid '
+                        'FROM entries ORDER BY accessed LIMIT ?)',
+                        (numEntries - self.maxEntries, ))
+
+
+def _get_key(fields):
+    # type: (dict) -> str
+    """Return the search key of the given request fields: every field
+    but the m/z values.
+
+    Keyword Arguments:
+        fields -- request fields
+    """
+    return json.dumps(sorted((k, v) for k, v in fields.items()
+                             if (k != 'file')))
+
+
+def _get_mz_list(fields):
+    # type: (dict) -> list
+    """Return the list of m/z values (as strings) of the given request
+    fields.
+
+    Keyword Arguments:
+        fields -- request fields
+    """
+    return [x.strip() for x in fields['file'].splitlines() if x.strip()]
+
+
+def _split_response(text, mzList):
+    # type: (str, list) -> dict
+    """Return a dictionary with the (header, rows) entry of every m/z in
+    'mzList' from the given response text.
+
+    Each row is assigned to the requested m/z closest to its input mass
+    (the server might alter its format). The rows keep the order of the
+    response.
+
+    Keyword Arguments:
+        text   -- text of the response (tab-separated table of matches)
+        mzList -- list of m/z values of the request
+    """
+    lines = [x for x in text.splitlines() if x.strip()]
+    rows = dict((mz, []) for mz in mzList)
+    header = ''
+    if (lines):
+        header = lines[0]
+        massIndex = header.split('\t').index('Input Mass') \
+                    if ('Input Mass' in header.split('\t')) else 0
+        mzValues = [float(x) for x in mzList]
+        for line in lines[1:]:
+            inputMass = line.split('\t')[massIndex]
+            if (inputMass in rows):
+                rows[inputMass].append(line)
+            else:
+                mass = float(inputMass)
+                closest = min(range(len(mzList)),
+                              key=lambda i: abs(mzValues[i] - mass))
+                rows[mzList[closest]].append(line)
+    return dict((mz, (header if (rows[mz]) else '', '\n'.join(rows[mz])))
+                for mz in mzList)
+
+
+def _join_entries(entries):
+    # type: (list) -> str
+    """Return the response text rebuilt from the given list of (header,
+    rows) entries ('' if none of them has rows).
+
+    Keyword Arguments:
+        entries -- list of (header, rows) entries
+    """
+    rows = [x[1] for x in entries if x[1]]
+    if (not rows):
+        return ''
+    header = next(x[0] for x in entries if x[1])
+    return '\n'.join([header] + rows) + '\n'
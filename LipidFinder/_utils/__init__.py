@@ -10,6 +10,8 @@ from __future__ import print_function
 
 import os
 
+import numpy
+
 
 def normalise_path(path):
     # type: (str) -> str
@@ -37,19 +39,34 @@ def traceless_warning(message, category, filename, lineno, file=None,
     return 'Warning{0}{1}{1}'.format(message, os.linesep)
 
 
+def _round(value, precision):
+    # type: (object, int) -> object
+    """Return the given value rounded to the given precision. NumPy
+    arrays are rounded element-wise, following the same rule NumPy
+    applies to its scalars.
+
+    Keyword Arguments:
+        value     -- float or NumPy array
+        precision -- number of decimal digits
+    """
+    if (isinstance(value, numpy.ndarray)):
+        return numpy.round(value, precision)
+    return round(value, precision)
+
+
 def mz_delta(mz, fixederr, ppmerr, precision=5):
     # type: (float, float, float, int) -> float
     """Return the delta tolerance for the given m/z.
 
     Keyword Arguments:
-        mz        -- m/z reference value
+        mz        -- m/z reference value (or NumPy array of values)
         fixederr  -- allowed fixed error
         ppmerr    -- mass-dependant PPM error to add to the fixed error
         precision -- number of decimal digits to use with floats (e.g. a
                      precision of 2 forces a difference of 0.01 between
                      two any consecutive float numbers) [default: 5]
     """
-    return round(fixederr + (mz * ppmerr * 1e-6), precision)
+    return _round(fixederr + (mz * ppmerr * 1e-6), precision)
 
 
 def mz_tol_range(mz, fixederr, ppmerr, precision=5):
@@ -57,7 +74,7 @@ def mz_tol_range(mz, fixederr, ppmerr, precision=5):
     """Return lower and upper tolerance limits for the given m/z.
 
     Keyword Arguments:
-        mz        -- m/z reference value
+        mz        -- m/z reference value (or NumPy array of values)
         fixederr  -- allowed fixed error
         ppmerr    -- mass-dependant PPM error to add to the fixed error
         precision -- number of decimal digits to use with floats (e.g. a
@@ -65,7 +82,7 @@ def mz_tol_range(mz, fixederr, ppmerr, precision=5):
                      two any consecutive float numbers) [default: 5]
     """
     delta = mz_delta(mz, fixederr, ppmerr, precision)
-    return (round(mz - delta, precision), round(mz + delta, precision))
+    return (_round(mz - delta, precision), _round(mz + delta, precision))
 
 
 def rt_delta(maxdiff, precision=5):
@@ -89,7 +106,8 @@ def rt_tol_range(rt, maxdiff, precision=5):
     time.
 
     Keyword Arguments:
-        rt        -- retention time (RT) reference value
+        rt        -- retention time (RT) reference value (or NumPy
+                     array of values)
         maxdiff   -- maximum time difference between a feature edge and
                      an adjacent frame to be considered part of the same
                      feature
@@ -98,7 +116,27 @@ def rt_tol_range(rt, maxdiff, precision=5):
                      any two consecutive float numbers) [default: 5]
     """
     delta = rt_delta(maxdiff, precision)
-    return (round(rt - delta, precision), round(rt + delta, precision))
+    return (_round(rt - delta, precision), _round(rt + delta, precision))
+
+
+def nonzero_mean(values):
+    # type: (object) -> numpy.ndarray
+    """Return the mean of the positive values of each row of the given
+    2D array or dataframe, or 0 if a row has none (zeros and NaNs are
+    ignored).
+
+    Keyword Arguments:
+        values -- 2D array or dataframe (e.g. the intensity columns)
+    """
+    values = numpy.asarray(values, dtype=float)
+    mask = values > 0
+    counts = mask.sum(axis=1)
+    # Replacing the masked values by zeros keeps the array contiguous,
+    # so each row is summed as it would be on its own
+    sums = numpy.where(mask, values, 0.0).sum(axis=1)
+    means = numpy.zeros(len(sums))
+    numpy.divide(sums, counts, out=means, where=(counts > 0))
+    return means
 
 
 def print_progress_bar(iteration, total, prefix='', suffix='Completed',
@@ -5,9 +5,9 @@
 # This file is part of the LipidFinder software tool and governed by the
 # 'MIT License'. Please see the LICENSE file that should have been
 # included as part of this software.
-"""Read negative and positive input CSV/TSV/XLS/XLSX files and the
-parameters JSON file, create the output folder and launch LipidFinder's
-Amalgamator.
+"""Read negative and positive input CSV/TSV/XLS/XLSX files (one or more
+batches per polarity) and the parameters JSON file, create the output
+folder and launch LipidFinder's Amalgamator.
 """
 
 import argparse
@@ -25,22 +25,29 @@ def main():
     parser = argparse.ArgumentParser(
             description="Run LipidFinder's Amalgamator.")
     parser.add_argument('-neg', '--negative', metavar='FILE', type=str,
-                        required=True, help="negative data file")
+                        nargs='+', required=True,
+                        help="negative data file(s), one per batch")
     parser.add_argument('-pos', '--positive', metavar='FILE', type=str,
-                        required=True, help="positive data file")
+                        nargs='+', required=True,
+                        help="positive data file(s), one per batch")
     parser.add_argument('-o', '--output', metavar='DIR', type=str,
                         help="folder where the output files will be stored")
     parser.add_argument('-p', '--params', metavar='FILE', type=str,
                         required=True, help="parameters JSON file")
     parser.add_argument('--timestamp', action='store_true',
                         help="add a timestamp to the output folder's name")
+    parser.add_argument('--profile', action='store_true',
+                        help="record the time and memory used by each stage")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help=("also trace the memory allocated by each stage "
+                              "(slow, implies --profile)"))
     parser.add_argument('--version', action='version',
                         version="LipidFinder 2.0")
     args = parser.parse_args()
     # Load parameters and input data
     parameters = LFParameters(module='amalgamator', src=args.params)
-    negData = LFDataFrame(args.negative, parameters)
-    posData = LFDataFrame(args.positive, parameters)
+    negBatches = [LFDataFrame(x, parameters) for x in args.negative]
+    posBatches = [LFDataFrame(x, parameters) for x in args.positive]
     # Check if the output directory exists. If not, create it.
     dst = args.output if (args.output) else ''
     if (args.timestamp):
@@ -50,7 +57,8 @@ def main():
     if (not os.path.isdir(dst)):
         os.makedirs(dst)
     # Run Amalgamator
-    Amalgamator.amalgamate_data(negData, posData, parameters, dst)
+    Amalgamator.amalgamate_batches(negBatches, posBatches, parameters, dst,
+                                   args.profile, args.trace_memory)
 
 if (__name__ == '__main__'):
     main()
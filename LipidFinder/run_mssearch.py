@@ -31,6 +31,11 @@ def main():
                         required=True, help="parameters JSON file")
     parser.add_argument('--timestamp', action='store_true',
                         help="add a timestamp to the output folder's name")
+    parser.add_argument('--profile', action='store_true',
+                        help="record the time and memory used by each stage")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help=("also trace the memory allocated by each stage "
+                              "(slow, implies --profile)"))
     parser.add_argument('--version', action='version',
                         version="LipidFinder v2.0")
     args = parser.parse_args()
@@ -46,7 +51,8 @@ def main():
     if (not os.path.isdir(dst)):
         os.makedirs(dst)
     # Run MS Search
-    MSSearch.bulk_structure_search(data, parameters, dst)
+    MSSearch.bulk_structure_search(data, parameters, dst, args.profile,
+                                   args.trace_memory)
 
 if (__name__ == '__main__'):
     main()
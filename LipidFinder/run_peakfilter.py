@@ -16,6 +16,7 @@ import os
 from LipidFinder import PeakFilter
 from LipidFinder.Configuration import LFParameters
 from LipidFinder.LFDataFrame import LFDataFrame
+from LipidFinder.PeakFilter import Checkpoint
 from LipidFinder._utils import normalise_path
 
 
@@ -33,12 +34,30 @@ def main ():
                         help="add a timestamp to the output folder's name")
     parser.add_argument('--verbose', action='store_true',
                         help="generate intermediate CSV result files")
+    parser.add_argument('--log-ids', action='store_true',
+                        help="write the IDs of every removed row in the log")
+    parser.add_argument('--checkpoints', metavar='DIR', type=str, default='',
+                        help=("folder where to save the checkpoint of each "
+                              "stage and resume from the latest valid one"))
+    parser.add_argument('--clear-checkpoints', action='store_true',
+                        help=("remove every checkpoint file of the "
+                              "checkpoint folder after a successful run"))
+    parser.add_argument('--profile', action='store_true',
+                        help="record the time and memory used by each stage")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help=("also trace the memory allocated by each stage "
+                              "(slow, implies --profile)"))
+    parser.add_argument('--cross-check', metavar='STAGE', type=str,
+                        nargs='*', default=None,
+                        help=("run the given stages (default: every stage "
+                              "with a fast implementation) with both engines "
+                              "and stop if their results differ"))
     parser.add_argument('--version', action='version',
                         version="LipidFinder v2.0")
     args = parser.parse_args()
     # Load parameters and input data
     parameters = LFParameters(module='peakfilter', src=args.params)
-    data = LFDataFrame(args.input, parameters)
+    data = LFDataFrame(args.input, parameters, logIDs=args.log_ids)
     # Check if the output directory exists. If not, create it.
     dst = args.output if (args.output) else ''
     if (args.timestamp):
@@ -47,8 +66,17 @@ def main ():
     dst = normalise_path(dst)
     if (not os.path.isdir(dst)):
         os.makedirs(dst)
+    # Stages to run with both engines (every stage with a fast
+    # implementation if none is given)
+    crossCheck = False
+    if (args.cross_check is not None):
+        crossCheck = args.cross_check if (args.cross_check) else True
     # Run PeakFilter
-    PeakFilter.peak_filter(data, parameters, dst, args.verbose)
+    PeakFilter.peak_filter(data, parameters, dst, args.verbose,
+                           args.checkpoints, args.profile,
+                           args.trace_memory, crossCheck)
+    if (args.checkpoints and args.clear_checkpoints):
+        Checkpoint.remove_checkpoints(args.checkpoints)
 
 if (__name__ == '__main__'):
     main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Read the manifest CSV/JSON file with the input data and parameters
+JSON file of each job, create the output folder and launch LipidFinder's
+PeakFilter for every job in a pool of worker processes.
+
+The manifest must have "input" and "params" columns (CSV) or fields
+(JSON list of objects), and an optional "output" one with the name of
+each job's output folder, e.g.:
+    input,params,output
+    xcms_negative.csv,params_peakfilter_negative.json,negative
+    xcms_positive.csv,params_peakfilter_positive.json,positive
+"""
+
+import argparse
+from datetime import datetime
+import os
+
+from LipidFinder.PeakFilter import Batch
+from LipidFinder._utils import normalise_path
+
+
+def main ():
+    # Create the argument parser and parse the arguments
+    parser = argparse.ArgumentParser(
+            description="Run LipidFinder's PeakFilter for a batch of inputs.")
+    parser.add_argument('-m', '--manifest', metavar='FILE', type=str,
+                        required=True, help="manifest CSV/JSON file")
+    parser.add_argument('-o', '--output', metavar='DIR', type=str,
+                        help="folder where the output files will be stored")
+    parser.add_argument('--workers', metavar='N', type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument('--timestamp', action='store_true',
+                        help="add a timestamp to the output folder's name")
+    parser.add_argument('--version', action='version',
+                        version="LipidFinder v2.0")
+    args = parser.parse_args()
+    # Load the list of jobs
+    jobs = Batch.read_manifest(args.manifest)
+    # Check if the output directory exists. If not, create it.
+    dst = args.output if (args.output) else ''
+    if (args.timestamp):
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        dst += '_{0}'.format(timestamp) if (dst) else timestamp
+    dst = normalise_path(dst)
+    if (not os.path.isdir(dst)):
+        os.makedirs(dst)
+    # Run PeakFilter for every job
+    Batch.peak_filter_batch(jobs, dst, args.workers)
+
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Read the input CSV/TSV/XLS/XLSX file(s), the base parameters JSON file
+and the parameter grid JSON file, create the output folder and launch
+LipidFinder's PeakFilter for every combination of parameter values.
+
+The parameter grid JSON file must contain an object with PeakFilter
+parameter names as keys and lists of values to test as values, e.g.:
+    {"mzPPMError": [3.0, 4.0], "solventMinFoldDiff": [2.0, 3.0]}
+"""
+
+import argparse
+from datetime import datetime
+import json
+import os
+
+from LipidFinder.Configuration import LFParameters
+from LipidFinder.LFDataFrame import LFDataFrame
+from LipidFinder.PeakFilter import Sweep
+from LipidFinder._utils import normalise_path
+
+
+def main ():
+    # Create the argument parser and parse the arguments
+    parser = argparse.ArgumentParser(
+            description=("Run LipidFinder's PeakFilter for every combination "
+                         "of the given parameter values."))
+    parser.add_argument('-i', '--input', metavar='INPUT', type=str,
+                        required=True, help="file or folder with input data")
+    parser.add_argument('-o', '--output', metavar='DIR', type=str,
+                        help="folder where the output files will be stored")
+    parser.add_argument('-p', '--params', metavar='FILE', type=str,
+                        required=True, help='base parameters JSON file')
+    parser.add_argument('-g', '--grid', metavar='FILE', type=str,
+                        required=True, help='parameter grid JSON file')
+    parser.add_argument('--workers', metavar='N', type=int, default=None,
+                        help="maximum number of worker processes")
+    parser.add_argument('--keep-checkpoints', action='store_true',
+                        help=("keep the checkpoints of the shared stages "
+                              "after the sweep"))
+    parser.add_argument('--timestamp', action='store_true',
+                        help="add a timestamp to the output folder's name")
+    parser.add_argument('--version', action='version',
+                        version="LipidFinder v2.0")
+    args = parser.parse_args()
+    # Load parameters, parameter grid and input data
+    parameters = LFParameters(module='peakfilter', src=args.params)
+    with open(args.grid, 'r') as gridFile:
+        grid = json.load(gridFile)
+    data = LFDataFrame(args.input, parameters)
+    # Check if the output directory exists. If not, create it.
+    dst = args.output if (args.output) else ''
+    if (args.timestamp):
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        dst += '_{0}'.format(timestamp) if (dst) else timestamp
+    dst = normalise_path(dst)
+    if (not os.path.isdir(dst)):
+        os.makedirs(dst)
+    # Run the PeakFilter parameter sweep
+    summary = Sweep.peak_filter_sweep(data, parameters, grid, dst,
+                                      args.workers, args.keep_checkpoints)
+    print(summary.to_string(index=False))
+
+if (__name__ == '__main__'):
+    main()
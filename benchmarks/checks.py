@@ -0,0 +1,796 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Focused regression checks for the optimised code paths that the
+golden-output harness (which only covers PeakFilter's final outputs)
+does not reach:
+    checkpoints       -- PeakFilter checkpoints are restored, resumed,
+                         invalidated by a parameter change, skipped if
+                         corrupted and removed
+    fingerprints      -- stage fingerprints and changed_stages() follow
+                         the parameters (and files) read by each stage
+    sweep-tree        -- the sweep prefix tree shares the right stages
+                         and has no node computing zero stages
+    engines           -- the reference and fast engines of PeakFilter
+                         produce the same data and removal ledger
+    amalgamator       -- Amalgamator (one or several batches per
+                         polarity) matches a row-by-row reference
+    local-search      -- LipidDatabase.search() and count_hits() match
+                         a brute-force search over every structure
+    assemble-results  -- MSSearch's result assembly matches the
+                         row-by-row join it replaced
+    output-writer     -- OutputWriter writes the same table in chunks,
+                         starting a new XLSX sheet when one is full
+    summary           -- MSSearch's summary matches the per-group
+                         category selection it replaced
+
+The reference implementations are simple restatements of the former
+row-by-row code, kept here only to validate the optimised ones. Every
+check runs on small synthetic datasets (see benchmarks/synthetic.py) in
+a temporary folder and needs no network access.
+
+Examples:
+    python -m benchmarks.checks
+    python -m benchmarks.checks amalgamator local-search
+"""
+
+import argparse
+from collections import OrderedDict
+from contextlib import redirect_stdout
+import copy
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import traceback
+import zipfile
+
+import numpy
+import pandas
+
+from LipidFinder import Amalgamator
+from LipidFinder import MSSearch
+from LipidFinder import PeakFilter
+from LipidFinder.Configuration import LFParameters
+from LipidFinder.LFDataFrame import LFDataFrame
+from LipidFinder.MSSearch import Summary
+from LipidFinder.MSSearch import Writer
+from LipidFinder.PeakFilter import Checkpoint
+from LipidFinder.PeakFilter import Sweep
+from LipidFinder._utils import LipidDatabase
+from LipidFinder._utils import mz_tol_range, rt_tol_range
+
+from benchmarks import synthetic
+
+
+# Number of rows of the synthetic PeakFilter datasets
+PEAKFILTER_ROWS = 1500
+# Stage whose parameters are changed to invalidate the later stages
+CHANGED_STAGE = 'ContaminantRemoval.stacks'
+# Amalgamator parameters of the synthetic summary datasets
+AMALGAMATOR_PARAMS = {'numSamples': 6, 'mzCol': 'mzmed', 'rtCol': 'rtmed',
+                      'firstSampleIndex': 5, 'mzFixedError': 0.0005,
+                      'mzPPMError': 4.0, 'maxRTDiffAdjFrame': 0.3}
+# Ion adducts searched in the synthetic structure export
+ADDUCTS = ['[M-H]-', '[M.Cl]-', '[M+H]+', '[M+Na]+']
+
+
+def _expect(condition, message):
+    # type: (bool, str) -> None
+    """Raise an AssertionError with the given message if 'condition' is
+    False (plain assert statements are removed by "python -O").
+
+    Keyword Arguments:
+        condition -- condition that must hold
+        message   -- description of the failure
+    """
+    if (not condition):
+        raise AssertionError(message)
+
+
+def _expect_same_frame(expected, new, label):
+    # type: (pandas.DataFrame, pandas.DataFrame, str) -> None
+    """Raise an AssertionError if both dataframes do not have the same
+    columns and values once written to and read back from CSV, so the
+    column types assigned by each implementation do not matter.
+
+    Keyword Arguments:
+        expected -- dataframe of the reference implementation
+        new      -- dataframe of the optimised implementation
+        label    -- name of the compared output in the error message
+    """
+    frames = [pandas.read_csv(io.StringIO(x.to_csv(index=False)))
+              for x in (expected, new)]
+    try:
+        pandas.testing.assert_frame_equal(frames[0], frames[1],
+                                          check_dtype=False)
+    except AssertionError as e:
+        raise AssertionError("{0} differs:\n{1}".format(label, e))
+
+
+def _expect_same_data(expected, new, label):
+    # type: (LFDataFrame, LFDataFrame, str) -> None
+    """Raise an AssertionError if both LFDataFrame instances differ in
+    their values or removal ledger.
+
+    Keyword Arguments:
+        expected -- reference LFDataFrame instance
+        new      -- LFDataFrame instance to check
+        label    -- name of the compared data in the error message
+    """
+    try:
+        pandas.testing.assert_frame_equal(
+                pandas.DataFrame(expected), pandas.DataFrame(new),
+                check_exact=True)
+        pandas.testing.assert_frame_equal(expected.removal_ledger(),
+                                          new.removal_ledger())
+    except AssertionError as e:
+        raise AssertionError("{0} differs:\n{1}".format(label, e))
+
+
+def _quietly(function, *args, **kwargs):
+    # type: (callable, ...) -> object
+    """Return the result of 'function' called with the given arguments,
+    hiding the progress bars it prints.
+
+    Keyword Arguments:
+        function -- function to call
+        *args    -- positional arguments of 'function'
+        **kwargs -- keyword arguments of 'function'
+    """
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        return function(*args, **kwargs)
+
+
+def _peakfilter_dataset(tmpDir, kind='xcms'):
+    # type: (str, str) -> tuple
+    """Write a synthetic PeakFilter dataset in 'tmpDir' and return its
+    parameters and the path of its CSV file, so a fresh LFDataFrame can
+    be loaded for every run.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+        kind   -- "xcms" or "sieve" layout [default: "xcms"]
+    """
+    dataFrame, paramsDict = synthetic.generate_peakfilter_dataset(
+            PEAKFILTER_ROWS, kind, numSamples=6)
+    dataPath, paramsPath = synthetic.write_peakfilter_dataset(
+            dataFrame, paramsDict, tmpDir, 'peakfilter_{0}'.format(kind))
+    return (LFParameters(module='peakfilter', src=paramsPath), dataPath)
+
+
+def check_checkpoints(tmpDir):
+    # type: (str) -> None
+    """Check that PeakFilter's checkpoints restore the same data and
+    ledger as a full run, resume a partial run with the same result,
+    are invalidated from the first stage reading a changed parameter,
+    are skipped when corrupted and are all removed at the end.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    parameters, dataPath = _peakfilter_dataset(tmpDir)
+    checkpointDir = os.path.join(tmpDir, 'checkpoints')
+    stages = [name for name, _ in PeakFilter._get_stages(parameters)]
+    expected = _quietly(PeakFilter.run_stages,
+                        LFDataFrame(dataPath, parameters), parameters,
+                        checkpointDir)
+    data = LFDataFrame(dataPath, parameters)
+    keys = Checkpoint.get_stage_keys(data, parameters, stages)
+    restored, numStages = Checkpoint.restore_latest(data, checkpointDir, keys)
+    _expect(numStages == len(stages),
+            "{0} of {1} stages restored".format(numStages, len(stages)))
+    _expect_same_data(expected, restored, "Restored data")
+    # Resume the run from the stage before CHANGED_STAGE
+    index = stages.index(CHANGED_STAGE)
+    Checkpoint.remove_checkpoints(checkpointDir, keys[index : ])
+    resumed = _quietly(PeakFilter.run_stages,
+                       LFDataFrame(dataPath, parameters), parameters,
+                       checkpointDir)
+    _expect_same_data(expected, resumed, "Resumed data")
+    # Changing a parameter of CHANGED_STAGE keeps the previous keys only
+    other = copy.deepcopy(parameters)
+    other['maxStackGap'] = parameters['maxStackGap'] + 1
+    otherKeys = Checkpoint.get_stage_keys(data, other, stages)
+    _expect(otherKeys[ : index] == keys[ : index],
+            "Keys of the stages before {0} changed".format(CHANGED_STAGE))
+    _expect(all(x != y for x, y in zip(otherKeys[index : ], keys[index : ])),
+            "Keys from {0} onwards did not change".format(CHANGED_STAGE))
+    numStages = Checkpoint.restore_latest(data, checkpointDir, otherKeys)[1]
+    _expect(numStages == index,
+            "{0} stages restored instead of {1}".format(numStages, index))
+    # A corrupted checkpoint is skipped
+    with open(Checkpoint._checkpoint_path(checkpointDir, keys[-1]),
+              'wb') as chkFile:
+        chkFile.write(b'corrupted')
+    numStages = Checkpoint.restore_latest(data, checkpointDir, keys)[1]
+    _expect(numStages == len(stages) - 1,
+            "Corrupted checkpoint not skipped")
+    numRemoved = Checkpoint.remove_checkpoints(checkpointDir)
+    _expect(numRemoved == len(stages),
+            "{0} checkpoints removed instead of {1}".format(numRemoved,
+                                                            len(stages)))
+    _expect(not os.path.isdir(checkpointDir),
+            "Empty checkpoint folder not removed")
+
+
+def check_fingerprints(tmpDir):
+    # type: (str) -> None
+    """Check that changing a parameter (or the content of a file given
+    as parameter) changes the fingerprint of the stages reading it and
+    the cumulative fingerprint of every later stage, and nothing else.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    parameters = _peakfilter_dataset(tmpDir)[0]
+    stages = parameters.get_stages()
+    other = copy.deepcopy(parameters)
+    _expect(parameters.changed_stages(other) == [],
+            "Changed stages found between identical parameters")
+    other['maxStackGap'] = parameters['maxStackGap'] + 1
+    index = stages.index(CHANGED_STAGE)
+    changed = parameters.changed_stages(other)
+    _expect(changed == stages[index : ],
+            "Unexpected changed stages: {0}".format(changed))
+    for stageIndex, stage in enumerate(stages):
+        same = (parameters.stage_fingerprint(stage)
+                == other.stage_fingerprint(stage))
+        _expect(same == (stageIndex < index),
+                "Wrong cumulative fingerprint of {0}".format(stage))
+        same = (parameters.stage_fingerprint(stage, False)
+                == other.stage_fingerprint(stage, False))
+        _expect(same == (stage != CHANGED_STAGE),
+                "Wrong fingerprint of {0}".format(stage))
+    # Editing the stacks file changes the fingerprint of its stage
+    stacksPath = os.path.join(tmpDir, 'stacks.csv')
+    shutil.copyfile(parameters['stacksCSVPath'], stacksPath)
+    other = copy.deepcopy(parameters)
+    other['stacksCSVPath'] = stacksPath
+    fingerprint = other.stage_fingerprint(CHANGED_STAGE, False)
+    with open(stacksPath, 'a') as stacksFile:
+        stacksFile.write('\n')
+    _expect(other.stage_fingerprint(CHANGED_STAGE, False) != fingerprint,
+            "Editing a parameter file does not change the fingerprint")
+
+
+def check_sweep_tree(tmpDir):
+    # type: (str) -> None
+    """Check the prefix tree of the sweep for a parameter of the first
+    stage, a parameter of a later stage and two parameters of different
+    stages.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    parameters = _peakfilter_dataset(tmpDir)[0]
+    stages = [name for name, _ in PeakFilter._get_stages(parameters)]
+    index = stages.index(CHANGED_STAGE)
+    gap = parameters['maxStackGap']
+
+    def build(grid):
+        return Sweep._build_tree([x for _, x in Sweep.get_configurations(
+                parameters, grid)])
+
+    # The first stage differs: nothing is shared, so no root node
+    tree = build({'QCRSD': [[30, 50], [25, 45]]})
+    _expect(tree == [{'config': 0}, {'config': 1}],
+            "Unexpected tree for a first stage parameter: {0}".format(tree))
+    tree = build({'maxStackGap': [gap, gap + 1]})
+    expected = [{'depth': index, 'configs': [0, 1],
+                 'children': [{'config': 0}, {'config': 1}]}]
+    _expect(tree == expected,
+            "Unexpected tree for a later stage parameter: {0}".format(tree))
+    # Configurations: (gap, 2.0), (gap, 3.0), (gap + 1, 2.0), (gap + 1, 3.0)
+    tree = build({'maxStackGap': [gap, gap + 1],
+                  'solventMinFoldDiff': [2.0, 3.0]})
+    solventIndex = stages.index('SolventCalcs')
+    expected = [{'depth': solventIndex, 'configs': [0, 1, 2, 3],
+                 'children': [
+                        {'depth': index, 'configs': [0, 2],
+                         'children': [{'config': 0}, {'config': 2}]},
+                        {'depth': index, 'configs': [1, 3],
+                         'children': [{'config': 1}, {'config': 3}]}]}]
+    _expect(tree == expected,
+            "Unexpected tree for two parameters: {0}".format(tree))
+
+
+def check_engines(tmpDir):
+    # type: (str) -> None
+    """Check that every stage with a fast implementation produces the
+    same data and removal ledger with both engines, on XCMS- and
+    SIEVE-shaped datasets.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    for kind in ['xcms', 'sieve']:
+        parameters, dataPath = _peakfilter_dataset(tmpDir, kind)
+        data = LFDataFrame(dataPath, parameters)
+        dst = os.path.join(tmpDir, 'engines_{0}'.format(kind))
+        os.makedirs(dst)
+        # Raises an AssertionError at the first stage that differs
+        _quietly(PeakFilter.peak_filter, data, parameters, dst,
+                 crossCheck=list(PeakFilter.FAST_STAGES))
+
+
+def _reference_amalgamation(negData, posData, parameters, offsets):
+    # type: (pandas.DataFrame, pandas.DataFrame, LFParameters, list)
+    #       -> pandas.DataFrame
+    """Return the amalgamated dataframe computed row by row, as the
+    original implementation did.
+
+    Keyword Arguments:
+        negData    -- negative polarity dataframe
+        posData    -- positive polarity dataframe
+        parameters -- LipidFinder's Amalgamator parameters instance
+        offsets    -- mass differences between both polarities, in order
+                      of priority
+    """
+    mzCol = parameters['mzCol']
+    rtCol = parameters['rtCol']
+    firstIndex = parameters['firstSampleIndex'] - 1
+    lastIndex = firstIndex + parameters['numSamples']
+
+    def total_means(data):
+        means = []
+        for values in data.iloc[:, firstIndex : lastIndex].values:
+            nonzero = values[values > 0]
+            means.append(int(numpy.rint(nonzero.mean())) if (len(nonzero))
+                         else 0)
+        return means
+
+    negMeans = total_means(negData)
+    posMeans = total_means(posData)
+    pmz = posData[mzCol].values
+    prt = posData[rtCol].values
+    suffix = ' (Combined)' if (parameters['combineIntensities']) \
+             else ' (Both)'
+    # Positive frames not matched yet, in their original order
+    available = list(range(len(posData)))
+    rows = []
+    for i in range(len(negData)):
+        negRow = negData.iloc[i].copy()
+        negMZ = negRow[mzCol]
+        negRT = negRow[rtCol]
+        minRT, maxRT = rt_tol_range(negRT, parameters['maxRTDiffAdjFrame'])
+        match = None
+        for offset in offsets:
+            srcMZ = negMZ + offset
+            minMZ, maxMZ = mz_tol_range(srcMZ, parameters['mzFixedError'],
+                                        parameters['mzPPMError'])
+            candidates = [k for k, j in enumerate(available)
+                          if ((minMZ <= pmz[j] <= maxMZ)
+                              and (minRT <= prt[j] <= maxRT))]
+            if (candidates):
+                # Highest hit score, or the first available frame if
+                # every score is 0
+                maxScore = 0.0
+                best = 0
+                for k in candidates:
+                    score = Amalgamator.__hitScore__(
+                            srcMZ, pmz[available[k]], negRT,
+                            prt[available[k]], parameters)
+                    if (score > maxScore):
+                        maxScore = score
+                        best = k
+                match = available.pop(best)
+                break
+        if (match is None):
+            rows.append(negRow)
+            continue
+        posRow = posData.iloc[match].copy()
+        if (posMeans[match] > negMeans[i]):
+            row, other = posRow, negRow
+        else:
+            row, other = negRow, posRow
+        if (parameters['combineIntensities']):
+            row.iloc[firstIndex : lastIndex] = \
+                    row.iloc[firstIndex : lastIndex] \
+                    + other.iloc[firstIndex : lastIndex]
+        row['Polarity'] += suffix
+        rows.append(row)
+    rows.extend(posData.iloc[j] for j in available)
+    result = pandas.DataFrame(rows).reset_index(drop=True).infer_objects()
+    return result.sort_values([mzCol, rtCol], kind='mergesort')
+
+
+def check_amalgamator(tmpDir):
+    # type: (str) -> None
+    """Check that Amalgamator's output matches the row-by-row reference,
+    with and without combining intensities, and that splitting each
+    polarity in several batches does not change it.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    negData, posData = synthetic.generate_amalgamator_datasets(
+            400, AMALGAMATOR_PARAMS['numSamples'], matchDensity=0.4)
+    # Add exact counterparts of some negative frames (hit score 0), a
+    # second candidate for each of them and a candidate for the second
+    # offset (only chosen if the first offset has none)
+    offsets = pandas.read_csv(LFParameters(module='amalgamator')[
+            'offsetsCSVPath'])['Mass Offset'].values
+    extra = negData.iloc[ : 40 : 2].copy()
+    extra['Polarity'] = 'Positive'
+    exact = extra.assign(mzmed=extra['mzmed'] + offsets[0])
+    close = exact.assign(rtmed=exact['rtmed'] + 0.01)
+    second = extra.assign(mzmed=extra['mzmed'] + offsets[1])
+    posData = pandas.concat([posData, exact, close, second],
+                            ignore_index=True)
+    posData['id'] = numpy.arange(1, len(posData) + 1)
+    posData.sort_values(['mzmed', 'rtmed'], inplace=True, kind='mergesort')
+    posData.reset_index(drop=True, inplace=True)
+    for combine in [True, False]:
+        paramsDict = dict(AMALGAMATOR_PARAMS, combineIntensities=combine)
+        paramsPath = os.path.join(tmpDir, 'amalgamator_params.json')
+        with open(paramsPath, 'w') as paramsFile:
+            json.dump(paramsDict, paramsFile, indent=4)
+        parameters = LFParameters(module='amalgamator', src=paramsPath)
+        expected = _reference_amalgamation(negData, posData, parameters,
+                                           offsets)
+        singleDst = os.path.join(tmpDir, 'single_{0}'.format(combine))
+        batchDst = os.path.join(tmpDir, 'batches_{0}'.format(combine))
+        for dst in [singleDst, batchDst]:
+            os.makedirs(dst)
+        _quietly(Amalgamator.amalgamate_data, negData.copy(), posData.copy(),
+                 parameters, singleDst)
+        new = pandas.read_csv(os.path.join(singleDst, 'amalgamated.csv'))
+        _expect_same_frame(expected, new,
+                           "Amalgamated data (combine={0})".format(combine))
+        _quietly(Amalgamator.amalgamate_batches,
+                 [x.copy() for x in numpy.array_split(negData, 3)],
+                 [x.copy() for x in numpy.array_split(posData, 2)],
+                 parameters, batchDst)
+        with open(os.path.join(singleDst, 'amalgamated.csv'), 'r') as csvFile:
+            singleText = csvFile.read()
+        with open(os.path.join(batchDst, 'amalgamated.csv'), 'r') as csvFile:
+            _expect(csvFile.read() == singleText,
+                    "Batch amalgamation (combine={0}) differs".format(
+                            combine))
+
+
+def _reference_search(database, mzValues, tolerance, adducts, categories=None,
+                      evenChains=False, massShift=0.0):
+    # type: (LipidDatabase, numpy.ndarray, object, list, list, bool,
+    #        float) -> pandas.DataFrame
+    """Return the matches of every m/z value found comparing it with
+    every structure of the database, in the order LipidDatabase.search()
+    promises: by input m/z, delta, adduct and matched m/z.
+
+    Keyword Arguments:
+        database   -- LipidDatabase instance
+        mzValues   -- array of m/z values
+        tolerance  -- mass tolerance (in Daltons), either a single value
+                      or one per m/z
+        adducts    -- list of ion adducts
+        categories -- list of lipid categories to search [default: all]
+        evenChains -- keep only the structures with an even total
+                      number of carbons? [default: False]
+        massShift  -- mass added to every structure [default: 0.0]
+    """
+    structures = database.structures
+    keep = numpy.ones(len(structures), dtype=bool)
+    if (categories):
+        names = [x.split('[')[0].strip().lower() for x in categories]
+        keep &= numpy.array([x.split('[')[0].strip().lower() in names
+                             for x in structures['Category']])
+    if (evenChains):
+        keep &= numpy.array(
+                [sum(int(x) for x in re.findall(r'(\d+):\d+', name)) % 2 == 0
+                 for name in structures['Bulk Structure']])
+    tolerance = numpy.broadcast_to(tolerance, mzValues.shape)
+    indices = numpy.flatnonzero(keep)
+    masses = structures['Exact Mass'].values[indices]
+    rows = []
+    for adductIndex, adduct in enumerate(adducts):
+        charge, offset = database.adducts.loc[adduct,
+                                              ['Charge', 'Adduct Offset']]
+        ionMZ = (masses + massShift + offset) / charge
+        # Compare every m/z with every structure
+        for i, mz in enumerate(mzValues):
+            for k in numpy.flatnonzero((ionMZ >= mz - tolerance[i])
+                                       & (ionMZ <= mz + tolerance[i])):
+                rows.append((i, abs(ionMZ[k] - mz), adductIndex, ionMZ[k],
+                             indices[k], adduct))
+    rows.sort(key=lambda x: x[ : 5])
+    structIdx = [x[4] for x in rows]
+    return pandas.DataFrame(
+            {'Input Mass': [mzValues[x[0]] for x in rows],
+             'Matched MZ': numpy.round([x[3] for x in rows],
+                                       LipidDatabase.DECIMALS),
+             'Delta': numpy.round([x[1] for x in rows],
+                                  LipidDatabase.DECIMALS),
+             'Bulk Structure': structures['Bulk Structure'].values[structIdx],
+             'Formula': structures['Formula'].values[structIdx],
+             'Adduct': [x[5] for x in rows],
+             'Main Class': structures['Main Class'].values[structIdx],
+             'Category': structures['Category'].values[structIdx]},
+            columns=LipidDatabase.COLUMNS)
+
+
+def check_local_search(tmpDir):
+    # type: (str) -> None
+    """Check LipidDatabase.search() and count_hits() against a
+    brute-force search, with a fixed and a per-m/z tolerance, category
+    and even chain filters, and a decoy mass shift.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    structuresPath = os.path.join(tmpDir, 'structures.csv')
+    structures = synthetic.generate_structure_export(600, seed=1)
+    structures.to_csv(structuresPath, index=False)
+    database = LipidDatabase.LipidDatabase(structuresPath)
+    # Random m/z values, plus [M-H]- ions of some structures (and their
+    # decoys, 0.5 Da heavier) with a small error
+    rng = numpy.random.RandomState(0)
+    ions = structures['Exact Mass'].values[ : 100] - 1.007276 \
+           + rng.normal(0, 0.003, 100)
+    mzValues = numpy.unique(numpy.concatenate((
+            synthetic.generate_summary_dataset(100)['mzmed'].values, ions,
+            ions[ : 50] + 0.5)).round(6))
+    cases = [(0.01, None, False, 0.0),
+             (mzValues * 20.0 / 1e6, None, False, 0.0),
+             (0.02, ['Glycerophospholipids [GP]', 'Sphingolipids'], True, 0.0),
+             (0.02, None, False, 0.5)]
+    for tolerance, categories, evenChains, massShift in cases:
+        label = ("Search (categories={0}, evenChains={1}, massShift={2})"
+                 ).format(categories, evenChains, massShift)
+        new = database.search(mzValues, tolerance, ADDUCTS, categories,
+                              evenChains, massShift)
+        expected = _reference_search(database, mzValues, tolerance, ADDUCTS,
+                                     categories, evenChains, massShift)
+        _expect(len(expected) > 0, "{0} found no matches".format(label))
+        _expect_same_frame(expected, new, label)
+    massShifts = (0.0, 0.5)
+    hits = database.count_hits(mzValues, 0.02, ADDUCTS, massShifts)
+    expected = [database.search(mzValues, 0.02, ADDUCTS, massShift=x)[
+                        'Input Mass'].nunique() for x in massShifts]
+    _expect(list(hits) == expected,
+            "count_hits() returned {0} instead of {1}".format(list(hits),
+                                                              expected))
+
+
+def _reference_assembly(data, matches, mzCol, rtCol, extraCols):
+    # type: (pandas.DataFrame, pandas.DataFrame, str, str, list)
+    #       -> pandas.DataFrame
+    """Return the matches of every row of 'data' joined row by row, as
+    the original implementation did.
+
+    Keyword Arguments:
+        data      -- pandas.DataFrame instance
+        matches   -- dataframe of matches
+        mzCol     -- m/z column name
+        rtCol     -- retention time column name
+        extraCols -- columns of 'data' copied to each match
+    """
+    frames = []
+    for _, row in data.iterrows():
+        mzMatches = matches.loc[matches[mzCol] == row[mzCol]].copy()
+        if (row['Polarity'].lower().startswith('n')):
+            mzMatches = mzMatches.loc[mzMatches['Adduct'].str[-1] != '+']
+        elif (row['Polarity'].lower().startswith('p')):
+            mzMatches = mzMatches.loc[mzMatches['Adduct'].str[-1] != '-']
+        if (mzMatches.empty):
+            mzMatches = pandas.DataFrame([row[[mzCol, rtCol, 'Polarity']]])
+        else:
+            mzMatches[rtCol] = row[rtCol]
+            mzMatches['Polarity'] = row['Polarity']
+        for col in extraCols:
+            mzMatches[col] = row[col]
+        frames.append(mzMatches)
+    result = pandas.concat(frames, ignore_index=True)
+    return result[list(matches) + extraCols]
+
+
+def check_assemble_results(tmpDir):
+    # type: (str) -> None
+    """Check MSSearch's result assembly against the row-by-row join,
+    with m/z values found at several retention times, both polarities
+    and rows without matches.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    rng = numpy.random.RandomState(0)
+    mzCol = 'mzmed'
+    rtCol = 'rtmed'
+    summary = synthetic.generate_summary_dataset(120, numSamples=2)
+    # Repeat some m/z values at other retention times and polarities
+    repeated = summary.sample(40, random_state=rng)
+    repeated[rtCol] += 1.5
+    data = pandas.concat([summary, repeated], ignore_index=True)
+    data['Polarity'] = rng.choice(['Negative', 'Positive', ''], len(data))
+    rows = []
+    for mz in rng.choice(data[mzCol].unique(), 80, replace=False):
+        for _ in range(rng.randint(1, 5)):
+            rows.append([mz, mz + rng.normal(0, 0.002), rng.uniform(0, 5),
+                         0.0, '', 'PC {0}:0'.format(rng.randint(10, 40)),
+                         'C10H20O8P', rng.choice(ADDUCTS),
+                         'Glycerophosphocholines [GP01]',
+                         'Glycerophospholipids [GP]'])
+    matches = pandas.DataFrame(
+            rows, columns=[mzCol, 'Matched MZ', 'Delta_PPM', rtCol,
+                           'Polarity', 'Bulk Structure', 'Formula', 'Adduct',
+                           'Main Class', 'Category'])
+    extraCols = [x for x in data.columns
+                 if x not in [mzCol, rtCol, 'Polarity']]
+    expected = _reference_assembly(data, matches, mzCol, rtCol, extraCols)
+    new = MSSearch._assemble_results(data, matches, mzCol, rtCol, extraCols)
+    _expect_same_frame(expected, new, "Assembled results")
+
+
+def check_output_writer(tmpDir):
+    # type: (str) -> None
+    """Check that OutputWriter writes the same CSV file as pandas when
+    the table is written in chunks, and starts a new XLSX sheet every
+    time the current one reaches the maximum number of rows.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    data = synthetic.generate_summary_dataset(23, numSamples=2)
+    data['Category'] = None
+    data.loc[::3, 'Category'] = 'Glycerolipids [GL]'
+    csvPath = os.path.join(tmpDir, 'output.csv')
+    with Writer.OutputWriter(csvPath, 'csv', list(data)) as writer:
+        for start in range(0, len(data), 5):
+            writer.write(data.iloc[start : start + 5])
+    with open(csvPath, 'r') as csvFile:
+        _expect(csvFile.read() == data.to_csv(index=False),
+                "Chunked CSV file differs")
+    # Sheets of 10 rows (header included)
+    maxRows = Writer.MAX_XLSX_ROWS
+    Writer.MAX_XLSX_ROWS = 10
+    try:
+        xlsxPath = os.path.join(tmpDir, 'output.xlsx')
+        with Writer.OutputWriter(xlsxPath, 'xlsx', list(data)) as writer:
+            for start in range(0, len(data), 4):
+                writer.write(data.iloc[start : start + 4])
+    finally:
+        Writer.MAX_XLSX_ROWS = maxRows
+    with zipfile.ZipFile(xlsxPath) as xlsxFile:
+        sheets = sorted(x for x in xlsxFile.namelist()
+                        if x.startswith('xl/worksheets/sheet'))
+        numRows = [xlsxFile.read(x).decode('utf-8').count('<row ')
+                   for x in sheets]
+    _expect(numRows == [10, 10, 6],
+            "XLSX sheets have {0} rows instead of [10, 10, 6]".format(numRows))
+    if (Writer.pyarrow is not None):
+        # A column without values in the first batch keeps its type
+        parquetPath = os.path.join(tmpDir, 'output.parquet')
+        data['Category'] = data['Category'].where(data.index >= 5)
+        with Writer.OutputWriter(parquetPath, 'parquet', list(data),
+                                 data) as writer:
+            for start in range(0, len(data), 5):
+                writer.write(data.iloc[start : start + 5])
+        _expect_same_frame(data, pandas.read_parquet(parquetPath),
+                           "Parquet file")
+
+
+def _reference_summary(data, mzCol, rtCol):
+    # type: (pandas.DataFrame, str, str) -> pandas.DataFrame
+    """Return the summary of 'data' computed group by group, as the
+    original implementation did.
+
+    Keyword Arguments:
+        data  -- MSSearch result dataframe
+        mzCol -- m/z column name
+        rtCol -- retention time column name
+    """
+    frames = []
+    for _, group in data.groupby([mzCol, rtCol]):
+        categories = group['Category'].value_counts()
+        if (categories.empty):
+            frames.append(group)
+            continue
+        bestCategory = categories.index[0]
+        subgroup = group[group['Category'] == bestCategory]
+        if (bestCategory == 'other metabolites'):
+            if ((len(categories) == 1)
+                or (categories.iloc[0] > categories.iloc[1])):
+                frames.append(subgroup.head(1))
+                continue
+            bestCategory = categories.index[1]
+            subgroup = group[group['Category'] == bestCategory]
+        mainClass = subgroup['Main Class'].value_counts().index[0]
+        frames.append(subgroup[subgroup['Main Class'] == mainClass].head(1))
+    return pandas.concat(frames, ignore_index=True)
+
+
+def check_summary(tmpDir):
+    # type: (str) -> None
+    """Check MSSearch's summary against the per-group selection on
+    random results with ties between categories and main classes, the
+    "other metabolites" category and unmatched rows.
+
+    Keyword Arguments:
+        tmpDir -- temporary directory
+    """
+    rng = numpy.random.RandomState(0)
+    parameters = {'mzCol': 'mz', 'rtCol': 'rt', 'database': 'ALL_LMSD',
+                  'outputFormat': 'csv'}
+    categories = numpy.array(['other metabolites', 'Glycerolipids [GL]',
+                              'Sterol Lipids [ST]', 'Fatty Acyls [FA]', None],
+                             dtype=object)
+    mainClasses = numpy.array(['A', 'B', 'C'], dtype=object)
+    for iteration in range(50):
+        numRows = rng.randint(1, 80)
+        data = pandas.DataFrame(
+                {'mz': rng.randint(0, 8, numRows).astype(float),
+                 'rt': rng.randint(0, 3, numRows).astype(float),
+                 'Category': categories[rng.choice(
+                         len(categories), numRows,
+                         p=[0.35, 0.2, 0.15, 0.1, 0.2])],
+                 'Main Class': mainClasses[rng.randint(0, 3, numRows)],
+                 'Value': rng.rand(numRows)},
+                columns=['mz', 'rt', 'Category', 'Main Class', 'Value'])
+        # Only specialized categories have a main class
+        noClass = data['Category'].isna() \
+                  | (data['Category'] == 'other metabolites')
+        data.loc[noClass, 'Main Class'] = None
+        Summary.create_summary(data, parameters, tmpDir)
+        new = pandas.read_csv(os.path.join(tmpDir,
+                                           'mssearch_all_lmsd_summary.csv'))
+        _expect_same_frame(_reference_summary(data, 'mz', 'rt'), new,
+                           "Summary (iteration {0})".format(iteration))
+
+
+# Available checks, in the order they are run
+CHECKS = OrderedDict([('checkpoints', check_checkpoints),
+                      ('fingerprints', check_fingerprints),
+                      ('sweep-tree', check_sweep_tree),
+                      ('engines', check_engines),
+                      ('amalgamator', check_amalgamator),
+                      ('local-search', check_local_search),
+                      ('assemble-results', check_assemble_results),
+                      ('output-writer', check_output_writer),
+                      ('summary', check_summary)])
+
+
+def run_checks(names=None):
+    # type: (list) -> bool
+    """Run the given checks, print the outcome of each one and return
+    True if all of them pass, False otherwise.
+
+    Keyword Arguments:
+        names -- list of check names [default: all]
+    """
+    allPass = True
+    for name in (names if (names) else CHECKS.keys()):
+        tmpDir = tempfile.mkdtemp(prefix='lf_check_')
+        try:
+            CHECKS[name](tmpDir)
+            print("{0}: OK".format(name))
+        except Exception:
+            allPass = False
+            print("{0}: FAILED".format(name))
+            print(traceback.format_exc())
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+    return allPass
+
+
+def main():
+    # Create the argument parser and parse the arguments
+    parser = argparse.ArgumentParser(
+            description="Focused regression checks of LipidFinder.")
+    parser.add_argument('checks', metavar='CHECK', nargs='*',
+                        help=("checks to run, from: {0} [default: all]"
+                              ).format(', '.join(CHECKS.keys())))
+    args = parser.parse_args()
+    unknown = [x for x in args.checks if x not in CHECKS]
+    if (unknown):
+        parser.error("unknown check(s): {0}".format(', '.join(unknown)))
+    if (not run_checks(args.checks)):
+        raise SystemExit(1)
+
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Golden-output regression harness for PeakFilter: record the
+canonical outputs of the test datasets and compare new implementations
+against them, stage by stage:
+    > record_golden():
+        Run PeakFilter on the test datasets and store the processed
+        data, summary and removal ledger (and, optionally, the
+        intermediate CSV file of every stage) as the golden outputs.
+
+    > compare_golden():
+        Run PeakFilter on the test datasets and compare every output
+        with the golden ones, reporting the first stage that diverges.
+
+    > compare_frames():
+        Return the differences between two dataframes within the
+        numeric tolerances configured for each column.
+
+Each dataset is processed with its shipped parameters JSON file
+(tests/<XCMS|SIEVE>/params_peakfilter_<polarity>.json), with the False
+Discovery Rate disabled since it does not modify the data and requires
+network access. The golden outputs are stored as gzip-compressed CSV
+files in tests/golden/<dataset>_<polarity>/. The intermediate CSV files
+are only stored on request, as they take much more space.
+
+Numeric columns are compared with numpy.isclose() using the relative
+and absolute tolerances configured for each column; the rest must be
+equal. The tolerances are read from a JSON file with the layout:
+    {"default": {"rtol": 0, "atol": 0},
+     "columns": {"*_mean": {"rtol": 1e-9}, "mzmed": {"atol": 1e-6}}}
+where column names can be shell-style wildcards (the first match wins).
+By default, the tolerances in "tolerances.json" in the golden outputs
+folder are used.
+
+Examples:
+    python -m benchmarks.golden record --steps
+    python -m benchmarks.golden compare --tolerances tolerances.json
+"""
+
+import argparse
+from collections import OrderedDict
+from contextlib import redirect_stdout
+import fnmatch
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+import pandas
+
+from LipidFinder import PeakFilter
+from LipidFinder.Configuration import LFParameters
+from LipidFinder.LFDataFrame import LFDataFrame
+
+
+# Folder with the test datasets
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'tests')
+# Default folder of the golden outputs
+GOLDEN_DIR = os.path.join(TESTS_DIR, 'golden')
+# (folder, file prefix) of each test dataset
+DATASETS = OrderedDict([('XCMS', 'xcms'), ('SIEVE', 'sieve')])
+POLARITIES = ['negative', 'positive']
+# Tolerances used when none are configured: exact match
+DEFAULT_TOLERANCES = {'default': {'rtol': 0.0, 'atol': 0.0}, 'columns': {}}
+
+
+def get_datasets(names=None):
+    # type: (list) -> list
+    """Return the list of (name, data path, parameters path) tuples of
+    the test datasets, where each name is "<dataset>_<polarity>".
+
+    Keyword Arguments:
+        names -- list of names to keep [default: all]
+    """
+    datasets = []
+    for folder, prefix in DATASETS.items():
+        for polarity in POLARITIES:
+            name = '{0}_{1}'.format(folder, polarity)
+            if (names and (name not in names)):
+                continue
+            datasets.append((name, os.path.join(
+                    TESTS_DIR, folder, '{0}_{1}.csv'.format(prefix, polarity)),
+                             os.path.join(TESTS_DIR, folder,
+                                          'params_peakfilter_{0}.json'.format(
+                                                  polarity))))
+    return datasets
+
+
+def run_peak_filter(dataPath, paramsPath, dst):
+    # type: (str, str, str) -> list
+    """Run PeakFilter on the given dataset with the intermediate CSV
+    files enabled and the False Discovery Rate disabled, and return the
+    list of step labels (one per intermediate CSV file).
+
+    Keyword Arguments:
+        dataPath   -- dataset file path
+        paramsPath -- parameters JSON file path
+        dst        -- output directory
+    """
+    parameters = LFParameters(module='peakfilter', src=paramsPath)
+    parameters['calculateFDR'] = False
+    data = LFDataFrame(dataPath, parameters)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        PeakFilter.peak_filter(data, parameters, dst, verbose=True)
+    return parameters.get_stages()
+
+
+def _output_files(polarity):
+    # type: (str) -> list
+    """Return the list of output file names of PeakFilter for the given
+    polarity.
+
+    Keyword Arguments:
+        polarity -- "negative" or "positive"
+    """
+    return ['peakfilter_{0}{1}.csv'.format(polarity, suffix)
+            for suffix in ['', '_summary', '_removed']]
+
+
+def _step_files(steps):
+    # type: (list) -> list
+    """Return the list of (step label, intermediate CSV file name)
+    pairs for the given step labels.
+
+    Keyword Arguments:
+        steps -- list of step labels
+    """
+    return [(label, os.path.join('step_by_step',
+                                 'peakfilter_step_{:02d}.csv'.format(num)))
+            for num, label in enumerate(steps, start=1)]
+
+
+def record_golden(dst=GOLDEN_DIR, names=None, steps=False):
+    # type: (str, list, bool) -> None
+    """Run PeakFilter on the test datasets and store the outputs as the
+    golden ones in 'dst', overwriting any previous version.
+
+    Keyword Arguments:
+        dst   -- golden outputs directory [default: tests/golden]
+        names -- list of "<dataset>_<polarity>" names to record
+                 [default: all]
+        steps -- also store the intermediate CSV file of every stage?
+                 [default: False]
+    """
+    for name, dataPath, paramsPath in get_datasets(names):
+        polarity = name.split('_')[1]
+        tmpDir = tempfile.mkdtemp(prefix='lf_golden_')
+        try:
+            stepLabels = run_peak_filter(dataPath, paramsPath, tmpDir)
+            goldenDir = os.path.join(dst, name)
+            if (os.path.isdir(goldenDir)):
+                shutil.rmtree(goldenDir)
+            os.makedirs(os.path.join(goldenDir, 'step_by_step'))
+            fileNames = _output_files(polarity)
+            if (steps):
+                fileNames += [x for _, x in _step_files(stepLabels)]
+            for fileName in fileNames:
+                _gzip_csv(os.path.join(tmpDir, fileName),
+                          os.path.join(goldenDir, fileName + '.gz'))
+            if (not steps):
+                os.rmdir(os.path.join(goldenDir, 'step_by_step'))
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+        print("{0}: golden outputs recorded".format(name))
+
+
+def compare_golden(src=GOLDEN_DIR, names=None, tolerances=None):
+    # type: (str, list, dict) -> bool
+    """Run PeakFilter on the test datasets and compare every output
+    with the golden ones stored in 'src'. Print a report of the
+    differences and return True if every output matches, False
+    otherwise.
+
+    If the golden intermediate CSV files are available, every stage is
+    compared too, and the first one whose output diverges is reported.
+
+    Keyword Arguments:
+        src        -- golden outputs directory [default: tests/golden]
+        names      -- list of "<dataset>_<polarity>" names to compare
+                      [default: all]
+        tolerances -- dictionary of numeric tolerances per column
+                      [default: "tolerances.json" in 'src' if it
+                      exists, exact match otherwise]
+    """
+    if (tolerances is None):
+        tolPath = os.path.join(src, 'tolerances.json')
+        if (os.path.isfile(tolPath)):
+            with open(tolPath, 'r') as tolFile:
+                tolerances = json.load(tolFile, object_pairs_hook=OrderedDict)
+    allMatch = True
+    for name, dataPath, paramsPath in get_datasets(names):
+        goldenDir = os.path.join(src, name)
+        if (not os.path.isdir(goldenDir)):
+            print("{0}: no golden outputs found in '{1}'".format(name, src))
+            allMatch = False
+            continue
+        polarity = name.split('_')[1]
+        tmpDir = tempfile.mkdtemp(prefix='lf_golden_')
+        try:
+            stepLabels = run_peak_filter(dataPath, paramsPath, tmpDir)
+            # Intermediate CSV files first, in stage order, so the first
+            # stage that diverges is reported
+            targets = [(label, x) for label, x in _step_files(stepLabels)
+                       if os.path.isfile(os.path.join(goldenDir, x + '.gz'))]
+            targets += [('Output', x) for x in _output_files(polarity)]
+            firstStage = None
+            for label, fileName in targets:
+                golden = pandas.read_csv(os.path.join(goldenDir,
+                                                      fileName + '.gz'))
+                new = pandas.read_csv(os.path.join(tmpDir, fileName))
+                differences = compare_frames(golden, new, tolerances)
+                if (differences):
+                    allMatch = False
+                    if (firstStage is None):
+                        firstStage = label
+                    print("{0}: {1} ({2}) differs:".format(name, fileName,
+                                                          label))
+                    for line in differences:
+                        print("    " + line)
+            if (firstStage is None):
+                print("{0}: OK".format(name))
+            else:
+                print("{0}: first divergence at stage '{1}'".format(
+                        name, firstStage))
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+    return allMatch
+
+
+def compare_frames(golden, new, tolerances=None, maxExamples=3):
+    # type: (pandas.DataFrame, pandas.DataFrame, dict, int) -> list
+    """Return a list of messages describing the differences between
+    'golden' and 'new' (empty if they match within the tolerances).
+
+    Keyword Arguments:
+        golden      -- reference dataframe
+        new         -- dataframe to validate
+        tolerances  -- dictionary of numeric tolerances per column
+                       [default: exact match]
+        maxExamples -- maximum number of differing row IDs reported
+                       per column [default: 3]
+    """
+    if (tolerances is None):
+        tolerances = DEFAULT_TOLERANCES
+    differences = []
+    if (list(golden.columns) != list(new.columns)):
+        missing = [x for x in golden.columns if x not in new.columns]
+        extra = [x for x in new.columns if x not in golden.columns]
+        differences.append("columns differ (missing: {0}; extra: {1})".format(
+                missing, extra))
+    if (len(golden.index) != len(new.index)):
+        differences.append("number of rows differs: {0} vs {1}".format(
+                len(golden.index), len(new.index)))
+        return differences
+    idCol = golden.columns[0]
+    for column in [x for x in golden.columns if x in new.columns]:
+        expected = golden[column].values
+        actual = new[column].values
+        if ((golden[column].dtype.kind in 'biuf')
+            and (new[column].dtype.kind in 'biuf')):
+            rtol, atol = get_tolerance(column, tolerances)
+            mismatch = ~numpy.isclose(actual.astype(float),
+                                      expected.astype(float), rtol=rtol,
+                                      atol=atol, equal_nan=True)
+            maxDiff = numpy.nanmax(numpy.abs(
+                    actual[mismatch].astype(float)
+                    - expected[mismatch].astype(float))) \
+                      if mismatch.any() else 0
+        else:
+            mismatch = golden[column].fillna('').astype(str).values \
+                       != new[column].fillna('').astype(str).values
+            maxDiff = None
+        numMismatches = mismatch.sum()
+        if (numMismatches > 0):
+            ids = golden[idCol].values[mismatch][ : maxExamples]
+            message = "{0}: {1} rows differ".format(column, numMismatches)
+            if (maxDiff is not None):
+                message += " (max. abs. difference {0:g})".format(maxDiff)
+            message += ", e.g. {0} {1}".format(idCol, ', '.join(map(str, ids)))
+            differences.append(message)
+    return differences
+
+
+def get_tolerance(column, tolerances):
+    # type: (str, dict) -> tuple
+    """Return the (relative, absolute) tolerance configured for the
+    given column.
+
+    Keyword Arguments:
+        column     -- column name
+        tolerances -- dictionary of numeric tolerances per column
+    """
+    default = tolerances.get('default', {})
+    for pattern, values in tolerances.get('columns', {}).items():
+        if (fnmatch.fnmatchcase(column, pattern)):
+            return (values.get('rtol', default.get('rtol', 0.0)),
+                    values.get('atol', default.get('atol', 0.0)))
+    return (default.get('rtol', 0.0), default.get('atol', 0.0))
+
+
+def _gzip_csv(src, dst):
+    # type: (str, str) -> None
+    """Copy the CSV file 'src' into the gzip-compressed file 'dst'
+    without modifying its content.
+
+    Keyword Arguments:
+        src -- CSV file path
+        dst -- gzip file path
+    """
+    with open(src, 'rb') as srcFile:
+        with gzip.GzipFile(dst, 'wb', mtime=0) as dstFile:
+            shutil.copyfileobj(srcFile, dstFile)
+
+
+def main():
+    # Create the argument parser and parse the arguments
+    parser = argparse.ArgumentParser(
+            description="PeakFilter golden-output regression harness.")
+    parser.add_argument('action', choices=['record', 'compare'],
+                        help="record the golden outputs or compare with them")
+    parser.add_argument('-d', '--datasets', metavar='NAME', nargs='+',
+                        choices=[x[0] for x in get_datasets()],
+                        help="datasets to process [default: all]")
+    parser.add_argument('-g', '--golden', metavar='DIR', type=str,
+                        default=GOLDEN_DIR, help="golden outputs folder")
+    parser.add_argument('--steps', action='store_true',
+                        help="also record the output of every stage")
+    parser.add_argument('-t', '--tolerances', metavar='FILE', type=str,
+                        help=("JSON file with the numeric tolerances per "
+                              "column [default: GOLDEN/tolerances.json]"))
+    args = parser.parse_args()
+    if (args.action == 'record'):
+        record_golden(args.golden, args.datasets, args.steps)
+    else:
+        tolerances = None
+        if (args.tolerances):
+            with open(args.tolerances, 'r') as tolFile:
+                tolerances = json.load(tolFile, object_pairs_hook=OrderedDict)
+        if (not compare_golden(args.golden, args.datasets, tolerances)):
+            raise SystemExit(1)
+
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,192 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Local mock of the LIPID MAPS bulk search service used by MSSearch and
+the False Discovery Rate, so both can be benchmarked without network
+access or load on the real server:
+    > MockLipidMaps:
+        Threaded HTTP server answering bulk search requests with
+        deterministic matches.
+
+The matches of each m/z depend only on the m/z, the database and the
+adducts requested, so repeated runs get the same answers. The decoy
+databases (names ending in "_5") return fewer matches than the target
+ones. An optional latency per request simulates the network round trip.
+
+Examples:
+    >>> from benchmarks.mock_lipidmaps import MockLipidMaps
+    >>> with MockLipidMaps(latency=0.2) as server:
+    ...     MSSearch.LIPIDMAPS_URL = server.url
+    ...     MSSearch.bulk_structure_search(data, parameters)
+"""
+
+import email.parser
+import hashlib
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import threading
+import time
+
+
+# Columns of the bulk search response
+COLUMNS = ['Input Mass', 'Matched MZ', 'Delta', 'Bulk Structure', 'Formula',
+           'Adduct', 'Main Class', 'Category']
+# (Category, Main Class, Bulk Structure prefix) of the mock lipids
+LIPIDS = [('Glycerophospholipids', 'Glycerophosphocholines [GP01]', 'PC'),
+          ('Glycerophospholipids', 'Glycerophosphoethanolamines [GP02]', 'PE'),
+          ('Glycerolipids', 'Triradylglycerols [GL03]', 'TG'),
+          ('Sphingolipids', 'Ceramides [SP02]', 'Cer'),
+          ('Fatty Acyls', 'Fatty Acids and Conjugates [FA01]', 'FA'),
+          ('Sterol Lipids', 'Sterols [ST01]', 'ST'),
+          ('Prenol Lipids', 'Isoprenoids [PR01]', 'PR')]
+# Adducts used when the request does not list any
+DEFAULT_ADDUCTS = ['M-H', 'M+H']
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a new thread."""
+    daemon_threads = True
+
+
+class _BulkSearchHandler(BaseHTTPRequestHandler):
+    """Answer LIPID MAPS bulk search requests with mock matches."""
+
+    def do_POST(self):
+        # type: () -> None
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        fields = _parse_multipart(self.headers['Content-Type'], body)
+        if (self.server.latency > 0):
+            time.sleep(self.server.latency)
+        self.server.numRequests += 1
+        response = _get_matches(fields).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output clean
+        pass
+
+
+class MockLipidMaps(object):
+    """A MockLipidMaps object runs a local LIPID MAPS bulk search server
+    in a background thread.
+
+    Attributes:
+        url  (Public[str])
+            URL of the bulk search service.
+        _server  (Private[HTTPServer])
+            HTTP server instance.
+        _thread  (Private[threading.Thread])
+            Thread serving the requests.
+    """
+
+    def __init__(self, latency=0.0, port=0):
+        # type: (float, int) -> MockLipidMaps
+        """Constructor of the class MockLipidMaps.
+
+        Keyword Arguments:
+            latency -- seconds to wait before answering each request
+                       [default: 0.0]
+            port    -- port to listen on [default: any free port]
+        """
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port),
+                                            _BulkSearchHandler)
+        self._server.latency = latency
+        self._server.numRequests = 0
+        self.url = 'http://127.0.0.1:{0}/tools/ms/py_bulk_search.php'.format(
+                self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def numRequests(self):
+        # type: () -> int
+        """Number of requests answered so far."""
+        return self._server.numRequests
+
+    def __enter__(self):
+        # type: () -> MockLipidMaps
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # type: (type, Exception, traceback) -> bool
+        self.close()
+        return False
+
+    def close(self):
+        # type: () -> None
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def _parse_multipart(contentType, body):
+    # type: (str, bytes) -> dict
+    """Return a dictionary with the fields of a multipart/form-data
+    request body.
+
+    Keyword Arguments:
+        contentType -- value of the "Content-Type" header
+        body        -- request body
+    """
+    message = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + contentType.encode('latin-1') + b'\r\n\r\n'
+            + body)
+    fields = {}
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        fields[name] = part.get_payload(decode=True).decode('utf-8')
+    return fields
+
+
+def _get_matches(fields):
+    # type: (dict) -> str
+    """Return the tab-separated table of mock matches for the m/z values
+    of the request.
+
+    Keyword Arguments:
+        fields -- request fields
+    """
+    database = fields.get('CHOICE', 'COMP_DB')
+    tolerance = float(fields.get('tol', '0.001'))
+    adducts = [x for x in fields.get('ion', '').split(',') if x] \
+              or DEFAULT_ADDUCTS
+    # Decoy databases get roughly a tenth of the matches
+    modulo = 20 if (database.endswith('_5')) else 2
+    rows = []
+    for line in fields.get('file', '').splitlines():
+        line = line.strip()
+        if (not line):
+            continue
+        mz = float(line)
+        for adduct in adducts:
+            digest = hashlib.md5('{0}|{1}|{2:.4f}'.format(
+                    database, adduct, mz).encode('utf-8')).digest()
+            if ((digest[0] % modulo) != 0):
+                continue
+            category, mainClass, prefix = LIPIDS[digest[1] % len(LIPIDS)]
+            delta = tolerance * ((digest[2] / 255.0) - 0.5)
+            sign = '+' if (adduct.startswith('M+')) else '-'
+            rows.append([line, '{0:.4f}'.format(mz + delta),
+                         '{0:.4f}'.format(abs(delta)),
+                         '{0} {1}:{2}'.format(prefix, 20 + digest[3] % 30,
+                                              digest[4] % 7),
+                         'C{0}H{1}NO8P'.format(30 + digest[3] % 20,
+                                               60 + digest[4] % 30),
+                         '[{0}]{1}'.format(adduct, sign), mainClass,
+                         category])
+    if (not rows):
+        return ''
+    return '\n'.join(['\t'.join(COLUMNS)]
+                     + ['\t'.join(row) for row in rows]) + '\n'
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Run the timed benchmark scenarios over synthetic datasets and save
+the results in a JSON file, optionally comparing them with the results
+of a previous run (e.g. from another commit).
+
+Scenarios:
+    peakfilter-xcms   -- PeakFilter on an XCMS-shaped dataset
+    peakfilter-sieve  -- PeakFilter on a SIEVE-shaped dataset
+    amalgamator       -- Amalgamator on a pair of summary datasets
+    mssearch          -- MSSearch on a summary dataset, against a local
+                         mock of the LIPID MAPS bulk search service
+    mssearch-local    -- MSSearch on a summary dataset, searching a
+                         synthetic structure export offline
+
+Every scenario runs with the profiler enabled, so the results include
+the time of each stage. The time reported for each scenario and stage
+is the minimum over the repetitions.
+
+Examples:
+    python -m benchmarks.run_benchmarks --rows 10000 100000 -o base.json
+    python -m benchmarks.run_benchmarks --rows 10000 100000 -o new.json \
+            --compare base.json
+"""
+
+import argparse
+from collections import OrderedDict
+from contextlib import redirect_stdout
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy
+import pandas
+
+from LipidFinder import Amalgamator
+from LipidFinder import MSSearch
+from LipidFinder import PeakFilter
+from LipidFinder.Configuration import LFParameters
+from LipidFinder.LFDataFrame import LFDataFrame
+from LipidFinder.PeakFilter import FalseDiscoveryRate
+
+from benchmarks import synthetic
+from benchmarks.mock_lipidmaps import MockLipidMaps
+
+
+# Available scenarios
+SCENARIOS = ['peakfilter-xcms', 'peakfilter-sieve', 'amalgamator',
+             'mssearch', 'mssearch-local']
+# Number of structures of the synthetic export of "mssearch-local"
+NUM_STRUCTURES = 100000
+# Relative change above which a time is flagged in the comparison
+THRESHOLD = 0.1
+
+
+def _load_data(dataFrame, paramsDict, module, tmpDir, name):
+    # type: (pandas.DataFrame, dict, str, str, str) -> tuple
+    """Write the dataframe and its parameters in 'tmpDir' and load them
+    back the same way LipidFinder's scripts do. Return the LFParameters
+    and LFDataFrame instances.
+
+    Keyword Arguments:
+        dataFrame  -- synthetic dataframe
+        paramsDict -- dictionary of parameters
+        module     -- LipidFinder's module name
+        tmpDir     -- temporary directory
+        name       -- base name of the files
+    """
+    dataPath = os.path.join(tmpDir, '{0}.csv'.format(name))
+    dataFrame.to_csv(dataPath, index=False)
+    paramsPath = os.path.join(tmpDir, '{0}_params.json'.format(name))
+    with open(paramsPath, 'w') as paramsFile:
+        json.dump(paramsDict, paramsFile, indent=4)
+    parameters = LFParameters(module=module, src=paramsPath)
+    return (parameters, LFDataFrame(dataPath, parameters))
+
+
+def _read_profile(dst, fileName):
+    # type: (str, str) -> tuple
+    """Return the time of each stage stored in the given profile JSON
+    file and the number of rows written by the "Output" stage.
+
+    Keyword Arguments:
+        dst      -- output directory of the run
+        fileName -- profile JSON file name
+    """
+    with open(os.path.join(dst, fileName), 'r') as profileFile:
+        profile = json.load(profileFile, object_pairs_hook=OrderedDict)
+    stages = OrderedDict((x['stage'], x['wallTime'])
+                         for x in profile['stages'])
+    rowsOut = [x['rowsOut'] for x in profile['stages']
+               if (x['stage'] == 'Output')]
+    return (stages, rowsOut[0] if (rowsOut) else None)
+
+
+def run_scenario(scenario, numRows, tmpDir, numSamples=12, latency=0.0):
+    # type: (str, int, str, int, float) -> dict
+    """Run the given scenario once and return a dictionary with its
+    total wall time, the time of each stage and the number of rows of
+    its output.
+
+    Keyword Arguments:
+        scenario   -- scenario name
+        numRows    -- number of rows of the synthetic input
+        tmpDir     -- temporary directory for the input and output files
+        numSamples -- number of samples of the synthetic input
+                      [default: 12]
+        latency    -- latency of the mock LIPID MAPS server (in seconds)
+                      [default: 0.0]
+    """
+    dst = tempfile.mkdtemp(dir=tmpDir)
+    if (scenario.startswith('peakfilter')):
+        kind = scenario.split('-')[1]
+        dataFrame, paramsDict = synthetic.generate_peakfilter_dataset(
+                numRows, kind, numSamples=numSamples)
+        parameters, data = _load_data(dataFrame, paramsDict, 'peakfilter',
+                                      tmpDir, scenario)
+        start = time.perf_counter()
+        PeakFilter.peak_filter(data, parameters, dst, profile=True)
+        wallTime = time.perf_counter() - start
+        stages, rowsOut = _read_profile(dst, 'peakfilter_profile.json')
+    elif (scenario == 'amalgamator'):
+        negFrame, posFrame = synthetic.generate_amalgamator_datasets(
+                numRows, numSamples)
+        paramsDict = {'numSamples': numSamples, 'mzCol': 'mzmed',
+                      'rtCol': 'rtmed', 'firstSampleIndex': 5,
+                      'mzFixedError': 0.0005, 'mzPPMError': 4.0,
+                      'maxRTDiffAdjFrame': 0.3, 'combineIntensities': True}
+        parameters, negData = _load_data(negFrame, paramsDict, 'amalgamator',
+                                         tmpDir, 'amalgamator_negative')
+        posData = _load_data(posFrame, paramsDict, 'amalgamator', tmpDir,
+                             'amalgamator_positive')[1]
+        start = time.perf_counter()
+        Amalgamator.amalgamate_data(negData, posData, parameters, dst,
+                                    profile=True)
+        wallTime = time.perf_counter() - start
+        stages, rowsOut = _read_profile(dst, 'amalgamator_profile.json')
+    elif (scenario == 'mssearch'):
+        dataFrame = synthetic.generate_summary_dataset(numRows,
+                                                       numSamples=numSamples)
+        paramsDict = {'mzCol': 'mzmed', 'rtCol': 'rtmed',
+                      'database': 'ALL_LMSD', 'mzTolerance': 0.005,
+                      'mzToleranceUnit': 'Daltons', 'addAllColumns': True,
+                      'summary': True, 'plotCategories': False,
+                      'figFormat': 'png', 'figColors': 'standard',
+                      # Time every search against the mock server
+                      'useCache': False}
+        parameters, data = _load_data(dataFrame, paramsDict, 'mssearch',
+                                      tmpDir, scenario)
+        with MockLipidMaps(latency) as server:
+            urls = (MSSearch.LIPIDMAPS_URL, FalseDiscoveryRate.LIPIDMAPS_URL)
+            MSSearch.LIPIDMAPS_URL = server.url
+            FalseDiscoveryRate.LIPIDMAPS_URL = server.url
+            try:
+                start = time.perf_counter()
+                MSSearch.bulk_structure_search(data, parameters, dst,
+                                               profile=True)
+                wallTime = time.perf_counter() - start
+            finally:
+                MSSearch.LIPIDMAPS_URL, FalseDiscoveryRate.LIPIDMAPS_URL = urls
+        stages, rowsOut = _read_profile(dst, 'mssearch_profile.json')
+    elif (scenario == 'mssearch-local'):
+        dataFrame = synthetic.generate_summary_dataset(numRows,
+                                                       numSamples=numSamples)
+        structuresPath = os.path.join(tmpDir, 'structures.csv')
+        if (not os.path.isfile(structuresPath)):
+            synthetic.generate_structure_export(NUM_STRUCTURES).to_csv(
+                    structuresPath, index=False)
+        paramsDict = {'mzCol': 'mzmed', 'rtCol': 'rtmed',
+                      'database': 'ALL_LMSD', 'mzTolerance': 0.005,
+                      'mzToleranceUnit': 'Daltons', 'addAllColumns': True,
+                      'summary': True, 'plotCategories': False,
+                      'figFormat': 'png', 'figColors': 'standard',
+                      'localSearch': True, 'structuresCSVPath': structuresPath}
+        parameters, data = _load_data(dataFrame, paramsDict, 'mssearch',
+                                      tmpDir, scenario)
+        start = time.perf_counter()
+        MSSearch.bulk_structure_search(data, parameters, dst, profile=True)
+        wallTime = time.perf_counter() - start
+        stages, rowsOut = _read_profile(dst, 'mssearch_profile.json')
+    else:
+        raise ValueError("Unknown scenario '{0}'".format(scenario))
+    shutil.rmtree(dst, ignore_errors=True)
+    return {'wallTime': wallTime, 'stages': stages, 'rowsOut': rowsOut}
+
+
+def run_benchmarks(scenarios, rowsList, repeat=1, numSamples=12,
+                   latency=0.0):
+    # type: (list, list, int, int, float) -> OrderedDict
+    """Run every scenario at every size and return the results.
+
+    Keyword Arguments:
+        scenarios  -- list of scenario names
+        rowsList   -- list of synthetic input sizes (number of rows)
+        repeat     -- number of repetitions of each run [default: 1]
+        numSamples -- number of samples of the synthetic inputs
+                      [default: 12]
+        latency    -- latency of the mock LIPID MAPS server (in seconds)
+                      [default: 0.0]
+    """
+    results = OrderedDict([('environment', _get_environment()),
+                           ('settings', OrderedDict([
+                                   ('repeat', repeat),
+                                   ('numSamples', numSamples),
+                                   ('latency', latency)])),
+                           ('results', [])])
+    tmpDir = tempfile.mkdtemp(prefix='lf_bench_')
+    try:
+        for scenario in scenarios:
+            for numRows in rowsList:
+                runs = []
+                # Hide the progress bars of the modules
+                with open(os.devnull, 'w') as devnull, \
+                        redirect_stdout(devnull):
+                    for _ in range(repeat):
+                        runs.append(run_scenario(scenario, numRows, tmpDir,
+                                                 numSamples, latency))
+                stages = OrderedDict(
+                        (x, round(min(run['stages'][x] for run in runs), 4))
+                        for x in runs[0]['stages'])
+                wallTimes = [x['wallTime'] for x in runs]
+                result = OrderedDict([
+                        ('scenario', scenario), ('rows', numRows),
+                        ('wallTime', round(min(wallTimes), 4)),
+                        ('wallTimes', [round(x, 4) for x in wallTimes]),
+                        ('rowsOut', runs[0]['rowsOut']),
+                        ('rowsPerSecond', round(numRows / min(wallTimes), 1)),
+                        ('stages', stages)])
+                results['results'].append(result)
+                print("{0:<18} {1:>9} rows  {2:>10.3f} s".format(
+                        scenario, numRows, result['wallTime']))
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    return results
+
+
+def compare_results(results, baseline):
+    # type: (dict, dict) -> list
+    """Return the lines of a table comparing the times of 'results'
+    with the ones of 'baseline'. A ratio above 1 means slower than the
+    baseline.
+
+    Keyword Arguments:
+        results  -- benchmark results
+        baseline -- benchmark results to compare with
+    """
+    baseTimes = {}
+    for result in baseline['results']:
+        key = (result['scenario'], result['rows'])
+        baseTimes[key + ('total', )] = result['wallTime']
+        for stage, wallTime in result['stages'].items():
+            baseTimes[key + (stage, )] = wallTime
+    rowFormat = '{0:<18} {1:>9} {2:<40} {3:>10} {4:>10} {5:>7} {6}'
+    lines = [rowFormat.format('Scenario', 'Rows', 'Stage', 'Base (s)',
+                              'New (s)', 'Ratio', '')]
+    for result in results['results']:
+        key = (result['scenario'], result['rows'])
+        times = [('total', result['wallTime'])] \
+                + list(result['stages'].items())
+        for stage, wallTime in times:
+            baseTime = baseTimes.get(key + (stage, ))
+            if (baseTime is None):
+                continue
+            ratio = wallTime / baseTime if (baseTime > 0) else numpy.nan
+            flag = ''
+            if (ratio > 1 + THRESHOLD):
+                flag = 'slower'
+            elif (ratio < 1 - THRESHOLD):
+                flag = 'faster'
+            lines.append(rowFormat.format(
+                    key[0], key[1], stage, '{0:.3f}'.format(baseTime),
+                    '{0:.3f}'.format(wallTime), '{0:.2f}'.format(ratio),
+                    flag))
+    return lines
+
+
+def _get_environment():
+    # type: () -> OrderedDict
+    """Return the git commit, platform and library versions of the
+    current environment.
+    """
+    try:
+        commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+        commit = commit.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return OrderedDict([('commit', commit),
+                        ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                        ('python', platform.python_version()),
+                        ('platform', platform.platform()),
+                        ('numpy', numpy.__version__),
+                        ('pandas', pandas.__version__)])
+
+
+def main():
+    # Create the argument parser and parse the arguments
+    parser = argparse.ArgumentParser(
+            description="Run LipidFinder's benchmark scenarios.")
+    parser.add_argument('-s', '--scenarios', metavar='NAME', nargs='+',
+                        choices=SCENARIOS, default=SCENARIOS,
+                        help="scenarios to run: {0}".format(
+                                ', '.join(SCENARIOS)))
+    parser.add_argument('--rows', metavar='N', type=int, nargs='+',
+                        default=[10000], help="sizes of the synthetic inputs")
+    parser.add_argument('--samples', metavar='N', type=int, default=12,
+                        help="number of samples of the synthetic inputs")
+    parser.add_argument('--repeat', metavar='N', type=int, default=1,
+                        help="number of repetitions of each run")
+    parser.add_argument('--latency', metavar='SEC', type=float, default=0.0,
+                        help="latency of the mock LIPID MAPS server")
+    parser.add_argument('-o', '--output', metavar='FILE', type=str,
+                        default='benchmark_results.json',
+                        help="results JSON file")
+    parser.add_argument('--compare', metavar='FILE', type=str,
+                        help="results JSON file to compare with")
+    args = parser.parse_args()
+    results = run_benchmarks(args.scenarios, args.rows, args.repeat,
+                             args.samples, args.latency)
+    with open(args.output, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=4)
+    if (args.compare):
+        with open(args.compare, 'r') as baselineFile:
+            baseline = json.load(baselineFile, object_pairs_hook=OrderedDict)
+        print('\n'.join(compare_results(results, baseline)))
+
+if (__name__ == '__main__'):
+    main()
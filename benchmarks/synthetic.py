@@ -0,0 +1,368 @@
+# Copyright (c) 2019 J. Alvarez-Jarreta and C.J. Brasher
+#
+# This file is part of the LipidFinder software tool and governed by the
+# 'MIT License'. Please see the LICENSE file that should have been
+# included as part of this software.
+"""Set of methods aimed to generate reproducible synthetic LC/MS datasets
+with the same layout as the input and output files of LipidFinder:
+    > generate_peakfilter_dataset():
+        Return an XCMS- or SIEVE-shaped PeakFilter input dataframe and
+        its parameters.
+
+    > generate_summary_dataset():
+        Return a dataframe with the layout of a PeakFilter summary file
+        (input of Amalgamator and MSSearch).
+
+    > generate_amalgamator_datasets():
+        Return a pair of negative and positive summary dataframes with a
+        share of features matching between polarities.
+
+    > generate_structure_export():
+        Return a dataframe with the layout of a LIPID MAPS structure
+        export (input of MSSearch local search).
+
+The generated features follow the lipid mass defect trend and include
+isotopes, adducts, lipid stacks and (for SIEVE-shaped data) multi-frame
+peaks at the given densities, so every PeakFilter stage has work to do.
+The same arguments always produce the same dataset.
+
+Examples:
+    >>> from benchmarks import synthetic
+    >>> data, params = synthetic.generate_peakfilter_dataset(100000)
+    >>> synthetic.write_peakfilter_dataset(data, params, 'bench_data')
+
+    The datasets can also be created from the command line:
+        python -m benchmarks.synthetic --kind sieve --rows 100000 -o data
+"""
+
+import argparse
+import json
+import os
+
+import numpy
+import pandas
+
+
+# Folder with the parameters JSON files shipped with the test datasets
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'tests')
+# Difference between C13 and C12 masses
+ISO_OFFSET = 1.003354838
+# m/z offset between the first and second adduct of the pair
+# [M-H]- / [M+Cl]- (negative) and [M+H]+ / [M+Na]+ (positive)
+ADDUCT_OFFSET = {'negative': 35.976678, 'positive': 21.981942}
+# m/z difference between consecutive members of a lipid stack (PEG)
+STACK_OFFSET = 44.0262
+# Number of members of each lipid stack (parent excluded)
+STACK_SIZE = 4
+# Hydrogen (H2) mass, offset between matching negative and positive m/z
+HYDROGEN = 2.01455292
+# (Category, Main Class, Bulk Structure prefix) of the synthetic lipid
+# structures
+LIPID_CLASSES = numpy.array([
+        ('Glycerophospholipids [GP]', 'Glycerophosphocholines [GP01]', 'PC'),
+        ('Glycerophospholipids [GP]', 'Glycerophosphoethanolamines [GP02]',
+         'PE'),
+        ('Glycerolipids [GL]', 'Triradylglycerols [GL03]', 'TG'),
+        ('Sphingolipids [SP]', 'Ceramides [SP02]', 'Cer'),
+        ('Fatty Acyls [FA]', 'Fatty Acids and Conjugates [FA01]', 'FA')],
+        dtype=object)
+
+
+def generate_peakfilter_dataset(numRows, kind='xcms', polarity='negative',
+                                numSamples=12, numTechReps=1, numQCReps=0,
+                                numSolventReps=2, isotopeDensity=0.1,
+                                adductDensity=0.05, stackDensity=0.02,
+                                frameDensity=0.2, seed=0):
+    # type: (int, str, str, int, int, int, int, float, float, float,
+    #        float, int) -> tuple
+    """Return a synthetic PeakFilter input dataframe and the dictionary
+    of PeakFilter parameters to process it.
+
+    The parameters are based on the ones shipped with the test dataset
+    of the same kind and polarity. The False Discovery Rate is disabled.
+
+    Keyword Arguments:
+        numRows        -- number of rows (frames)
+        kind           -- "xcms" or "sieve" layout [default: "xcms"]
+        polarity       -- "negative" or "positive"
+                          [default: "negative"]
+        numSamples     -- number of samples [default: 12]
+        numTechReps    -- number of technical replicates per sample
+                          [default: 1]
+        numQCReps      -- number of quality control replicates
+                          [default: 0]
+        numSolventReps -- number of solvent replicates [default: 2]
+        isotopeDensity -- fraction of rows that are isotopes
+                          [default: 0.1]
+        adductDensity  -- fraction of rows that are adducts
+                          [default: 0.05]
+        stackDensity   -- fraction of rows that are members of lipid
+                          stacks [default: 0.02]
+        frameDensity   -- fraction of rows that are extra frames of
+                          multi-frame peaks (SIEVE only) [default: 0.2]
+        seed           -- random number generator seed [default: 0]
+    """
+    kind = kind.lower()
+    polarity = polarity.lower()
+    rng = numpy.random.RandomState(seed)
+    numIsotopes = int(numRows * isotopeDensity)
+    numAdducts = int(numRows * adductDensity)
+    numStacks = int(numRows * stackDensity / STACK_SIZE)
+    numFrames = int(numRows * frameDensity) if (kind == 'sieve') else 0
+    numBase = numRows - numIsotopes - numAdducts - numStacks * STACK_SIZE \
+              - numFrames
+    if (numBase < 1):
+        raise ValueError("The densities leave no room for parent features")
+    # Parent features: m/z following the lipid mass defect trend and RT
+    # in minutes
+    nominal = rng.randint(200, 1000, numBase)
+    mz = nominal + 0.00112 * nominal + 0.01953 + rng.normal(0, 0.02, numBase)
+    rt = rng.uniform(1.0, 57.5, numBase)
+    intensity = rng.lognormal(11, 1.5, numBase)
+    # Derived features: (m/z, RT, intensity) computed from a parent
+    parts = [(mz, rt, intensity)]
+    parents = rng.randint(0, numBase, numIsotopes)
+    numC = numpy.round(mz[parents] / 12)
+    parts.append((mz[parents] + ISO_OFFSET, rt[parents],
+                  intensity[parents] * (numC ** 1.3) * 0.002))
+    parents = rng.randint(0, numBase, numAdducts)
+    parts.append((mz[parents] + ADDUCT_OFFSET[polarity], rt[parents],
+                  intensity[parents] * 0.3))
+    parents = rng.randint(0, numBase, numStacks)
+    for member in range(1, STACK_SIZE + 1):
+        parts.append((mz[parents] + member * STACK_OFFSET, rt[parents],
+                      intensity[parents] * (0.8 ** member)))
+    if (numFrames > 0):
+        parents = rng.randint(0, numBase, numFrames)
+        step = rng.randint(1, 4, numFrames) * rng.choice([-1, 1], numFrames)
+        parts.append((mz[parents] + rng.normal(0, 1e-5, numFrames),
+                      rt[parents] + step * 0.05,
+                      intensity[parents] * (0.5 ** numpy.abs(step))))
+    mz, rt, intensity = [numpy.concatenate(x) for x in zip(*parts)]
+    mz = mz.round(6)
+    # Intensity of every sample replicate, QC replicate and solvent
+    numReps = numSamples * numTechReps
+    numIntenCols = numReps + numQCReps + numSolventReps
+    intensities = intensity[:, numpy.newaxis] \
+                  * rng.lognormal(0, 0.3, (numRows, numIntenCols))
+    # Random missing values in the sample replicates
+    intensities[:, : numReps][rng.rand(numRows, numReps) < 0.2] = 0.0
+    # Solvents are low for most features and similar to the samples for
+    # solvent contaminants
+    solvents = intensities[:, numReps + numQCReps : ]
+    solvents *= numpy.where(rng.rand(numRows, 1) < 0.1, 1.0, 0.01)
+    intensities = intensities.round(4)
+    intenCols = ['S{0:02d}r{1}'.format(i, j)
+                 for i in range(1, numSamples + 1)
+                 for j in range(1, numTechReps + 1)]
+    intenCols += ['QC{0}'.format(i) for i in range(1, numQCReps + 1)]
+    intenCols += ['blank{0}'.format(i) for i in range(1, numSolventReps + 1)]
+    ids = numpy.arange(1, numRows + 1)
+    if (kind == 'xcms'):
+        # XCMS reports the retention time in seconds
+        rtSec = (rt * 60).round(4)
+        data = pandas.DataFrame(
+                {'id': ids,
+                 'name': ['M{0:.0f}T{1:.0f}'.format(x, y)
+                          for x, y in zip(mz, rtSec)],
+                 'fold': rng.lognormal(0, 1, numRows).round(6),
+                 'tstat': rng.normal(0, 5, numRows).round(6),
+                 'pvalue': rng.uniform(0, 1, numRows).round(8),
+                 'mzmed': mz, 'mzmin': mz - 1e-4, 'mzmax': mz + 1e-4,
+                 'rtmed': rtSec, 'rtmin': rtSec - 2, 'rtmax': rtSec + 2,
+                 'npeaks': rng.randint(1, 20, numRows),
+                 'c': rng.randint(0, numSamples, numRows),
+                 'sol': rng.randint(0, numSolventReps + 1, numRows)},
+                columns=['id', 'name', 'fold', 'tstat', 'pvalue', 'mzmed',
+                         'mzmin', 'mzmax', 'rtmed', 'rtmin', 'rtmax',
+                         'npeaks', 'c', 'sol'])
+    else:
+        data = pandas.DataFrame({'id': ids, 'MZ': mz, 'Time': rt.round(6)},
+                                columns=['id', 'MZ', 'Time'])
+    firstSampleIndex = len(data.columns) + 1
+    data = pandas.concat(
+            [data, pandas.DataFrame(intensities, columns=intenCols)], axis=1)
+    if (kind == 'xcms'):
+        data['isotopes'] = ''
+    # Load the parameters of the matching test dataset
+    paramsPath = os.path.join(TESTS_DIR, 'XCMS' if (kind == 'xcms')
+                              else 'SIEVE',
+                              'params_peakfilter_{0}.json'.format(polarity))
+    with open(paramsPath, 'r') as paramsFile:
+        parameters = json.load(paramsFile)
+    parameters.update({'numSamples': numSamples, 'numTechReps': numTechReps,
+                       'numQCReps': numQCReps,
+                       'numSolventReps': numSolventReps,
+                       'firstSampleIndex': firstSampleIndex,
+                       'calculateFDR': False})
+    return (data, parameters)
+
+
+def generate_summary_dataset(numRows, polarity='negative', numSamples=12,
+                             seed=0):
+    # type: (int, str, int, int) -> pandas.DataFrame
+    """Return a synthetic dataframe with the layout of a PeakFilter
+    summary file: id, m/z ("mzmed"), retention time ("rtmed"), polarity
+    and one mean column per sample.
+
+    Keyword Arguments:
+        numRows    -- number of rows
+        polarity   -- "negative" or "positive" [default: "negative"]
+        numSamples -- number of samples [default: 12]
+        seed       -- random number generator seed [default: 0]
+    """
+    rng = numpy.random.RandomState(seed)
+    nominal = rng.randint(200, 1000, numRows)
+    mz = nominal + 0.00112 * nominal + 0.01953 + rng.normal(0, 0.02, numRows)
+    rt = rng.uniform(1.0, 57.5, numRows)
+    return _summary_dataframe(mz, rt, polarity, numSamples, rng)
+
+
+def generate_amalgamator_datasets(numRows, numSamples=12, matchDensity=0.3,
+                                  seed=0):
+    # type: (int, int, float, int) -> tuple
+    """Return a pair of synthetic negative and positive summary
+    dataframes where a share of the positive features are the [M+H]+
+    counterpart of a negative [M-H]- feature.
+
+    Keyword Arguments:
+        numRows      -- number of rows of each dataframe
+        numSamples   -- number of samples [default: 12]
+        matchDensity -- fraction of positive rows matching a negative
+                        one [default: 0.3]
+        seed         -- random number generator seed [default: 0]
+    """
+    rng = numpy.random.RandomState(seed)
+    negData = generate_summary_dataset(numRows, 'negative', numSamples, seed)
+    numMatches = int(numRows * matchDensity)
+    matches = rng.choice(numRows, numMatches, replace=False)
+    mz = negData['mzmed'].values[matches] + HYDROGEN \
+         + rng.normal(0, 1e-4, numMatches)
+    rt = negData['rtmed'].values[matches] + rng.normal(0, 0.05, numMatches)
+    nominal = rng.randint(200, 1000, numRows - numMatches)
+    mz = numpy.concatenate((mz, nominal + 0.00112 * nominal + 0.01953
+                            + rng.normal(0, 0.02, numRows - numMatches)))
+    rt = numpy.concatenate((rt, rng.uniform(1.0, 57.5, numRows - numMatches)))
+    posData = _summary_dataframe(mz, rt, 'positive', numSamples, rng)
+    return (negData, posData)
+
+
+def generate_structure_export(numStructures, seed=0):
+    # type: (int, int) -> pandas.DataFrame
+    """Return a synthetic dataframe with the layout of a LIPID MAPS
+    structure export: bulk structure, formula, exact mass, main class
+    and category of each structure.
+
+    Keyword Arguments:
+        numStructures -- number of structures
+        seed          -- random number generator seed [default: 0]
+    """
+    rng = numpy.random.RandomState(seed)
+    lipids = LIPID_CLASSES[rng.randint(0, len(LIPID_CLASSES), numStructures)]
+    carbons = rng.randint(10, 60, numStructures)
+    bonds = rng.randint(0, 7, numStructures)
+    nominal = rng.randint(200, 1000, numStructures)
+    mass = nominal + 0.00112 * nominal + rng.normal(0, 0.02, numStructures)
+    return pandas.DataFrame(
+            {'Bulk Structure': ['{0} {1}:{2}'.format(x[2], c, b) for x, c, b
+                                in zip(lipids, carbons, bonds)],
+             'Formula': ['C{0}H{1}O8P'.format(c, 2 * c - 2 * b)
+                         for c, b in zip(carbons, bonds)],
+             'Exact Mass': mass.round(4), 'Main Class': lipids[:, 1],
+             'Category': lipids[:, 0]},
+            columns=['Bulk Structure', 'Formula', 'Exact Mass', 'Main Class',
+                     'Category'])
+
+
+def _summary_dataframe(mz, rt, polarity, numSamples, rng):
+    # type: (numpy.ndarray, numpy.ndarray, str, int, RandomState)
+    #       -> pandas.DataFrame
+    """Return a summary dataframe sorted by m/z and RT for the given
+    m/z and RT values, with random sample means.
+
+    Keyword Arguments:
+        mz         -- array of m/z values
+        rt         -- array of retention times
+        polarity   -- "negative" or "positive"
+        numSamples -- number of samples
+        rng        -- random number generator
+    """
+    numRows = len(mz)
+    means = rng.lognormal(11, 1.5, (numRows, 1)) \
+            * rng.lognormal(0, 0.3, (numRows, numSamples))
+    means[rng.rand(numRows, numSamples) < 0.2] = 0
+    data = pandas.DataFrame({'id': numpy.arange(1, numRows + 1),
+                             'mzmed': mz.round(6), 'rtmed': rt.round(2),
+                             'Polarity': polarity.capitalize()},
+                            columns=['id', 'mzmed', 'rtmed', 'Polarity'])
+    meanCols = ['S{0:02d}_mean'.format(i) for i in range(1, numSamples + 1)]
+    data = pandas.concat([data, pandas.DataFrame(
+            means.round(0).astype(int), columns=meanCols)], axis=1)
+    data.sort_values(['mzmed', 'rtmed'], inplace=True, kind='mergesort')
+    data.reset_index(drop=True, inplace=True)
+    return data
+
+
+def write_peakfilter_dataset(data, parameters, dst, name='dataset'):
+    # type: (pandas.DataFrame, dict, str, str) -> tuple
+    """Write the dataset CSV file and its parameters JSON file in 'dst'
+    and return both paths.
+
+    Keyword Arguments:
+        data       -- synthetic PeakFilter input dataframe
+        parameters -- dictionary of PeakFilter parameters
+        dst        -- destination directory
+        name       -- base name of both files [default: "dataset"]
+    """
+    if (not os.path.isdir(dst)):
+        os.makedirs(dst)
+    dataPath = os.path.join(dst, '{0}.csv'.format(name))
+    data.to_csv(dataPath, index=False)
+    paramsPath = os.path.join(dst, '{0}_params.json'.format(name))
+    with open(paramsPath, 'w') as paramsFile:
+        json.dump(parameters, paramsFile, indent=4)
+    return (dataPath, paramsPath)
+
+
+def main():
+    # Create the argument parser and parse the arguments
+    parser = argparse.ArgumentParser(
+            description="Generate a synthetic PeakFilter input dataset.")
+    parser.add_argument('--kind', choices=['xcms', 'sieve'], default='xcms',
+                        help="pre-processing software layout")
+    parser.add_argument('--polarity', choices=['negative', 'positive'],
+                        default='negative', help="ion polarity")
+    parser.add_argument('--rows', metavar='N', type=int, default=10000,
+                        help="number of rows")
+    parser.add_argument('--samples', metavar='N', type=int, default=12,
+                        help="number of samples")
+    parser.add_argument('--reps', metavar='N', type=int, default=1,
+                        help="number of technical replicates per sample")
+    parser.add_argument('--qc-reps', metavar='N', type=int, default=0,
+                        help="number of quality control replicates")
+    parser.add_argument('--solvent-reps', metavar='N', type=int, default=2,
+                        help="number of solvent replicates")
+    parser.add_argument('--isotopes', metavar='F', type=float, default=0.1,
+                        help="fraction of rows that are isotopes")
+    parser.add_argument('--adducts', metavar='F', type=float, default=0.05,
+                        help="fraction of rows that are adducts")
+    parser.add_argument('--stacks', metavar='F', type=float, default=0.02,
+                        help="fraction of rows that are lipid stack members")
+    parser.add_argument('--frames', metavar='F', type=float, default=0.2,
+                        help="fraction of rows that are extra peak frames")
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help="random number generator seed")
+    parser.add_argument('-o', '--output', metavar='DIR', type=str,
+                        default='', help="destination folder")
+    args = parser.parse_args()
+    data, parameters = generate_peakfilter_dataset(
+            args.rows, args.kind, args.polarity, args.samples, args.reps,
+            args.qc_reps, args.solvent_reps, args.isotopes, args.adducts,
+            args.stacks, args.frames, args.seed)
+    name = '{0}_{1}_{2}'.format(args.kind, args.polarity, args.rows)
+    for path in write_peakfilter_dataset(data, parameters, args.output, name):
+        print(path)
+
+if (__name__ == '__main__'):
+    main()
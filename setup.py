@@ -26,9 +26,8 @@ setuptools.setup(
     url = "https://github.com/ODonnell-Lipidomics/LipidFinder",
     packages = setuptools.find_packages(),
     keywords = 'lipidomics LC/MS profile',
-    python_requires = '>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, <4',
+    python_requires = '>=3.4, <4',
     classifiers = [
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
@@ -49,6 +48,8 @@ setuptools.setup(
         'console_scripts': [
             'config_params.py=LipidFinder.config_params:main',
             'run_peakfilter.py=LipidFinder.run_peakfilter:main',
+            'run_peakfilter_batch.py=LipidFinder.run_peakfilter_batch:main',
+            'run_peakfilter_sweep.py=LipidFinder.run_peakfilter_sweep:main',
             'run_amalgamator.py=LipidFinder.run_amalgamator:main',
             'run_mssearch.py=LipidFinder.run_mssearch:main',
             'update_params.py=LipidFinder.update_params:main',